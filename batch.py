@@ -0,0 +1,162 @@
+"""In this module you can find batch mode compressing or decompressing many files.
+   Neural network is loaded once and files are processed by a pool of worker processes.
+   Input is a directory or a manifest file listing one path per line, relative paths are resolved against manifest location.
+"""
+import json
+import logging
+import os
+import StringIO
+import time
+
+from PIL import Image
+
+import compression
+import neural_network
+import parallel
+import training
+
+
+logger = logging.getLogger('logger')
+
+IMAGE_EXTENSIONS = training.IMAGE_EXTENSIONS
+COMPRESSED_EXTENSIONS = ('.zdp',)
+SUMMARY_NAME = 'summary.json'
+
+
+def compress_batch(source, neural_network_path, output_directory, bits, smoothing=compression.SMOOTHING_NONE, workers=1,
+                   entropy_coding=False, result_cache=None, chroma_bits=None, progressive=()):
+    """Compress every image of source into output_directory, results may be taken from result_cache.
+       Returns summary, which is also saved in output directory.
+    """
+    compression.check_compress_arguments(bits, workers, smoothing, chroma_bits, progressive)
+    network = neural_network.load_encoder(neural_network_path)
+    tasks = get_tasks(source, IMAGE_EXTENSIONS, output_directory, '.zdp')
+    settings = {'network': network, 'bits': bits, 'smoothing': smoothing, 'entropy_coding': entropy_coding, 'chroma_bits': chroma_bits,
+                'progressive': progressive, 'result_cache': result_cache, 'read': _read_image, 'process': _compress}
+    return run_batch(tasks, workers, settings, output_directory)
+
+
+def decompress_batch(source, neural_network_path, output_directory, workers=1, result_cache=None, layer=None):
+    """Decompress every compressed image of source into output_directory, results may be taken from result_cache.
+       Layer selects preview of progressive images, see compression.read_header.
+       Returns summary, which is also saved in output directory.
+    """
+    if workers <= 0:
+        raise compression.ZdpException('Number of workers must be grater than 0')
+    network = neural_network.load_decoder(neural_network_path)
+    tasks = get_tasks(source, COMPRESSED_EXTENSIONS, output_directory, '.bmp')
+    settings = {'network': network, 'layer': layer, 'result_cache': result_cache, 'read': _read_compressed, 'process': _decompress}
+    return run_batch(tasks, workers, settings, output_directory)
+
+
+def get_tasks(source, extensions, output_directory, output_extension):
+    """List (input path, output path) pairs for files of given extensions in source directory or manifest"""
+    if os.path.isdir(source):
+        names = sorted(name for name in os.listdir(source) if os.path.splitext(name)[1].lower() in extensions)
+        paths = [os.path.join(source, name) for name in names]
+    elif os.path.isfile(source):
+        with open(source) as manifest:
+            lines = [line.strip() for line in manifest]
+        paths = [os.path.join(os.path.dirname(source), line) for line in lines if line and not line.startswith('#')]
+    else:
+        raise compression.ZdpException('Batch input must be a directory or a manifest file')
+
+    outputs = [os.path.join(output_directory, os.path.splitext(os.path.basename(path))[0] + output_extension) for path in paths]
+    if len(set(outputs)) != len(outputs):
+        raise compression.ZdpException('Batch input contains files of the same name')
+    return zip(paths, outputs)
+
+
+def run_batch(tasks, workers, settings, output_directory):
+    """Process tasks with read and process functions of settings.
+       Log result of each task and save summary in output directory.
+    """
+    if not os.path.isdir(output_directory):
+        os.makedirs(output_directory)
+
+    start = time.time()
+    if workers == 1:
+        # read following file while current one is being processed
+        fetched = parallel.prefetch(settings['read'], tasks)
+        results = (_run_task(task, settings, data, error) for task, data, error in fetched)
+    else:
+        results = parallel.imap_tasks(_run_pool_task, tasks, workers, {'settings': settings})
+
+    files = []
+    for i, result in enumerate(results):
+        if result['error'] is None:
+            logger.info('[%d/%d] %s -> %s, %d -> %d bytes in %.3fs' % (i + 1, len(tasks), result['input'], result['output'],
+                                                                     result['input_size'], result['output_size'], result['seconds']))
+        else:
+            logger.warning('[%d/%d] %s failed: %s' % (i + 1, len(tasks), result['input'], result['error']))
+        files.append(result)
+
+    succeeded = [result for result in files if result['error'] is None]
+    summary = {
+        'files': len(files),
+        'succeeded': len(succeeded),
+        'failed': len(files) - len(succeeded),
+        'input_bytes': sum(result['input_size'] for result in succeeded),
+        'output_bytes': sum(result['output_size'] for result in succeeded),
+        'cache_hits': sum(1 for result in succeeded if result['cached']),
+        'seconds': time.time() - start,
+        'results': files,
+    }
+    with open(os.path.join(output_directory, SUMMARY_NAME), 'w') as summary_file:
+        json.dump(summary, summary_file, indent=2)
+
+    logger.info('Batch completed: %d of %d files succeeded, %d -> %d bytes in %.3fs' % (
+        summary['succeeded'], summary['files'], summary['input_bytes'], summary['output_bytes'], summary['seconds']))
+    if settings['result_cache'] is not None:
+        logger.info('Result cache hits: %d, misses: %d' % (summary['cache_hits'], summary['succeeded'] - summary['cache_hits']))
+    return summary
+
+
+def _run_pool_task(task):
+    settings = parallel.get_shared('settings')
+    try:
+        data, error = settings['read'](task), None
+    except Exception as exc:
+        data, error = None, exc
+    return _run_task(task, settings, data, error)
+
+
+def _run_task(task, settings, data, error):
+    """Process already read data of the task, returns dictionary describing the result"""
+    input_path, output_path = task
+    result = {'input': input_path, 'output': output_path, 'error': None, 'cached': False}
+    result_cache = settings['result_cache']
+    start = time.time()
+    try:
+        if error is not None:
+            raise error
+        # each process has its own copy of the cache, so its hits are counted around the task
+        hits = result_cache.hits if result_cache is not None else 0
+        settings['process'](data, output_path, settings)
+        result['cached'] = result_cache is not None and result_cache.hits > hits
+        result['input_size'] = os.path.getsize(input_path)
+        result['output_size'] = os.path.getsize(output_path)
+    except Exception as exc:
+        # single damaged file must not stop the whole batch
+        result['error'] = str(exc)
+    result['seconds'] = time.time() - start
+    return result
+
+
+def _read_image(task):
+    return compression.get_pixels(Image.open(task[0]))
+
+
+def _compress(pixels, output_path, settings):
+    compression.compress_pixels(pixels, settings['network'], output_path, settings['bits'], settings['smoothing'],
+                                entropy_coding=settings['entropy_coding'], result_cache=settings['result_cache'],
+                                chroma_bits=settings['chroma_bits'], progressive=settings['progressive'])
+
+
+def _read_compressed(task):
+    with open(task[0], 'rb') as file:
+        return StringIO.StringIO(file.read())
+
+
+def _decompress(file, output_path, settings):
+    compression.decompress_file(file, settings['network'], output_path, result_cache=settings['result_cache'], layer=settings['layer'])
@@ -0,0 +1,56 @@
+"""In this module you can find measures of decompressed image quality and of process memory used by benchmarks."""
+import sys
+
+import numpy
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+SSIM_WINDOW = 7
+
+
+def psnr(original, decompressed):
+    """Peak signal to noise ratio of two arrays of bytes in dB"""
+    mse = numpy.mean((original.astype(numpy.float64) - decompressed) ** 2)
+    return 10 * numpy.log10(255 ** 2 / mse) if mse else float('inf')
+
+
+def ssim(original, decompressed):
+    """Mean structural similarity of luminance of two (height, width, RGB colour) arrays of bytes,
+       statistics are taken from uniform SSIM_WINDOW x SSIM_WINDOW windows
+    """
+    x, y = _luminance(original), _luminance(decompressed)
+    if min(x.shape) < SSIM_WINDOW:
+        return 1.0 if (x == y).all() else 0.0
+    c1, c2 = (0.01 * 255) ** 2, (0.03 * 255) ** 2
+    mean_x, mean_y = _window_mean(x), _window_mean(y)
+    variance_x = _window_mean(x * x) - mean_x ** 2
+    variance_y = _window_mean(y * y) - mean_y ** 2
+    covariance = _window_mean(x * y) - mean_x * mean_y
+    similarity = ((2 * mean_x * mean_y + c1) * (2 * covariance + c2)) / ((mean_x ** 2 + mean_y ** 2 + c1) * (variance_x + variance_y + c2))
+    return float(similarity.mean())
+
+
+def peak_rss():
+    """Peak resident set size of current process in MB, None when it cannot be measured"""
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, OS X bytes
+    return usage / float(1 << 20) if sys.platform == 'darwin' else usage / 1024.0
+
+
+def _luminance(pixels):
+    return numpy.dot(pixels[..., :3].astype(numpy.float64), [0.299, 0.587, 0.114])
+
+
+def _window_mean(values):
+    """Means of all whole windows, computed from summed area table"""
+    table = numpy.zeros((values.shape[0] + 1, values.shape[1] + 1))
+    table[1:, 1:] = values.cumsum(axis=0).cumsum(axis=1)
+    size = SSIM_WINDOW
+    sums = table[size:, size:] - table[:-size, size:] - table[size:, :-size] + table[:-size, :-size]
+    return sums / (size * size)
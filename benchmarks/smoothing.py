@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+"""Compare smoothing modes by quality, size and time of compression.
+   Each image is compressed and decompressed without smoothing, with grid smoothing and with deblocking,
+   results are printed as a table.
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import compression
+import metrics
+import neural_network
+
+
+MODES = (('none', compression.SMOOTHING_NONE), ('grid', compression.SMOOTHING_GRID), ('deblock', compression.SMOOTHING_DEBLOCK))
+
+
+def main():
+    args = parse_arguments()
+    network = neural_network.load(args.network)
+    directory = tempfile.mkdtemp()
+    try:
+        print '%-24s %-8s %4s %10s %8s %10s %12s' % ('image', 'mode', 'bits', 'size', 'PSNR', 'compress', 'decompress')
+        for path in args.images:
+            pixels = compression.get_pixels(Image.open(path))
+            for bits in args.bits:
+                for name, smoothing in MODES:
+                    result = measure(pixels, network, bits, smoothing, os.path.join(directory, 'image.zdp'), args.repeat)
+                    print '%-24s %-8s %4d %10d %8.2f %9.3fs %11.3fs' % ((os.path.basename(path), name, bits) + result)
+    finally:
+        shutil.rmtree(directory)
+
+
+def measure(pixels, network, bits, smoothing, compressed_image_path, repeat):
+    """Returns size of compressed image, PSNR of decompressed image and best compression and decompression times"""
+    compress_time = decompress_time = float('inf')
+    for i in xrange(repeat):
+        start = time.time()
+        compression.compress_pixels(pixels, network, compressed_image_path, bits, smoothing)
+        compress_time = min(compress_time, time.time() - start)
+        start = time.time()
+        decompressed = numpy.array(compression.decompress_region(compressed_image_path, network))
+        decompress_time = min(decompress_time, time.time() - start)
+    return os.path.getsize(compressed_image_path), metrics.psnr(pixels, decompressed), compress_time, decompress_time
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Compare smoothing modes of image compression')
+    parser.add_argument('images', type=str, nargs='+', metavar='PATH', help='images to compress')
+    parser.add_argument('-n', '--network', type=str, metavar='PATH', default='network.mkm',
+                        help='indicates path to neural network (default network.mkm)')
+    parser.add_argument('-b', '--bits', type=int, nargs='+', default=[4], choices=[1, 2, 3, 4, 5, 6, 7, 8],
+                        help='numbers of bits per pixel to compare (default 4)')
+    parser.add_argument('-r', '--repeat', type=int, metavar='NUMBER', default=3,
+                        help='number of runs, the best time is reported (default 3)')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    main()
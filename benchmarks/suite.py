@@ -0,0 +1,308 @@
+#!/usr/bin/env python
+"""Benchmark suite of teaching, compression and decompression.
+   'run' generates synthetic images of several sizes, measures every stage in a fresh process and saves results to JSON.
+   'compare' reads two such files and flags results of the second one which are worse than the baseline.
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import compression
+import entropy
+import kernels
+import metrics
+import synthetic
+
+
+MODES = (('none', compression.SMOOTHING_NONE), ('grid', compression.SMOOTHING_GRID), ('deblock', compression.SMOOTHING_DEBLOCK))
+# compared values, whether lower is better and whether tolerance is relative, otherwise absolute
+COMPARED = (
+    ('seconds', True, True),
+    ('peak_rss_mb', True, True),
+    ('size', True, True),
+    ('psnr', False, False),
+    ('ssim', False, False),
+)
+SIZE_TOLERANCE = 0.5
+# smaller changes of time are taken for noise
+TIME_RESOLUTION = 0.005
+PSNR_TOLERANCE = 0.05
+SSIM_TOLERANCE = 0.002
+
+
+def main():
+    args = parse_arguments()
+    logging.getLogger('logger').addHandler(logging.NullHandler())
+    exit(globals()['do_' + args.command](args))
+
+
+def do_run(args):
+    directory = tempfile.mkdtemp()
+    try:
+        images = []
+        for width, height in args.sizes:
+            path = os.path.join(directory, '%dx%d.bmp' % (width, height))
+            synthetic.save_image(path, width, height, args.seed)
+            images.append(path)
+
+        results = []
+        network_path = args.network
+        if network_path is None:
+            # network is taught on the smallest image and used for all others
+            network_path = os.path.join(directory, 'network.mkm')
+            results.append(run_isolated(measure_teach, network_path, images[0], args.samples, args.rate, args.hidden, args.batch,
+                                        args.block, args.encoder, args.seed, args.repeat))
+            print_result(results[-1])
+
+        compressed_image_path = os.path.join(directory, 'image.zdp')
+        decompressed_image_path = os.path.join(directory, 'image.bmp')
+        for path in images:
+            for bits in args.bits:
+                for name, smoothing in MODES:
+                    for entropy_coding, chroma_bits in get_codings(args, smoothing):
+                        settings = {'image': os.path.splitext(os.path.basename(path))[0], 'bits': bits, 'smoothing': name,
+                                    'entropy_coding': entropy_coding, 'chroma_bits': chroma_bits}
+                        results.append(run_isolated(measure_compress, settings, path, network_path, compressed_image_path, smoothing,
+                                                    args.workers, args.repeat))
+                        print_result(results[-1])
+                        results.append(run_isolated(measure_decompress, settings, path, network_path, compressed_image_path,
+                                                    decompressed_image_path, args.workers, args.repeat))
+                        print_result(results[-1])
+                if args.entropy:
+                    settings = {'image': os.path.splitext(os.path.basename(path))[0], 'bits': bits, 'smoothing': 'none',
+                                'entropy_coding': True}
+                    results.extend(run_isolated(measure_entropy, settings, path, network_path, compressed_image_path, args.repeat))
+                    print_result(results[-2])
+                    print_result(results[-1])
+    finally:
+        shutil.rmtree(directory)
+
+    report = {'environment': get_environment(), 'settings': vars(args), 'results': results}
+    with open(args.output, 'w') as output:
+        json.dump(report, output, indent=2, sort_keys=True)
+    print 'Results saved to ' + args.output
+    return 0
+
+
+def do_compare(args):
+    with open(args.baseline) as baseline_file, open(args.current) as current_file:
+        baseline, current = json.load(baseline_file), json.load(current_file)
+    baseline_results = dict((get_result_key(result), result) for result in baseline['results'])
+    tolerances = {'seconds': args.tolerance, 'peak_rss_mb': args.tolerance, 'size': SIZE_TOLERANCE,
+                  'psnr': PSNR_TOLERANCE, 'ssim': SSIM_TOLERANCE}
+
+    regressions = 0
+    for result in current['results']:
+        key = get_result_key(result)
+        if key not in baseline_results:
+            print 'NEW        %s' % describe(result)
+            continue
+        previous = baseline_results.pop(key)
+        for name, lower_is_better, relative in COMPARED:
+            if result.get(name) is None or previous.get(name) is None:
+                continue
+            change = result[name] - previous[name]
+            if name == 'seconds' and abs(change) < TIME_RESOLUTION:
+                continue
+            if relative:
+                change = 100.0 * change / previous[name] if previous[name] else 0.0
+            if (change if lower_is_better else -change) > tolerances[name]:
+                regressions += 1
+                print 'REGRESSION %s: %s %.4g -> %.4g (%+.2f%s)' % (describe(result), name, previous[name], result[name], change,
+                                                                    '%' if relative else '')
+    for key, result in sorted(baseline_results.items()):
+        print 'MISSING    %s' % describe(result)
+
+    print '%d regressions found' % regressions
+    return 1 if regressions else 0
+
+
+def get_codings(args, smoothing):
+    """Measured pairs of entropy coding and chroma bits, grid smoothing cannot be combined with chroma subsampling"""
+    chroma = (None, args.chroma) if args.chroma and smoothing != compression.SMOOTHING_GRID else (None,)
+    return [(entropy_coding, chroma_bits) for entropy_coding in ((False, True) if args.entropy else (False,)) for chroma_bits in chroma]
+
+
+def run_isolated(function, *args):
+    """Call function in a new process, so that its peak memory is not affected by previous measurements"""
+    pool = multiprocessing.Pool(1)
+    try:
+        return pool.apply(function, args)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def measure_teach(network_path, image_path, samples, learning_rate, hidden_layer_size, batch_size, block_size, encoder_layers_sizes, seed,
+                  repeat):
+    seconds = float('inf')
+    for i in xrange(repeat):
+        start = time.time()
+        compression.teach(network_path, image_path, samples, learning_rate, hidden_layer_size, batch_size, 1, block_size, encoder_layers_sizes,
+                          seed)
+        seconds = min(seconds, time.time() - start)
+    return {'stage': 'teach', 'image': os.path.splitext(os.path.basename(image_path))[0], 'samples': samples,
+            'seconds': seconds, 'samples_per_second': samples / seconds, 'peak_rss_mb': metrics.peak_rss()}
+
+
+def measure_compress(settings, image_path, network_path, compressed_image_path, smoothing, workers, repeat):
+    seconds = float('inf')
+    for i in xrange(repeat):
+        start = time.time()
+        compression.compress(image_path, network_path, compressed_image_path, settings['bits'], smoothing, workers,
+                             entropy_coding=settings['entropy_coding'], chroma_bits=settings['chroma_bits'])
+        seconds = min(seconds, time.time() - start)
+    result = _timing_result('compress', settings, image_path, seconds)
+    result['size'] = os.path.getsize(compressed_image_path)
+    result['bits_per_pixel'] = 8.0 * result['size'] / (result['megapixels'] * 1e6)
+    return result
+
+
+def measure_decompress(settings, image_path, network_path, compressed_image_path, decompressed_image_path, workers, repeat):
+    seconds = float('inf')
+    for i in xrange(repeat):
+        start = time.time()
+        compression.decompress(compressed_image_path, network_path, decompressed_image_path, workers)
+        seconds = min(seconds, time.time() - start)
+    # quality is measured after peak memory is taken
+    result = _timing_result('decompress', settings, image_path, seconds)
+    original = compression.get_pixels(Image.open(image_path))
+    decompressed = compression.get_pixels(Image.open(decompressed_image_path))
+    result['psnr'] = metrics.psnr(original, decompressed)
+    result['ssim'] = metrics.ssim(original, decompressed)
+    return result
+
+
+def measure_entropy(settings, image_path, network_path, compressed_image_path, repeat):
+    """Measure entropy coding of the tiles of the picture alone, throughput is given in megabytes of packed values"""
+    compression.compress(image_path, network_path, compressed_image_path, settings['bits'])
+    with open(compressed_image_path, 'rb') as file:
+        header = compression.read_header(file)
+        offsets = header['offsets']
+        file.seek(int(offsets[0]))
+        data = file.read(int(offsets[-1] - offsets[0]))
+    bits, contexts = settings['bits'], header['hidden_layer_length']
+    tiles = [kernels.unpack(numpy.frombuffer(data, dtype=numpy.uint8, count=end - start, offset=start - offsets[0]).reshape(-1, bits * contexts / 8),
+                            bits, contexts) for start, end in zip(offsets[:-1], offsets[1:])]
+    encode_seconds = decode_seconds = float('inf')
+    for i in xrange(repeat):
+        start = time.time()
+        coded_tiles = [entropy.encode(symbols, bits) for symbols in tiles]
+        encode_seconds = min(encode_seconds, time.time() - start)
+        start = time.time()
+        for coded, symbols in zip(coded_tiles, tiles):
+            entropy.decode(coded, bits, len(symbols), contexts)
+        decode_seconds = min(decode_seconds, time.time() - start)
+    results = []
+    for stage, seconds in (('entropy encode', encode_seconds), ('entropy decode', decode_seconds)):
+        result = _timing_result(stage, settings, image_path, seconds)
+        result['size'] = sum(len(coded) for coded in coded_tiles)
+        result['megabytes_per_second'] = len(data) / 1e6 / seconds
+        results.append(result)
+    return results
+
+
+def _timing_result(stage, settings, image_path, seconds):
+    width, height = Image.open(image_path).size
+    result = dict(settings, stage=stage, seconds=seconds, peak_rss_mb=metrics.peak_rss(), megapixels=width * height / 1e6)
+    result['megapixels_per_second'] = result['megapixels'] / seconds
+    return result
+
+
+def get_result_key(result):
+    return tuple(result.get(name) for name in ('stage', 'image', 'bits', 'smoothing', 'entropy_coding', 'chroma_bits'))
+
+
+def describe(result):
+    if result['stage'] == 'teach':
+        return 'teach %s' % result['image']
+    return '%s %s %d bits %s%s%s' % (result['stage'], result['image'], result['bits'], result['smoothing'],
+                                     ' entropy' if result['entropy_coding'] else '',
+                                     ' chroma %d' % result['chroma_bits'] if result.get('chroma_bits') else '')
+
+
+def print_result(result):
+    if result['stage'] == 'teach':
+        print '%-48s %8.3fs %10.0f samples/s' % (describe(result), result['seconds'], result['samples_per_second'])
+    elif result['stage'].startswith('entropy'):
+        print '%-48s %8.3fs %8.2f MB/s %19d B' % (describe(result), result['seconds'], result['megabytes_per_second'], result['size'])
+    elif result['stage'] == 'compress':
+        print '%-48s %8.3fs %8.2f MP/s %8.1f MB %10d B' % (describe(result), result['seconds'], result['megapixels_per_second'],
+                                                          result['peak_rss_mb'] or 0, result['size'])
+    else:
+        print '%-48s %8.3fs %8.2f MP/s %8.1f MB %7.2f dB %6.4f' % (describe(result), result['seconds'], result['megapixels_per_second'],
+                                                                  result['peak_rss_mb'] or 0, result['psnr'], result['ssim'])
+
+
+def get_environment():
+    return {'python': platform.python_version(), 'numpy': numpy.__version__, 'platform': platform.platform(),
+            'processor': platform.processor(), 'cpus': multiprocessing.cpu_count(), 'time': time.strftime('%Y-%m-%d %H:%M:%S')}
+
+
+def parse_size(text):
+    try:
+        width, height = [int(value) for value in text.lower().split('x')]
+    except ValueError:
+        raise argparse.ArgumentTypeError('Size must be given as WIDTHxHEIGHT')
+    if width <= 0 or height <= 0:
+        raise argparse.ArgumentTypeError('Size must be positive')
+    return width, height
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Benchmarks of image compression using neural network')
+    subparsers = parser.add_subparsers(help='help for subcommands')
+
+    # create the parser for the 'run' command
+    parser_run = subparsers.add_parser('run', help='Measure teaching, compression and decompression of synthetic images')
+    parser_run.add_argument('-o', '--output', type=str, metavar='PATH', default='benchmark.json',
+                            help='indicates path where results will be saved (default benchmark.json)')
+    parser_run.add_argument('-s', '--sizes', type=parse_size, nargs='+', metavar='WIDTHxHEIGHT',
+                            default=[(256, 256), (1024, 768), (1920, 1080)], help='sizes of synthetic images (default 256x256 1024x768 1920x1080)')
+    parser_run.add_argument('-b', '--bits', type=int, nargs='+', default=range(1, 9), choices=range(1, 9),
+                            help='numbers of bits per pixel to measure (default all)')
+    parser_run.add_argument('-e', '--entropy', action='store_true', help='Measures entropy coded compression and entropy coding alone too')
+    parser_run.add_argument('-c', '--chroma', type=int, metavar='BITS', choices=range(1, 9),
+                            help='Measures YCbCr 4:2:0 compression with given number of chroma bits too')
+    parser_run.add_argument('-n', '--network', type=str, metavar='PATH',
+                            help='indicates path to neural network, new one is taught and measured by default')
+    parser_run.add_argument('-w', '--workers', type=int, metavar='NUMBER', default=1,
+                            help='number of worker processes (default 1)')
+    parser_run.add_argument('-r', '--repeat', type=int, metavar='NUMBER', default=3,
+                            help='number of runs of each measurement, the best time is reported (default 3)')
+    parser_run.add_argument('--samples', type=int, metavar='NUMBER', default=30000,
+                            help='number of samples used to teach the network (default 30000)')
+    parser_run.add_argument('--rate', type=float, metavar='<0,1>', default=0.5, help='learning rate (default 0.5)')
+    parser_run.add_argument('--hidden', type=int, metavar='NUMBER', default=32, help='hidden layer size (default 32)')
+    parser_run.add_argument('--batch', type=int, metavar='NUMBER', default=1, help='teaching batch size (default 1)')
+    parser_run.add_argument('--block', type=int, metavar='SIZE', default=8, choices=compression.BLOCK_SIZES,
+                            help='side of coded squares of taught network (default 8)')
+    parser_run.add_argument('--encoder', type=int, nargs='+', metavar='NUMBER', default=[],
+                            help='sizes of encoder layers of taught network (default none)')
+    parser_run.add_argument('--seed', type=int, metavar='NUMBER', default=0, help='seed of synthetic images and teaching (default 0)')
+    parser_run.set_defaults(command='run')
+
+    # create the parser for the 'compare' command
+    parser_compare = subparsers.add_parser('compare', help='Flag results worse than baseline, exits with status 1 if any')
+    parser_compare.add_argument('baseline', type=str, metavar='BASELINE', help='indicates path to baseline results')
+    parser_compare.add_argument('current', type=str, metavar='CURRENT', help='indicates path to current results')
+    parser_compare.add_argument('-t', '--tolerance', type=float, metavar='PERCENT', default=10.0,
+                                help='allowed growth of time and memory in percent (default 10)')
+    parser_compare.set_defaults(command='compare')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,37 @@
+"""In this module you can find deterministic synthetic test images.
+   Image mixes smooth gradients, flat shapes with sharp edges and fine noise, so that it resembles a photograph
+   in the way that matters for block coding. The same size and seed always give the same pixels.
+"""
+import numpy
+from PIL import Image
+
+
+def make_pixels(width, height, seed=0):
+    """Returns (height, width, RGB colour) array of bytes"""
+    state = numpy.random.RandomState(seed)
+    ys, xs = numpy.mgrid[0:height, 0:width].astype(numpy.float64)
+    xs /= max(width - 1, 1)
+    ys /= max(height - 1, 1)
+
+    pixels = numpy.empty((height, width, 3))
+    for colour in xrange(3):
+        phase, frequency = state.uniform(0, 2 * numpy.pi), state.uniform(2, 6)
+        pixels[:, :, colour] = 128 + 60 * numpy.sin(frequency * xs + phase) * numpy.cos(frequency * ys) + 40 * (xs - ys)
+
+    # shapes are placed relatively to the image size, so they look alike at every resolution
+    for i in xrange(12):
+        colour = state.uniform(0, 255, 3)
+        left, top = state.uniform(0, 1, 2)
+        right, bottom = left + state.uniform(0.05, 0.3), top + state.uniform(0.05, 0.3)
+        if state.randint(2):
+            mask = (xs >= left) & (xs < right) & (ys >= top) & (ys < bottom)
+        else:
+            mask = ((xs - (left + right) / 2) / (right - left)) ** 2 + ((ys - (top + bottom) / 2) / (bottom - top)) ** 2 < 0.25
+        pixels[mask] = colour
+
+    pixels += state.normal(0, 6, pixels.shape)
+    return numpy.clip(pixels, 0, 255).astype(numpy.uint8)
+
+
+def save_image(path, width, height, seed=0):
+    Image.fromarray(make_pixels(width, height, seed), 'RGB').save(path, 'BMP')
@@ -0,0 +1,102 @@
+"""In this module you can find on-disk cache of compression results.
+   Each result is a file named by hash of everything it depends on. When cache grows over its size,
+   least recently used results are removed. Results are written to a temporary file and renamed,
+   so that a result is either complete or missing, even when several processes share the cache.
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+
+import numpy
+
+
+DEFAULT_MAX_SIZE = 1 << 30
+TEMPORARY_PREFIX = '.tmp'
+
+
+class ResultCache(object):
+    """Cache of result files in directory, at most max_size bytes large.
+       Counts hits and misses of fetch.
+    """
+
+    def __init__(self, directory, max_size=DEFAULT_MAX_SIZE):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.directory = directory
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+    def fetch(self, key, target_path):
+        """Copy result stored under key to target_path, returns whether it was found"""
+        path = os.path.join(self.directory, key)
+        try:
+            shutil.copyfile(path, target_path)
+            # modification time orders results for eviction
+            os.utime(path, None)
+        except (IOError, OSError):
+            self.misses += 1
+            return False
+        self.hits += 1
+        return True
+
+    def store(self, key, source_path):
+        """Store copy of source_path under key and evict least recently used results"""
+        descriptor, temporary_path = tempfile.mkstemp(prefix=TEMPORARY_PREFIX, dir=self.directory)
+        try:
+            with os.fdopen(descriptor, 'wb') as temporary, open(source_path, 'rb') as source:
+                shutil.copyfileobj(source, temporary)
+            try:
+                os.rename(temporary_path, os.path.join(self.directory, key))
+            except OSError:
+                # on Windows rename fails when other process has just stored the same result
+                if not os.path.exists(os.path.join(self.directory, key)):
+                    raise
+        finally:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+        self.evict()
+
+    def evict(self):
+        """Remove least recently used results until cache fits in its size"""
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.startswith(TEMPORARY_PREFIX):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+        size = sum(entry[1] for entry in entries)
+        for mtime, entry_size, name in sorted(entries):
+            if size <= self.max_size:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+            size -= entry_size
+
+
+def get_key(*parts):
+    """Hash parts into cache key, parts may be strings, numbers, numpy arrays or lists and tuples of them"""
+    digest = hashlib.sha256()
+    _update_digest(digest, parts)
+    return digest.hexdigest()
+
+
+def _update_digest(digest, part):
+    if isinstance(part, numpy.ndarray):
+        digest.update('array%r%s' % (part.shape, part.dtype.str))
+        digest.update(numpy.ascontiguousarray(part).data)
+    elif isinstance(part, (list, tuple)):
+        digest.update('sequence%d' % len(part))
+        for item in part:
+            _update_digest(digest, item)
+    elif isinstance(part, str):
+        digest.update('string%d' % len(part))
+        digest.update(part)
+    else:
+        digest.update(repr(part))
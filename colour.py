@@ -0,0 +1,40 @@
+"""In this module you can find conversion of pictures between RGB and YCbCr with chroma subsampled 2:1 in both directions (4:2:0).
+   Conversion uses full range BT.601 coefficients, as JPEG does. All values are real numbers from <0;1>.
+   Chroma is subsampled by averaging 2 x 2 pixels and upsampled by repeating them, so that every macroblock
+   of 2 x 2 squares is converted independently of its neighbours.
+"""
+import numpy
+
+
+RGB_TO_YCBCR = numpy.array([[0.299, 0.587, 0.114],
+                            [-0.168736, -0.331264, 0.5],
+                            [0.5, -0.418688, -0.081312]])
+YCBCR_TO_RGB = numpy.array([[1.0, 0.0, 1.402],
+                            [1.0, -0.344136, -0.714136],
+                            [1.0, 1.772, 0.0]])
+CHROMA_OFFSET = numpy.array([0.0, 0.5, 0.5])
+
+
+def rgb_to_ycbcr(pixels):
+    """Convert (height, width, RGB colour) array of real values, height and width must be even.
+       Returns (height, width) luma array and (2, height / 2, width / 2) array of subsampled Cb and Cr.
+    """
+    height, width = pixels.shape[:2]
+    # 2-D product of colours by rows of pixels runs in BLAS, it gives planes of luma, Cb and Cr
+    planes = numpy.dot(RGB_TO_YCBCR, pixels.reshape(-1, 3).T)
+    # pairs of rows and then pairs of columns of every 2 x 2 block are summed
+    rows = planes[1:].reshape(2, height / 2, 2 * width)
+    columns = (rows[:, :, :width] + rows[:, :, width:]).reshape(2, height / 2, width / 2, 2)
+    chroma = columns[:, :, :, 0] + columns[:, :, :, 1]
+    chroma *= 0.25
+    chroma += CHROMA_OFFSET[1:, numpy.newaxis, numpy.newaxis]
+    return planes[0].reshape(height, width), chroma
+
+
+def ycbcr_to_rgb(luma, chroma):
+    """Convert luma and subsampled chroma made by rgb_to_ycbcr back to (height, width, RGB colour) array of real values"""
+    height, width = luma.shape
+    # luma adds the same to every colour, so only chroma is multiplied, once per 2 x 2 block
+    chroma_rgb = numpy.dot((chroma - CHROMA_OFFSET[1:, numpy.newaxis, numpy.newaxis]).reshape(2, -1).T, YCBCR_TO_RGB[:, 1:].T)
+    rgb = luma.reshape(height / 2, 2, width / 2, 2, 1) + chroma_rgb.reshape(height / 2, 1, width / 2, 1, 3)
+    return numpy.clip(rgb, 0, 1, out=rgb).reshape(height, width, 3)
@@ -1,263 +1,1126 @@
+import itertools
 import logging
+import mmap
+import os
 import random
 import struct
 
+import numpy
 from PIL import Image
 
+import cache
+import colour
+import entropy
+import kernels
 import neural_network
+import parallel
+import progress
+import training
 
 
 logger = logging.getLogger('logger')
 
+# compressed image starts with magic and format version; version 1 files have no magic and store squares
+# column by column, version 2 stores them row by row and version 3 in tiles listed in an index of offsets,
+# version 4 adds flags of optional coding stages, version 5 stores code layer size in 4 bytes and adds block size
+# and layers of the network, version 6 adds progressive images, whose header is followed by previews of the picture
+# stored as compressed images of their own, version 7 starts every tile of entropy coded image with its tile coding
+# and codes it in more lanes, see entropy module
+MAGIC = 'ZDP'
+VERSION = 7
+# sides of squares coded by network
+BLOCK_SIZES = (4, 8, 16)
+# tiles are entropy coded, see entropy module
+ENTROPY_CODING = 1
+# picture is coded as YCbCr 4:2:0 in macroblocks of 2 x 2 squares, see colour module, number of chroma bits follows network layers
+CHROMA_SUBSAMPLING = 2
+PROGRESSIVE = 4
+# tile of entropy coded image keeps packed values when entropy coding would make it larger
+TILE_RAW = 0
+TILE_ENTROPY_CODED = 1
+# smoothing modes, grid adds squares shifted by half of the step, deblocking filters block edges when decompressing
+SMOOTHING_NONE = 0
+SMOOTHING_GRID = 1
+SMOOTHING_DEBLOCK = 2
+SMOOTHING_MODES = {'grid': SMOOTHING_GRID, 'deblock': SMOOTHING_DEBLOCK}
+# weights of the step across block edge added to pixels at distance 0, 1, 2 from the edge
+DEBLOCKING_WEIGHTS = (3 / 8.0, 2 / 8.0, 1 / 8.0)
+# edge is filtered only when the step across it is below alpha and steps next to it on both sides are below beta,
+# both are multiples of the quantization step of codes in pixel values, larger steps are edges of the picture itself
+DEBLOCKING_ALPHA = 8
+DEBLOCKING_BETA = 0.5
+# sides of compressed pictures in pixels, larger sides in header mean damaged file
+MAX_SIDE = 65535
+# progressive images keep previews downscaled by some of these scales
+PREVIEW_SCALES = (2, 4, 8, 16, 32)
+# squares of the picture calibrating int8 weights and measuring accuracy of changed precision
+PRECISION_SAMPLES = 10000
+
 
 class ZdpException(Exception):
     pass
 
 
-def teach(neural_network_path, learning_image, repeat, learning_rate, hidden_layer_size=32):
+def teach(neural_network_path, learning_image, repeat, learning_rate, hidden_layer_size=32, batch_size=1, epochs=1, block_size=8,
+          encoder_layers_sizes=(), seed=None, reservoir_size=training.RESERVOIR_SIZE, validation_samples=training.VALIDATION_SAMPLES,
+          colour_space=training.COLOUR_RGB):
+    """Teach network coding block_size x block_size squares of single colour into hidden_layer_size values.
+       Encoder_layers_sizes are sizes of layers between input and bottleneck layer, decoder mirrors them.
+       Learning image is a picture, directory of pictures or glob pattern, squares are streamed from them, see training module.
+       Each epoch teaches repeat squares and reports PSNR of network output for validation squares.
+       Seed makes teaching repeatable, it also seeds random module for initial weights.
+       Colour space is one of training.COLOURS, networks taught on YCbCr planes code images with chroma subsampling better.
+    """
     if repeat <= 0:
         raise ZdpException('Number of repetitions must be grater than 0')
     if not 0 <= learning_rate <= 1:
         raise ZdpException('Learning rate must be <0;1>')
     if not hidden_layer_size > 0 or hidden_layer_size % 8 != 0:
         raise ZdpException('Hidden layer size must be multiple of 8')
-    network = neural_network.NeuralNetwork(64, [hidden_layer_size], 64, learning_rate=learning_rate)
+    if batch_size <= 0:
+        raise ZdpException('Batch size must be grater than 0')
+    if epochs <= 0:
+        raise ZdpException('Number of epochs must be grater than 0')
+    if block_size not in BLOCK_SIZES:
+        raise ZdpException('Block size must be one of ' + ', '.join(str(size) for size in BLOCK_SIZES))
+    if not all(size > 0 for size in encoder_layers_sizes):
+        raise ZdpException('Encoder layer sizes must be grater than 0')
+    if reservoir_size <= 0 or validation_samples < 0:
+        raise ZdpException('Reservoir size must be grater than 0 and number of validation samples must not be negative')
+    if colour_space not in training.COLOURS:
+        raise ZdpException('Colour space must be one of ' + ', '.join(training.COLOURS))
+    paths = training.get_image_paths(learning_image)
+    if not paths:
+        raise ZdpException('No training images found in ' + learning_image)
+    if seed is not None:
+        random.seed(seed)
+    inputs = block_size * block_size
+    hidden_layers_sizes = list(encoder_layers_sizes) + [hidden_layer_size] + list(reversed(encoder_layers_sizes))
+    network = neural_network.NeuralNetwork(inputs, hidden_layers_sizes, inputs, learning_rate=learning_rate,
+                                           bottleneck=len(encoder_layers_sizes))
     network.init_weights()
     logger.info('Neural network edges initialized')
 
-    image = Image.open(learning_image)
-    for i in xrange(repeat):
-        x = random.randint(0, (image.size[0] - 8))
-        y = random.randint(0, (image.size[1] - 8))
-        colour = random.randint(0, 2)
-        data = get_square(image, x, y, 8)
-        network.teach_step(data[colour], data[colour])
-        logger.info('Teaching in progress... %d%%\033[F' % (100 * (i + 1) / repeat))
+    tracker = progress.track('teach')
+    with tracker.stage('load'):
+        stream = training.SquareStream(paths, block_size, seed, reservoir_size, validation_samples, colour_space=colour_space)
+    logger.info('Teaching on %d images, %d held out for validation' % (len(stream.paths), len(stream.validation_paths)))
+    steps = (repeat + batch_size - 1) / batch_size
+    tracker.begin(epochs * steps)
+    try:
+        for epoch in xrange(epochs):
+            squared_error = 0.0
+            for i in xrange(steps):
+                samples = min(batch_size, repeat - i * batch_size)
+                with tracker.stage('sample'):
+                    data = stream.next_batch(samples)
+                with tracker.stage('teach'):
+                    squared_error += network.teach_batch(data, data) * samples
+                tracker.advance()
+            tracker.count('samples', repeat)
+            message = 'Epoch %d/%d completed, reconstruction MSE %.6f' % (epoch + 1, epochs, squared_error / repeat)
+            if len(stream.validation):
+                with tracker.stage('validate'):
+                    message += ', validation PSNR %.2f dB' % get_psnr(network, stream.validation)
+            logger.info(message)
+    finally:
+        stream.close()
 
     logger.info('Teaching completed          ')
-    neural_network.save(network, neural_network_path)
+    with tracker.stage('write'):
+        neural_network.save(network, neural_network_path)
+    tracker.finish()
     logger.info('Neural network saved to ' + neural_network_path)
 
 
-def compress(image_path, neural_network_path, compressed_image_path, bits, smoothing=False):
-    if not 1 <= bits <= 8:
+def change_precision(neural_network_path, output_path, precision, calibration_image, samples=PRECISION_SAMPLES):
+    """Save network with weights of given precision, one of neural_network.PRECISIONS.
+       Random squares of calibration image, usually the training one, set scales of int8 weights
+       and measure accuracy of the saved network, returns report made by precision_report.
+    """
+    if precision not in neural_network.PRECISIONS:
+        raise ZdpException('Precision must be one of ' + ', '.join(sorted(neural_network.PRECISIONS)))
+    if samples <= 0:
+        raise ZdpException('Number of samples must be grater than 0')
+    tracker = progress.track('precision')
+    with tracker.stage('load'):
+        network = neural_network.load(neural_network_path)
+        squares = training.get_all_squares(get_pixels(Image.open(calibration_image)), get_block_size(network))
+        inputs = get_random_squares(squares, samples)
+    with tracker.stage('calibrate'):
+        converted = neural_network.convert_precision(network, neural_network.PRECISIONS[precision], inputs)
+    with tracker.stage('measure'):
+        report = precision_report(neural_network.convert_precision(network, neural_network.FLOAT32), converted, inputs)
+    with tracker.stage('write'):
+        neural_network.save(converted, output_path)
+    tracker.finish()
+    for row in report:
+        logger.info('%d bits: %d of %d codes differ from float64 (largest difference %d), decoded PSNR %.2f dB'
+                    % (row['bits'], row['different_codes'], row['codes'], row['largest_difference'], row['psnr']))
+    logger.info('Neural network saved to ' + output_path)
+    return report
+
+
+def precision_report(reference, network, inputs, bits_list=range(1, 9)):
+    """Compare network with reference network of the same weights counted in float64 on rows of inputs.
+       For each number of bits counts quantified code values which differ from the reference codes and PSNR
+       of squares decoded by network from the reference codes against squares decoded by reference.
+    """
+    reference_hidden_values = reference.encode(inputs)
+    hidden_values = network.encode(inputs)
+    report = []
+    for bits in bits_list:
+        reference_codes = kernels.quantify(reference_hidden_values, bits)
+        codes = kernels.quantify(hidden_values, bits)
+        differences = numpy.abs(codes.astype(numpy.int16) - reference_codes)
+        decoder_input = kernels.dequantify(reference_codes, bits)
+        squared_error = numpy.mean((network.decode(decoder_input) - reference.decode(decoder_input)) ** 2)
+        report.append({'bits': bits, 'codes': codes.size, 'different_codes': int(numpy.count_nonzero(differences)),
+                       'largest_difference': int(differences.max()),
+                       'psnr': 10 * numpy.log10(1 / squared_error) if squared_error > 0 else float('inf')})
+    return report
+
+
+def get_psnr(network, squares):
+    """PSNR of network output for rows of squares of <0;1> values, without quantization of codes"""
+    squared_error = numpy.mean((network.decode(network.encode(squares)) - squares) ** 2)
+    return 10 * numpy.log10(1 / squared_error) if squared_error > 0 else float('inf')
+
+
+def check_compress_arguments(bits, workers=1, smoothing=SMOOTHING_NONE, chroma_bits=None, progressive=()):
+    if not 1 <= bits <= 8 or chroma_bits is not None and not 1 <= chroma_bits <= 8:
         raise ZdpException('Number of bits must be <1;8>')
-    network = neural_network.load(neural_network_path)
+    if not all(scale in PREVIEW_SCALES for scale in progressive) or len(set(progressive)) != len(progressive):
+        raise ZdpException('Preview scales must be different numbers of ' + ', '.join(str(scale) for scale in PREVIEW_SCALES))
+    if smoothing not in (SMOOTHING_NONE, SMOOTHING_GRID, SMOOTHING_DEBLOCK):
+        raise ZdpException('Unknown smoothing mode')
+    if smoothing == SMOOTHING_GRID and chroma_bits is not None:
+        raise ZdpException('Grid smoothing cannot be used with chroma subsampling')
+    if workers <= 0:
+        raise ZdpException('Number of workers must be grater than 0')
 
-    img = Image.open(image_path)
-    rgb_squares = get_sequence_squares(img)
 
-    # open file and write data necessary to decompress
-    file = open(compressed_image_path, 'wb')
-    file.write(struct.pack('>i', img.size[0]))
-    file.write(struct.pack('>i', img.size[1]))
-    file.write(struct.pack('>i', len(rgb_squares)))
-    file.write(struct.pack('>b', bits))
-    file.write(struct.pack('>b', len(network.hidden_layers[0])))
-    file.write(struct.pack('>b', int(smoothing)))
+def check_tile_size(tile_size, block_size=8):
+    if not 0 < tile_size <= 1 << 16 or tile_size % block_size != 0:
+        raise ZdpException('Tile size must be multiple of %d, at most 65536' % block_size)
 
-    if smoothing:
-        compress_squares(file, rgb_squares, network, bits, 0, 50)
-        smoothing_squares = get_sequence_squares(img, 4)
-        compress_squares(file, smoothing_squares, network, bits, 50, 100)
+
+def get_block_size(network):
+    """Side of squares coded by network or its half, input and output layers of network are single colour squares"""
+    sizes = network.sizes
+    block_size = int(round(sizes[0] ** 0.5))
+    if block_size not in BLOCK_SIZES or sizes[0] != block_size * block_size or sizes[-1] != sizes[0] or len(sizes) <= 2:
+        raise ZdpException('Loaded network does not code squares of supported size')
+    return block_size
+
+
+def check_network(header, network):
+    """Check that network or its half codes squares the way compressed image of given header was coded"""
+    if header['block_size'] != get_block_size(network) or header['hidden_layer_length'] != network.code_size:
+        raise ZdpException('Loaded network and compressed image are not compatible')
+    if header['layers'] is not None and (header['layers'] != network.sizes or header['bottleneck'] != network.bottleneck):
+        raise ZdpException('Loaded network and compressed image are not compatible')
+
+
+def compress(image_path, neural_network_path, compressed_image_path, bits, smoothing=SMOOTHING_NONE, workers=1, tile_size=256,
+             entropy_coding=False, result_cache=None, chroma_bits=None, progressive=()):
+    check_compress_arguments(bits, workers, smoothing, chroma_bits, progressive)
+    tracker = progress.track('compress')
+    with tracker.stage('load'):
+        network = neural_network.load_encoder(neural_network_path)
+        img = Image.open(image_path)
+    if result_cache is None and not progressive:
+        compress_bands(read_bands(img, get_unit_size(network, chroma_bits)), img.size, network, compressed_image_path, bits, smoothing,
+                       workers, tile_size, entropy_coding, tracker, chroma_bits)
     else:
-        compress_squares(file, rgb_squares, network, bits)
+        # cache key and previews need all pixels, so the picture is not streamed
+        compress_pixels(get_pixels(img), network, compressed_image_path, bits, smoothing, workers, tile_size, entropy_coding, result_cache,
+                        chroma_bits, progressive, tracker)
 
-    file.close()
+
+def compress_pixels(pixels, network, compressed_image_path, bits, smoothing=SMOOTHING_NONE, workers=1, tile_size=256, entropy_coding=False,
+                    result_cache=None, chroma_bits=None, progressive=(), tracker=None):
+    """Compress picture pixels made by get_pixels using already loaded network or its encoder.
+       With result_cache, see cache module, the same pixels compressed the same way are taken from cache.
+       Progressive image keeps also previews of the picture downscaled by given scales, see compress_bands.
+    """
+    if result_cache is not None:
+        key = cache.get_key('compress', VERSION, pixels, network.weights, network.weights_type, network.bottleneck, bits, smoothing,
+                            tile_size, entropy_coding, chroma_bits, sorted(progressive))
+        if result_cache.fetch(key, compressed_image_path):
+            logger.info('Compressed image taken from cache')
+            logger.info('Compressed image saved to ' + compressed_image_path)
+            return
+        compress_pixels(pixels, network, compressed_image_path, bits, smoothing, workers, tile_size, entropy_coding,
+                        chroma_bits=chroma_bits, progressive=progressive, tracker=tracker)
+        result_cache.store(key, compressed_image_path)
+        return
+
+    unit = get_unit_size(network, chroma_bits)
+    bands = (pixels[top:top + unit] for top in xrange(0, len(pixels), unit))
+    compress_bands(bands, (pixels.shape[1], pixels.shape[0]), network, compressed_image_path, bits, smoothing, workers, tile_size,
+                   entropy_coding, tracker, chroma_bits, get_previews(pixels, progressive))
+
+
+def get_previews(pixels, scales):
+    """Previews of progressive image as (scale, pixels) pairs from the coarsest one, see downscale_pixels"""
+    return [(scale, downscale_pixels(pixels, scale)) for scale in sorted(scales, reverse=True)]
+
+
+def downscale_pixels(pixels, scale):
+    """Average every scale x scale pixels of (height, width, RGB colour) array of bytes,
+       picture is extended by its edge pixels to whole multiples of scale
+    """
+    height, width = pixels.shape[:2]
+    rows, columns = (height + scale - 1) / scale, (width + scale - 1) / scale
+    padded = numpy.pad(pixels, ((0, rows * scale - height), (0, columns * scale - width), (0, 0)), 'edge')
+    averages = padded.reshape(rows, scale, columns, scale, 3).mean(axis=(1, 3))
+    return numpy.round(averages).astype(numpy.uint8)
+
+
+def get_unit_size(network, chroma_bits=None):
+    """Side of the grid units in pixels, squares coded by network or macroblocks of 2 x 2 squares with chroma subsampling"""
+    return get_block_size(network) * (2 if chroma_bits else 1)
+
+
+def compress_bands(bands, size, network, compressed_image_path, bits, smoothing=SMOOTHING_NONE, workers=1, tile_size=256,
+                   entropy_coding=False, tracker=None, chroma_bits=None, previews=()):
+    """Compress picture given as consecutive bands of RGB bytes as high as grid units, see read_bands and get_unit_size.
+       Rows of units are encoded as soon as their band is read and written out tile by tile
+       as soon as a row of tiles is complete, so memory does not depend on picture height.
+       With more than one worker rows are encoded in separate processes.
+       With entropy coding every tile is coded separately, so tiles remain independently decodable,
+       tiles which entropy coding would make larger keep packed values.
+       Smoothing is one of SMOOTHING modes, only grid smoothing adds data.
+       With chroma_bits picture is coded as YCbCr 4:2:0, luma squares with bits and chroma squares with chroma_bits.
+       Previews made by get_previews are compressed the same way and written before the tiles of the picture,
+       so that reading of progressive image can stop after any of them.
+       Progress and stage times are reported to tracker, see progress module.
+    """
+    if tracker is None:
+        tracker = progress.track('compress')
+    with open(compressed_image_path, 'wb') as file:
+        write_image(file, bands, size, network, bits, smoothing, workers, tile_size, entropy_coding, tracker, chroma_bits, previews)
+        tracker.count('bytes', file.tell())
+    tracker.finish()
     logger.info('Compressing completed          ')
     logger.info('Compressed image saved to ' + compressed_image_path)
 
 
-def compress_squares(file, rgb_squares, network, bits, prog_start=0, prog_end=100):
-    size = bits * len(network.hidden_layers[0]) / 8
-    for i, rgb_square in enumerate(rgb_squares):
-        logger.info('Compressing in progress... %d%%\033[F' % ((prog_end - prog_start) * (i + 1) / len(rgb_squares) + prog_start))
-        for sq in rgb_square:
-            network.run(sq)
-            # get hidden neuron's values
-            hidden_values = [neuron.value for neuron in network.hidden_layers[0]]
-            quant_values = quantify(hidden_values, bits)
-
-            # place quantified values in byte array and write to file
-            bin_square = bytearray([0] * size)
-            B = 0
-            pos = 0
-            for val in quant_values:
-                bin_square[B] |= val << pos & 255
-                pos += bits
-                if pos == 8:
-                    B += 1
-                    pos = 0
-                elif pos > 8:
-                    B += 1
-                    pos %= 8
-                    bin_square[B] |= val >> (bits - pos)
-            file.write(bin_square)
-
-def decompress(compressed_image_path, neural_network_path, target_image_path):
-    network = neural_network.load(neural_network_path)
-
-    # read data necessary to decompress
-    file = open(compressed_image_path, 'rb')
-    x = struct.unpack('>i', file.read(4))[0]
-    y = struct.unpack('>i', file.read(4))[0]
-    number_of_rgb_squares = struct.unpack('>i', file.read(4))[0]
-    bits = struct.unpack('>b', file.read(1))[0]
-    hidden_layer_length = struct.unpack('>b', file.read(1))[0]
-    smoothing = struct.unpack('>b', file.read(1))[0]
-
-    if hidden_layer_length != len(network.hidden_layers[0]):
-        raise ZdpException('Loaded network and compressed image are not compatible')
+def write_image(file, bands, size, network, bits, smoothing, workers, tile_size, entropy_coding, tracker, chroma_bits, previews=()):
+    """Write compressed image to file from its current position, see compress_bands.
+       Offsets of tiles and previews are positions in file, so embedded previews are read through the whole file.
+    """
+    step = get_block_size(network)
+    unit = get_unit_size(network, chroma_bits)
+    check_tile_size(tile_size, unit)
+    shifted_grid = smoothing == SMOOTHING_GRID
+    x, y = size
+    if not (1 <= x <= MAX_SIDE and 1 <= y <= MAX_SIDE):
+        raise ZdpException('Picture sides must be <1;%d>' % MAX_SIDE)
+    columns, rows = (x + unit - 1) / unit, (y + unit - 1) / unit
+    tile_squares = tile_size / unit
+    tile_columns, tile_rows = (columns + tile_squares - 1) / tile_squares, (rows + tile_squares - 1) / tile_squares
+    hidden_layer_length = network.code_size
+    square_size = get_unit_data_size(hidden_layer_length, bits, chroma_bits)
 
-    logger.info('Decompressing in progress...\033[F')
+    # write data necessary to decompress
+    flags = (ENTROPY_CODING if entropy_coding else 0) | (CHROMA_SUBSAMPLING if chroma_bits else 0) | (PROGRESSIVE if previews else 0)
+    file.write(MAGIC + chr(VERSION))
+    file.write(struct.pack('>i', x))
+    file.write(struct.pack('>i', y))
+    file.write(struct.pack('>i', columns * rows))
+    file.write(struct.pack('>b', bits))
+    file.write(struct.pack('>I', hidden_layer_length))
+    file.write(struct.pack('>b', int(smoothing)))
+    file.write(struct.pack('>i', tile_size))
+    file.write(struct.pack('>B', flags))
+    sizes = network.sizes
+    file.write(struct.pack('>BBB', step, len(sizes), network.bottleneck))
+    file.write(struct.pack('>%dI' % len(sizes), *sizes))
+    if chroma_bits:
+        file.write(struct.pack('>b', chroma_bits))
+    if previews:
+        _write_previews(file, previews, network, bits, smoothing, workers, tile_size, entropy_coding, tracker, chroma_bits)
+    # tile index is filled in when all tiles are written
+    index_position = file.tell()
+    file.write('\x00' * 8 * (tile_columns * tile_rows + 1))
 
-    if not smoothing:
-        squares = decompress_squares(file, number_of_rgb_squares, network, bits)
-        print_picture(Image.new('RGB', (x, y)), squares, target_image_path)
+    grid_bands = tracker.timed('tile', get_grid_bands(bands, columns, shifted_grid, unit))
+    if workers == 1:
+        records = (_encode_band(grid_band, network, bits, tracker, chroma_bits) for grid_band in grid_bands)
     else:
-        squares = decompress_squares(file, number_of_rgb_squares, network, bits)
-        smoothing_squares = decompress_squares(file, number_of_rgb_squares, network, bits)
-        print_picture(Image.new('RGB', (x, y)), squares, target_image_path, smoothing_squares)
+        # bands go to workers and records come back through slots of shared memory,
+        # stage times are measured in workers and sent back instead of the records
+        slots = parallel.Slots(workers * parallel.DEPTH, {'band': ((unit, columns * unit, 3), numpy.uint8),
+                                                          'record': ((columns * square_size,), numpy.uint8)}, 'band')
+        shared = {'network': network, 'bits': bits, 'chroma_bits': chroma_bits, 'timed': tracker is not progress.NULL_TRACKER}
+        records = _add_times(((slots.get('record', slot).tostring(), times)
+                              for slot, times in parallel.imap_bounded(_encode_grid_band, grid_bands, workers, shared, slots=slots)), tracker)
+
+    order = get_record_order(rows, shifted_grid)
+    tracker.begin(len(order))
+    tracker.count('squares', len(order) * columns)
+    pending = {}
+    offsets = []
+    for (row, shifted), record in itertools.izip(order, records):
+        pending[row, shifted] = record
+        first_row = row / tile_squares * tile_squares
+        last_row = min(rows, first_row + tile_squares) - 1
+        # last row of the row of tiles is complete, shifted rows come after the primary ones
+        if row == last_row and shifted == shifted_grid:
+            for column in xrange(0, columns, tile_squares):
+                offsets.append(file.tell())
+                first, last = column * square_size, min(columns, column + tile_squares) * square_size
+                tile = ''.join(pending[tile_row, kind][first:last]
+                               for kind in ((False, True) if shifted_grid else (False,)) for tile_row in xrange(first_row, last_row + 1))
+                if entropy_coding:
+                    with tracker.stage('entropy'):
+                        coded_tile = _entropy_encode_tile(tile, hidden_layer_length, bits, chroma_bits)
+                    if len(coded_tile) < len(tile):
+                        tile = chr(TILE_ENTROPY_CODED) + coded_tile
+                    else:
+                        tile = chr(TILE_RAW) + tile
+                        tracker.count('raw tiles')
+                with tracker.stage('write'):
+                    file.write(tile)
+                tracker.count('tiles')
+            for tile_row in xrange(first_row, last_row + 1):
+                pending.pop((tile_row, False))
+                pending.pop((tile_row, True), None)
+        tracker.advance()
+
+    with tracker.stage('write'):
+        offsets.append(file.tell())
+        file.seek(index_position)
+        file.write(numpy.array(offsets, dtype='>u8').tostring())
+        file.seek(offsets[-1])
+
+
+def _write_previews(file, previews, network, bits, smoothing, workers, tile_size, entropy_coding, tracker, chroma_bits):
+    """Write number and scales of previews, their offsets followed by offset of the tile index and the previews themselves"""
+    file.write(struct.pack('>B', len(previews)))
+    file.write(struct.pack('>%dB' % len(previews), *[scale for scale, pixels in previews]))
+    # offsets are filled in when all previews are written
+    table_position = file.tell()
+    file.write('\x00' * 8 * (len(previews) + 1))
+    unit = get_unit_size(network, chroma_bits)
+    offsets = []
+    with tracker.stage('preview'):
+        for scale, pixels in previews:
+            offsets.append(file.tell())
+            bands = (pixels[top:top + unit] for top in xrange(0, len(pixels), unit))
+            write_image(file, bands, (pixels.shape[1], pixels.shape[0]), network, bits, smoothing, workers, tile_size, entropy_coding,
+                        progress.NULL_TRACKER, chroma_bits)
+    offsets.append(file.tell())
+    file.seek(table_position)
+    file.write(numpy.array(offsets, dtype='>u8').tostring())
+    file.seek(offsets[-1])
+
+
+def get_unit_data_size(hidden_layer_length, bits, chroma_bits=None):
+    """Number of bytes of a grid unit, RGB square or macroblock of 4 luma and 2 chroma squares"""
+    if chroma_bits:
+        return (4 * bits + 2 * chroma_bits) * hidden_layer_length / 8
+    return 3 * bits * hidden_layer_length / 8
+
+
+def _encode_band(grid_band, network, bits, timer, chroma_bits=None):
+    if not chroma_bits:
+        with timer.stage('tile'):
+            rgb_squares = band_squares(grid_band)
+        return encode_squares(rgb_squares, network, bits, timer).tostring()
+
+    # data of every macroblock are its luma squares followed by its chroma squares
+    with timer.stage('tile'):
+        luma_squares, chroma_squares = band_macroblocks(grid_band)
+    luma_data = encode_squares(luma_squares, network, bits, timer)
+    chroma_data = encode_squares(chroma_squares, network, chroma_bits, timer)
+    macroblocks = len(grid_band[0]) / len(grid_band)
+    return numpy.concatenate((luma_data.reshape(macroblocks, -1), chroma_data.reshape(macroblocks, -1)), axis=1).tostring()
+
+
+def _encode_grid_band(task):
+    slot, unused = task
+    timer = progress.StageTimer() if parallel.get_shared('timed') else progress.NULL_TRACKER
+    record = _encode_band(parallel.get_slot('band', slot), parallel.get_shared('network'), parallel.get_shared('bits'), timer,
+                          parallel.get_shared('chroma_bits'))
+    parallel.get_slot('record', slot)[...] = numpy.frombuffer(record, dtype=numpy.uint8)
+    return timer.times
+
+
+def _entropy_encode_tile(tile, hidden_layer_length, bits, chroma_bits=None):
+    """Entropy code packed values of tile. Luma and chroma are coded separately, preceded by length of luma data."""
+    bin_units = numpy.frombuffer(tile, dtype=numpy.uint8).reshape(-1, get_unit_data_size(hidden_layer_length, bits, chroma_bits))
+    if not chroma_bits:
+        return entropy.encode(kernels.unpack(bin_units.reshape(-1, bits * hidden_layer_length / 8), bits, hidden_layer_length), bits)
+
+    luma_size = 4 * bits * hidden_layer_length / 8
+    luma = entropy.encode(kernels.unpack(bin_units[:, :luma_size].reshape(-1, luma_size / 4), bits, hidden_layer_length), bits)
+    chroma_squares = bin_units[:, luma_size:].reshape(-1, chroma_bits * hidden_layer_length / 8)
+    chroma = entropy.encode(kernels.unpack(chroma_squares, chroma_bits, hidden_layer_length), chroma_bits)
+    return struct.pack('>I', len(luma)) + luma + chroma
+
+
+def _add_times(results, tracker):
+    """Add stage times of (result, times) pairs to tracker, yields results"""
+    for result, times in results:
+        tracker.add_times(times)
+        yield result
+
+
+def encode_squares(rgb_squares, network, bits, timer=progress.NULL_TRACKER):
+    """Encode all squares at once, each RGB colour of each square is a row of the input matrix.
+       Returns array of quantified hidden values packed into bytes, row by row.
+    """
+    with timer.stage('encode'):
+        inputs = numpy.asarray(rgb_squares, dtype=numpy.float64).reshape(-1, network.sizes[0])
+        hidden_values = network.encode(inputs)
+    with timer.stage('quantize'):
+        quant_values = kernels.quantify(hidden_values, bits)
+    with timer.stage('pack'):
+        return kernels.pack(quant_values, bits)
+
+
+def decompress(compressed_image_path, neural_network_path, target_image_path, workers=1, box=None, result_cache=None, layer=None):
+    """Decompress image or its region, layer selects preview of progressive image, see read_header"""
+    if workers <= 0:
+        raise ZdpException('Number of workers must be grater than 0')
+    tracker = progress.track('decompress')
+    with tracker.stage('load'):
+        network = neural_network.load_decoder(neural_network_path)
+    if box is None:
+        decompress_file(open(compressed_image_path, 'rb'), network, target_image_path, workers, result_cache, tracker, layer)
+        return
+
+    if result_cache is not None:
+        with open(compressed_image_path, 'rb') as file:
+            key = cache.get_key('decompress', VERSION, file.read(), network.weights, network.weights_type, box, layer)
+        if result_cache.fetch(key, target_image_path):
+            logger.info('Decompressed region taken from cache')
+            logger.info('Decompressed region saved to ' + target_image_path)
+            return
+    decompress_region(compressed_image_path, network, box, workers, tracker, layer).save(target_image_path, 'BMP')
+    if result_cache is not None:
+        result_cache.store(key, target_image_path)
+    logger.info('Decompressed region saved to ' + target_image_path)
+
+
+def decompress_file(file, network, target_image_path, workers=1, result_cache=None, tracker=None, layer=None):
+    """Decompress image read from file object using already loaded network or its decoder.
+       With result_cache, see cache module, decompressed image of the same data and network is taken from cache.
+       Layer selects preview of progressive image, only the file up to the end of the preview is read, see read_header.
+       Progress and stage times are reported to tracker, see progress module.
+    """
+    if tracker is None:
+        tracker = progress.track('decompress')
+    if result_cache is not None:
+        position = file.tell()
+        key = cache.get_key('decompress', VERSION, file.read(), network.weights, network.weights_type, None, layer)
+        if result_cache.fetch(key, target_image_path):
+            logger.info('Decompressed image taken from cache')
+            logger.info('Decompressed image saved to ' + target_image_path)
+            return
+        file.seek(position)
+        decompress_file(file, network, target_image_path, workers, tracker=tracker, layer=layer)
+        result_cache.store(key, target_image_path)
+        return
+
+    header = read_header(file, layer)
+    check_network(header, network)
+    if header['scale'] > 1:
+        logger.info('Decompressing preview downscaled %d times' % header['scale'])
+
+    bits, smoothing = header['bits'], header['smoothing']
+    if header['version'] == 1:
+        # files of older versions are decoded at once
+        tracker.begin(1)
+        with tracker.stage('decode'):
+            number_of_rgb_squares = header['number_of_rgb_squares']
+            squares = decompress_squares(file, number_of_rgb_squares, network, bits, workers)
+            smoothing_squares = decompress_squares(file, number_of_rgb_squares, network, bits, workers) if smoothing else None
+        with tracker.stage('write'):
+            print_picture(header['size'], squares, target_image_path, smoothing_squares)
+        tracker.advance()
+    else:
+        if header['version'] == 2:
+            tracker.begin(1)
+            with tracker.stage('decode'):
+                pixels = decompress_rows(file, header['size'], network, bits, smoothing, workers)
+            tracker.advance()
+        else:
+            pixels = decompress_tiles(file, header, network, workers=workers, tracker=tracker)
+        with tracker.stage('write'):
+            Image.fromarray(pixels, 'RGB').save(target_image_path, 'BMP')
+    tracker.finish()
     logger.info('Decompressing completed     ')
     logger.info('Decompressed image saved to ' + target_image_path)
 
 
-def decompress_squares(file, number_of_rgb_squares, network, bits):
-    hidden_layer_length = len(network.hidden_layers[0])
+def decompress_region(compressed_image_path, network, box=None, workers=1, tracker=None, layer=None):
+    """Decompress part of the picture given as (left, upper, right, lower) box, whole picture by default.
+       Compressed image is memory-mapped and only tiles covering the box are read.
+       Layer selects preview of progressive image, then the box lies within the preview, see read_header.
+       Returns RGB picture of the box size.
+    """
+    if tracker is None:
+        tracker = progress.track('decompress')
+    with open(compressed_image_path, 'rb') as file:
+        data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        header = read_header(data, layer)
+        if header['version'] < 3:
+            raise ZdpException('Only compressed images of version 3 or newer contain tiles')
+        check_network(header, network)
+        img = Image.fromarray(decompress_tiles(data, header, network, box, workers, tracker), 'RGB')
+        tracker.finish()
+        return img
+    finally:
+        data.close()
+
+
+def read_header(file, layer=None):
+    """Read data necessary to decompress, returns dictionary of header fields.
+       Files of version 1 start with picture size instead of magic.
+       Layers of progressive image are its previews from the coarsest one and the whole picture as the last and default one,
+       other images have just one layer. Header of selected preview is returned, scale field tells how many times it is downscaled.
+    """
+    data = _read_data(file, 4)
+    if data[:len(MAGIC)] == MAGIC:
+        version = ord(data[len(MAGIC)])
+        if not 2 <= version <= VERSION:
+            raise ZdpException('Unsupported compressed image version %d' % version)
+        data = _read_data(file, 4)
+    else:
+        version = 1
+    if layer not in (None, 0) and version < 6:
+        raise ZdpException('Layer must be <0;0>')
+
+    header = {'version': version}
+    header['size'] = struct.unpack('>i', data)[0], _read_value(file, '>i')
+    if not all(1 <= side <= MAX_SIDE for side in header['size']):
+        raise ZdpException('Compressed image is damaged')
+    header['number_of_rgb_squares'] = _read_value(file, '>i')
+    header['bits'] = _read_value(file, '>b')
+    if not 1 <= header['bits'] <= 8:
+        raise ZdpException('Compressed image is damaged')
+    header['hidden_layer_length'] = _read_value(file, '>I' if version >= 5 else '>b')
+    header['smoothing'] = _read_value(file, '>b')
+    header['entropy_coding'] = False
+    # older versions code 8 x 8 squares and do not record network layers
+    header['block_size'] = 8
+    header['layers'] = header['bottleneck'] = header['chroma_bits'] = None
+    header['previews'], header['scale'] = [], 1
+    if header['smoothing'] not in ((SMOOTHING_NONE, SMOOTHING_GRID, SMOOTHING_DEBLOCK) if version >= 4 else (SMOOTHING_NONE, SMOOTHING_GRID)):
+        raise ZdpException('Compressed image is damaged')
+
+    if version >= 3:
+        header['tile_size'] = _read_value(file, '>i')
+        if version >= 4:
+            flags = _read_value(file, '>B')
+            if flags & ~(ENTROPY_CODING | (CHROMA_SUBSAMPLING if version >= 5 else 0) | (PROGRESSIVE if version >= 6 else 0)):
+                raise ZdpException('Unsupported compressed image flags %d' % flags)
+            header['entropy_coding'] = bool(flags & ENTROPY_CODING)
+        if version >= 5:
+            header['block_size'], number_of_layers, header['bottleneck'] = _read_values(file, '>BBB')
+            if header['block_size'] not in BLOCK_SIZES:
+                raise ZdpException('Compressed image is damaged')
+            header['layers'] = list(_read_values(file, '>%dI' % number_of_layers))
+            if flags & CHROMA_SUBSAMPLING:
+                header['chroma_bits'] = _read_value(file, '>b')
+                if not 1 <= header['chroma_bits'] <= 8 or header['smoothing'] == SMOOTHING_GRID:
+                    raise ZdpException('Compressed image is damaged')
+            if flags & PROGRESSIVE:
+                number_of_previews = _read_value(file, '>B')
+                header['previews'] = list(_read_values(file, '>%dB' % number_of_previews))
+                if not all(scale in PREVIEW_SCALES for scale in header['previews']):
+                    raise ZdpException('Compressed image is damaged')
+                preview_offsets = _read_values(file, '>%dQ' % (number_of_previews + 1))
+        if layer is not None and not 0 <= layer <= len(header['previews']):
+            raise ZdpException('Layer must be <0;%d>' % len(header['previews']))
+        if layer is not None and layer < len(header['previews']):
+            file.seek(int(preview_offsets[layer]))
+            preview = read_header(file)
+            if preview['previews']:
+                raise ZdpException('Compressed image is damaged')
+            preview['scale'] = header['previews'][layer]
+            return preview
+        if header['previews']:
+            # tile index of the picture follows the previews
+            file.seek(int(preview_offsets[-1]))
+        x, y = header['size']
+        step = header['block_size'] * (2 if header['chroma_bits'] else 1)
+        try:
+            check_tile_size(header['tile_size'], step)
+        except ZdpException:
+            raise ZdpException('Compressed image is damaged')
+        tile_squares = header['tile_size'] / step
+        columns, rows = (x + step - 1) / step, (y + step - 1) / step
+        number_of_tiles = (columns + tile_squares - 1) / tile_squares * ((rows + tile_squares - 1) / tile_squares)
+        data = _read_data(file, 8 * (number_of_tiles + 1))
+        header['offsets'] = numpy.frombuffer(data, dtype='>u8').astype(numpy.int64)
+        # tiles follow the index in order and end within the file
+        index_end = file.tell()
+        file.seek(0, os.SEEK_END)
+        if header['offsets'][0] < index_end or numpy.any(numpy.diff(header['offsets']) < 0) or header['offsets'][-1] > file.tell():
+            raise ZdpException('Compressed image is damaged')
+    return header
+
+
+def _read_data(file, size):
+    """Read size bytes from file, short read means damaged file"""
+    data = file.read(size)
+    if len(data) != size:
+        raise ZdpException('Compressed image is damaged')
+    return data
+
+
+def _read_values(file, format):
+    return struct.unpack(format, _read_data(file, struct.calcsize(format)))
+
+
+def _read_value(file, format):
+    return _read_values(file, format)[0]
+
+
+def decompress_tiles(file, header, network, box=None, workers=1, tracker=progress.NULL_TRACKER):
+    """Read and decode tiles of compressed image version 3 or newer covering (left, upper, right, lower) box,
+       whole picture by default. With more than one worker tiles are decoded in separate processes.
+       Returns (height, width, RGB colour) array of box pixels.
+    """
+    x, y = header['size']
+    left, upper, right, lower = box if box is not None else (0, 0, x, y)
+    if not (0 <= left < right <= x and 0 <= upper < lower <= y):
+        raise ZdpException('Region must lie within the picture')
+
+    step = header['block_size']
+    shift = step / 2
+    bits, smoothing, tile_size, entropy_coding = header['bits'], header['smoothing'], header['tile_size'], header['entropy_coding']
+    chroma_bits = header['chroma_bits']
+    # grid consists of squares or, with chroma subsampling, of macroblocks
+    unit = step * (2 if chroma_bits else 1)
+    tile_squares = tile_size / unit
+    columns, rows = (x + unit - 1) / unit, (y + unit - 1) / unit
+    tile_columns = (columns + tile_squares - 1) / tile_squares
+    shifted_grid = smoothing == SMOOTHING_GRID
+
+    # shifted squares of preceding row and column cover upper and left edge of the box,
+    # deblocking needs squares on both sides of the box edges
+    margin = 1 if smoothing else 0
+    end_margin = 1 if smoothing == SMOOTHING_DEBLOCK else 0
+    first_tile_row = max(upper / unit - margin, 0) / tile_squares
+    last_tile_row = min((lower - 1) / unit + end_margin, rows - 1) / tile_squares
+    first_tile_column = max(left / unit - margin, 0) / tile_squares
+    last_tile_column = min((right - 1) / unit + end_margin, columns - 1) / tile_squares
+
+    tiles = []
+    with tracker.stage('read'):
+        for tile_row in xrange(first_tile_row, last_tile_row + 1):
+            for tile_column in xrange(first_tile_column, last_tile_column + 1):
+                index = tile_row * tile_columns + tile_column
+                file.seek(int(header['offsets'][index]))
+                data = file.read(int(header['offsets'][index + 1] - header['offsets'][index]))
+                tile_rows = min(rows, (tile_row + 1) * tile_squares) - tile_row * tile_squares
+                tile_width = min(columns, (tile_column + 1) * tile_squares) - tile_column * tile_squares
+                coded = entropy_coding
+                if entropy_coding and header['version'] >= 7:
+                    if data[:1] not in (chr(TILE_RAW), chr(TILE_ENTROPY_CODED)):
+                        raise ZdpException('Compressed image is damaged')
+                    coded, data = data[:1] == chr(TILE_ENTROPY_CODED), data[1:]
+                tiles.append((tile_row, tile_column, data, tile_rows, tile_width, coded))
+                tracker.count('bytes', len(data))
+    tracker.count('tiles', len(tiles))
+    tracker.begin(len(tiles))
+
+    legacy_lanes = header['version'] < 7
+    tasks = ((data, tile_rows, tile_width, coded, legacy_lanes) for tile_row, tile_column, data, tile_rows, tile_width, coded in tiles)
+    if workers == 1:
+        decoded = (_decode_tile(task, network, bits, shifted_grid, tracker, chroma_bits) for task in tasks)
+    else:
+        # tiles come back through slots of shared memory large enough for any tile,
+        # stage times are measured in workers and sent back with the sizes of tiles
+        tile_shape = (min(tile_size, rows * unit), min(tile_size, columns * unit), 3)
+        arrays = {'tile': (tile_shape, numpy.uint8)}
+        if shifted_grid:
+            arrays['flatten_tile'] = (tile_shape, numpy.float64)
+        slots = parallel.Slots(workers * parallel.DEPTH, arrays)
+        shared = {'network': network, 'bits': bits, 'shifted_grid': shifted_grid, 'chroma_bits': chroma_bits,
+                  'timed': tracker is not progress.NULL_TRACKER}
+        decoded = _take_tiles(parallel.imap_bounded(_decode_shared_tile, tasks, workers, shared, slots=slots), slots, tracker)
+
+    # squares of the last tiles may exceed the picture, tiles may exceed the grid
+    top, offset = first_tile_row * tile_size, first_tile_column * tile_size
+    height = min((last_tile_row + 1) * tile_size, rows * unit) - top + shift
+    width = min((last_tile_column + 1) * tile_size, columns * unit) - offset + shift
+    pixels = numpy.zeros((height, width, 3), dtype=numpy.uint8)
+    flatten_tiles = []
+    for (tile_row, tile_column, data, tile_rows, tile_width, coded), (tile, flatten_tile) in itertools.izip(tiles, decoded):
+        with tracker.stage('raster'):
+            area_top, area_left = tile_row * tile_size - top, tile_column * tile_size - offset
+            pixels[area_top:area_top + len(tile), area_left:area_left + tile.shape[1]] = tile
+            if flatten_tile is not None:
+                flatten_tiles.append((area_top + shift, area_left + shift, flatten_tile))
+        tracker.advance()
+
+    # shifted squares overlap neighbouring tiles, so they are blended when all tiles are placed
+    with tracker.stage('smooth'):
+        for area_top, area_left, flatten_tile in flatten_tiles:
+            area = pixels[area_top:area_top + len(flatten_tile), area_left:area_left + flatten_tile.shape[1]]
+            area[...] = smooth_pixels(area, flatten_tile, step)
+        if smoothing == SMOOTHING_DEBLOCK:
+            decoded_height = min((last_tile_row + 1) * tile_size, y) - top
+            decoded_width = min((last_tile_column + 1) * tile_size, x) - offset
+            pixels = deblock_pixels(pixels, decoded_width, decoded_height, bits, step)
+    return pixels[upper - top:lower - top, left - offset:right - offset]
+
+
+def _decode_tile(task, network, bits, shifted_grid, timer=progress.NULL_TRACKER, chroma_bits=None):
+    """Decode tile given by its data, size in squares, whether it is entropy coded and whether in legacy lanes.
+       Returns array of bytes of its squares and array of real values of its shifted squares, both placed in (height, width, RGB colour) raster.
+    """
+    data, tile_rows, tile_width, entropy_coding, legacy_lanes = task
+    if chroma_bits:
+        tile = _decode_macroblocks(data, tile_rows, tile_width, network, bits, chroma_bits, entropy_coding, legacy_lanes, timer)
+        with timer.stage('raster'):
+            return (tile * 255).astype(numpy.uint8), None
+    hidden_layer_length = network.code_size
+    number = (2 if shifted_grid else 1) * tile_rows * tile_width * 3
+    if entropy_coding:
+        try:
+            with timer.stage('entropy'):
+                quant_values = entropy.decode(data, bits, number, hidden_layer_length, legacy_lanes)
+        except entropy.EntropyCodingException:
+            raise ZdpException('Compressed image is damaged')
+        with timer.stage('dequantize'):
+            hidden_values = kernels.dequantify(quant_values, bits)
+        with timer.stage('decode'):
+            output_values = network.decode(hidden_values)
+    else:
+        size = bits * hidden_layer_length / 8
+        if len(data) != number * size:
+            raise ZdpException('Compressed image is damaged')
+        output_values = decode_squares(numpy.frombuffer(data, dtype=numpy.uint8).reshape(-1, size), network, bits, timer)
+    with timer.stage('raster'):
+        step = get_block_size(network)
+        rasters = [rows_to_raster(values, tile_rows, tile_width, step) for values in numpy.split(output_values, 2 if shifted_grid else 1)]
+        return (rasters[0] * 255).astype(numpy.uint8), rasters[1] if shifted_grid else None
+
+
+def _decode_macroblocks(data, tile_rows, tile_width, network, bits, chroma_bits, entropy_coding, legacy_lanes, timer):
+    """Decode tile of macroblocks, returns array of real values of its pixels placed in (height, width, RGB colour) raster"""
+    hidden_layer_length = network.code_size
+    number = tile_rows * tile_width
+    if entropy_coding:
+        luma_length = struct.unpack('>I', data[:4])[0] if len(data) >= 4 else len(data)
+        if luma_length > len(data) - 4:
+            raise ZdpException('Compressed image is damaged')
+        try:
+            with timer.stage('entropy'):
+                quant_values = (entropy.decode(data[4:4 + luma_length], bits, 4 * number, hidden_layer_length, legacy_lanes),
+                                entropy.decode(data[4 + luma_length:], chroma_bits, 2 * number, hidden_layer_length, legacy_lanes))
+        except entropy.EntropyCodingException:
+            raise ZdpException('Compressed image is damaged')
+        planes = []
+        for values, plane_bits in zip(quant_values, (bits, chroma_bits)):
+            with timer.stage('dequantize'):
+                hidden_values = kernels.dequantify(values, plane_bits)
+            with timer.stage('decode'):
+                planes.append(network.decode(hidden_values))
+        luma, chroma = planes
+    else:
+        luma_size = 4 * bits * hidden_layer_length / 8
+        if len(data) != number * get_unit_data_size(hidden_layer_length, bits, chroma_bits):
+            raise ZdpException('Compressed image is damaged')
+        bin_units = numpy.frombuffer(data, dtype=numpy.uint8).reshape(number, -1)
+        luma = decode_squares(bin_units[:, :luma_size].reshape(4 * number, -1), network, bits, timer)
+        chroma = decode_squares(bin_units[:, luma_size:].reshape(2 * number, -1), network, chroma_bits, timer)
+    with timer.stage('raster'):
+        step = get_block_size(network)
+        luma_plane = luma.reshape(tile_rows, tile_width, 2, 2, step, step).transpose(0, 2, 4, 1, 3, 5)
+        chroma_planes = chroma.reshape(tile_rows, tile_width, 2, step, step).transpose(2, 0, 3, 1, 4)
+        return colour.ycbcr_to_rgb(luma_plane.reshape(tile_rows * 2 * step, tile_width * 2 * step),
+                                   chroma_planes.reshape(2, tile_rows * step, tile_width * step))
+
+
+def _decode_shared_tile(task):
+    slot, task = task
+    timer = progress.StageTimer() if parallel.get_shared('timed') else progress.NULL_TRACKER
+    tile, flatten_tile = _decode_tile(task, parallel.get_shared('network'), parallel.get_shared('bits'), parallel.get_shared('shifted_grid'),
+                                      timer, parallel.get_shared('chroma_bits'))
+    height, width = tile.shape[:2]
+    parallel.get_slot('tile', slot)[:height, :width] = tile
+    if flatten_tile is not None:
+        parallel.get_slot('flatten_tile', slot)[:height, :width] = flatten_tile
+    return (height, width), timer.times
+
+
+def _take_tiles(results, slots, tracker):
+    """Yield tiles and shifted tiles decoded by _decode_shared_tile from their slots, tile is valid until the next one is taken"""
+    for slot, ((height, width), times) in results:
+        tracker.add_times(times)
+        tile = slots.get('tile', slot)[:height, :width]
+        flatten_tile = slots.get('flatten_tile', slot)[:height, :width].copy() if 'flatten_tile' in slots.arrays else None
+        yield tile, flatten_tile
+
+
+def decompress_rows(file, size, network, bits, smoothing, workers=1):
+    """Read and decode rows of squares written by compress_bands.
+       With more than one worker rows are decoded in separate processes.
+       Returns (height, width, RGB colour) array of picture pixels.
+    """
+    x, y = size
+    step = 8
+    shift = step / 2
+    columns, rows = (x + step - 1) / step, (y + step - 1) / step
+    record_size = 3 * columns * bits * network.code_size / 8
+    order = get_record_order(rows, smoothing)
+
+    def read_records():
+        for i in xrange(len(order)):
+            data = file.read(record_size)
+            if len(data) != record_size:
+                raise ZdpException('Compressed image is damaged')
+            yield data
+
+    records = itertools.izip(read_records(), (shifted for row, shifted in order))
+    if workers == 1:
+        bands = (_decode_record(data, network, bits, shifted) for data, shifted in records)
+    else:
+        # rows come back through slots of shared memory
+        band_shape = (step, columns * step, 3)
+        slots = parallel.Slots(workers * parallel.DEPTH, {'band': (band_shape, numpy.uint8), 'flatten_band': (band_shape, numpy.float64)})
+        bands = (slots.get('flatten_band' if shifted else 'band', slot)
+                 for slot, shifted in parallel.imap_bounded(_decode_shared_record, records, workers, {'network': network, 'bits': bits},
+                                                            slots=slots))
+
+    # squares of the last row and column may exceed the picture
+    pixels = numpy.zeros((rows * step + shift, columns * step + shift, 3), dtype=numpy.uint8)
+    for (row, shifted), band in itertools.izip(order, bands):
+        if not shifted:
+            pixels[row * step:(row + 1) * step, :columns * step] = band
+        else:
+            area = pixels[row * step + shift:(row + 1) * step + shift, shift:]
+            area[...] = smooth_pixels(area, band)
+    return pixels[:y, :x]
+
+
+def _decode_record(data, network, bits, shifted=False):
+    """Decode row of squares, returns (8, width, RGB colour) array of bytes or, for shifted row, of real values"""
+    size = bits * network.code_size / 8
+    output_values = decode_squares(numpy.frombuffer(data, dtype=numpy.uint8).reshape(-1, size), network, bits)
+    band = rows_to_raster(output_values, 1, len(output_values) / 3, 8)
+    return band if shifted else (band * 255).astype(numpy.uint8)
+
+
+def _decode_shared_record(task):
+    slot, (data, shifted) = task
+    band = _decode_record(data, parallel.get_shared('network'), parallel.get_shared('bits'), shifted)
+    parallel.get_slot('flatten_band' if shifted else 'band', slot)[...] = band
+    return shifted
+
+
+def get_record_order(rows, smoothing):
+    """List (row, shifted) pairs in the order rows of squares are stored in compressed image.
+       Row of squares shifted by half of the step follows the next row of the grid,
+       because it covers part of that row.
+    """
+    order = []
+    for row in xrange(rows):
+        order.append((row, False))
+        if smoothing and row > 0:
+            order.append((row - 1, True))
+    if smoothing:
+        order.append((rows - 1, True))
+    return order
+
+
+def decompress_squares(file, number_of_rgb_squares, network, bits, workers=1):
+    """Read and decode all squares at once.
+       With more than one worker, ranges of squares are decoded in separate processes.
+       Returns array of real values indexed by square, RGB colour and pixel.
+    """
+    hidden_layer_length = network.code_size
     size = bits * hidden_layer_length / 8
-    mask = pow(2, bits) - 1
-    squares = ([], [], [])
-    for i in xrange(number_of_rgb_squares):
-        rgb_square = ([], [], [])
-
-        # read 3 squares for each RGB colour
-        for sq in rgb_square:
-            B = 0
-            pos = 0
-            bin_square = bytearray(file.read(size))
-            for j in xrange(hidden_layer_length):
-                val = (bin_square[B] & (mask << pos & 255)) >> pos
-                pos += bits
-                if pos == 8:
-                    B += 1
-                    pos = 0
-                elif pos > 8:
-                    B += 1
-                    pos %= 8
-                    mask2 = pow(2, pos) - 1
-                    val += (bin_square[B] & mask2) << (bits - pos)
-                sq.append(val)
-
-        # dequantify read squares, decompress and place in squares
-        for i, sq in enumerate(rgb_square):
-            sq = dequantify(sq, bits)
-            for j, val in enumerate(sq):
-                network.hidden_layers[0][j].value = val
-            network.output_layer.update_values()
-            output_values = [neuron.value for neuron in network.output_layer]
-            squares[i].append(output_values)
-
-    return squares
-
-
-def get_sequence_squares(img, shift=0):
-    """Get all consecutive squares from the picture.
+    data = file.read(3 * number_of_rgb_squares * size)
+    if len(data) != 3 * number_of_rgb_squares * size:
+        raise ZdpException('Compressed image is damaged')
+
+    bin_squares = numpy.frombuffer(data, dtype=numpy.uint8).reshape(3 * number_of_rgb_squares, size)
+    if workers == 1:
+        output_values = decode_squares(bin_squares, network, bits)
+    else:
+        shared_bin_squares = parallel.SharedArray(bin_squares.shape, numpy.uint8)
+        shared_bin_squares.array()[...] = bin_squares
+        shared_output = parallel.SharedArray((len(bin_squares), network.sizes[-1]), numpy.float64)
+        shared = {'bin_squares': shared_bin_squares, 'output': shared_output, 'network': network, 'bits': bits}
+        parallel.map_ranges(_decompress_rows, len(bin_squares), workers, shared)
+        output_values = shared_output.array()
+    return output_values.reshape(number_of_rgb_squares, 3, -1)
+
+
+def _decompress_rows(bounds):
+    first, last = bounds
+    bin_squares = parallel.get_shared('bin_squares')[first:last]
+    parallel.get_shared('output')[first:last] = decode_squares(bin_squares, parallel.get_shared('network'), parallel.get_shared('bits'))
+
+
+def decode_squares(bin_squares, network, bits, timer=progress.NULL_TRACKER):
+    """Decode rows of packed quantified hidden values, returns matrix of network outputs"""
+    with timer.stage('unpack'):
+        quant_values = kernels.unpack(bin_squares, bits, network.code_size)
+    with timer.stage('dequantize'):
+        hidden_values = kernels.dequantify(quant_values, bits)
+    with timer.stage('decode'):
+        return network.decode(hidden_values)
+
+
+def get_pixels(img):
+    """Convert picture to RGB once and return its (height, width, RGB colour) array of bytes"""
+    return numpy.array(img.convert('RGB'), dtype=numpy.uint8)
+
+
+def read_bands(img, height):
+    """Yield consecutive bands of height rows of the picture as RGB arrays of bytes.
+       Pictures stored uncompressed as a single tile, like BMP, are read from the file band by band,
+       others have to be decoded at once.
+    """
+    width, image_height = img.size
+    tile = getattr(img, 'tile', None)
+    if tile and len(tile) == 1 and tile[0][0] == 'raw' and tile[0][1] == (0, 0, width, image_height):
+        offset, args = tile[0][2], tile[0][3]
+        rawmode, stride, orientation = (args, 0, 1) if isinstance(args, str) else (tuple(args) + (0, 1))[:3]
+        if stride == 0 and rawmode == img.mode:
+            stride = len(Image.new(img.mode, (width, 1)).tobytes())
+        if stride > 0:
+            for top in xrange(0, image_height, height):
+                rows = min(height, image_height - top)
+                # rows of bottom-up pictures are stored in reversed order
+                first_row = image_height - top - rows if orientation < 0 else top
+                img.fp.seek(offset + first_row * stride)
+                band = Image.frombytes(img.mode, (width, rows), img.fp.read(rows * stride), 'raw', rawmode, stride, orientation)
+                if img.mode == 'P':
+                    band.putpalette(img.palette.palette, img.palette.rawmode or img.palette.mode)
+                yield get_pixels(band)
+            return
+
+    pixels = get_pixels(img)
+    for top in xrange(0, image_height, height):
+        yield pixels[top:top + height]
+
+
+def get_grid_bands(bands, columns, smoothing=False, step=8):
+    """Yield rows of the grid of step x step squares as (step, columns * step, RGB colour) arrays of bytes,
+       ordered as in get_record_order. Right and bottom edge of the picture are padded with black so that rows consist of whole squares.
+    """
+    shift = step / 2
+    previous = None
+    for band in bands:
+        grid_band = numpy.zeros((step, columns * step + shift, 3), dtype=numpy.uint8)
+        grid_band[:len(band), :band.shape[1]] = band
+        yield grid_band[:, :columns * step]
+        if smoothing and previous is not None:
+            yield numpy.concatenate((previous[shift:, shift:], grid_band[:shift, shift:]))
+        previous = grid_band
+
+    if smoothing and previous is not None:
+        yield numpy.concatenate((previous[shift:, shift:], numpy.zeros_like(previous[:shift, shift:])))
+
+
+def band_squares(grid_band):
+    """Cut row of the grid into squares as high as the row.
        Pixel colour is converted to <0;1> value.
     """
-    x, y = img.size
-    step = 8
-    squares = []
-    for i in xrange(0 + shift, x + shift, step):
-        for j in xrange(0 + shift, y + shift, step):
-            squares.append(get_square(img, i, j, step))
+    step = len(grid_band)
+    columns = grid_band.shape[1] / step
+    blocks = grid_band.reshape(step, columns, step, 3).transpose(1, 3, 0, 2)
+    return blocks.reshape(columns, 3, step * step) / 255.0
 
-    return squares
 
+def band_macroblocks(grid_band):
+    """Cut row of the grid into macroblocks of 2 x 2 squares converted to YCbCr 4:2:0, see colour module.
+       Returns luma squares, 4 of each macroblock row by row, and chroma squares, Cb and Cr of each macroblock.
+    """
+    step = len(grid_band) / 2
+    macroblocks = grid_band.shape[1] / (2 * step)
+    luma, chroma = colour.rgb_to_ycbcr(grid_band / 255.0)
+    luma_squares = luma.reshape(2, step, macroblocks, 2, step).transpose(2, 0, 3, 1, 4)
+    chroma_squares = chroma.reshape(2, step, macroblocks, step).transpose(2, 0, 1, 3)
+    return luma_squares.reshape(4 * macroblocks, step * step), chroma_squares.reshape(2 * macroblocks, step * step)
 
-def get_square(img, x, y, size):
-    """Get tuple of size x size squares for each RGB colour
-       from the fixed position of the picture
+
+def get_random_squares(squares, number):
+    """Draw number of random single colour squares from the view made by training.get_all_squares.
+       Pixel colour is converted to <0;1> value.
     """
-    img_rgb = img.convert('RGB')
-    rgb_square = ([], [], [])
-    for i in xrange(size):
-        for j in xrange(size):
-            if x + j < img.width and y + i < img.height:
-                r, g, b = img_rgb.getpixel((x + j, y + i))
-            else:
-                r = g = b = 0
-            rgb_square[0].append(r / 255.0)
-            rgb_square[1].append(g / 255.0)
-            rgb_square[2].append(b / 255.0)
-
-    return rgb_square
-
-
-def quantify(values, bits):
-    """Quantify real numbers to the no. of bits"""
-    variants = pow(2, bits)
-    step = 1.0 / variants
-    quant = []
-    for val in values:
-        for j in range(variants):
-            if j * step <= val < (j + 1) * step:
-                quant.append(j)
-                break
-
-    return quant
-
-
-def dequantify(values, bits):
-    """Dequantifies list of values - integer values to real values"""
-    dequant = []
-    for val in values:
-        dequant.append(float(val) / (pow(2, bits) - 1))
-
-    return dequant
-
-
-def print_picture(img, squares, filename, flatten_squares=None):
-    """Print squares sequence into img
+    xs, ys, colours = [], [], []
+    for i in xrange(number):
+        xs.append(random.randint(0, squares.shape[1] - 1))
+        ys.append(random.randint(0, squares.shape[0] - 1))
+        colours.append(random.randint(0, 2))
+    return squares[ys, xs, colours].reshape(number, -1) / 255.0
+
+
+def print_picture(size, squares, filename, flatten_squares=None):
+    """Print squares sequence of compressed image version 1 into picture of given size.
        Saves under filename.
     """
-    x, y = img.size
+    x, y = size
     step = 8
-    idx = 0
-    for i in xrange(0, x, step):
-        for j in xrange(0, y, step):
-            put_square(img, i, j, (squares[0][idx], squares[1][idx], squares[2][idx]), step)
-            idx += 1
-
-    if flatten_squares:
-        idx = 0
-        for i in xrange(4, x + 4, step):
-            for j in xrange(4, y + 4, step):
-                put_smoothing_square(img, i, j, (flatten_squares[0][idx], flatten_squares[1][idx], flatten_squares[2][idx]), step)
-                idx += 1
-    img.save(filename, 'BMP')
-
-
-def put_square(img, x, y, real_values, size):
-    """Generate size x size square into given pos image from list of real_values containing numbers 0.0-1.0"""
-    idx = 0
-    for i in range(size):
-        for j in range(size):
-            if x + j < img.width and y + i < img.height:
-                img.putpixel((x + j, y + i), (int(real_values[0][idx] * 255), int(real_values[1][idx] * 255), int(real_values[2][idx] * 255)))
-            idx += 1
-
-
-def put_smoothing_square(img, x, y, real_values, size):
-    """Compare square on given pos of image with a list of 64 real_values containing numbers 0.0-1.0, and calculate avg"""
-    idx = 0
-    for i in xrange(size):
-        for j in xrange(size):
-            if x + j < img.width and y + i < img.height:
-                r, g, b = img.getpixel((x + j, y + i))
-                weight1 = (abs(i - 3) + abs(j - 3)) / 8.0
-                weight2 = 1 - weight1
-                r = min(int((real_values[0][idx] * 255 * weight2 + r * weight1)), 255)
-                g = min(int((real_values[1][idx] * 255 * weight2 + g * weight1)), 255)
-                b = min(int((real_values[2][idx] * 255 * weight2 + b * weight1)), 255)
-                img.putpixel((x + j, y + i), (r, g, b))
-            idx += 1
\ No newline at end of file
+    columns, rows = (x + step - 1) / step, (y + step - 1) / step
+    pixels = (squares_to_raster(squares, columns, rows, step)[:y, :x] * 255).astype(numpy.uint8)
+
+    if flatten_squares is not None:
+        shift = step / 2
+        flatten_pixels = squares_to_raster(flatten_squares, columns, rows, step)[:max(y - shift, 0), :max(x - shift, 0)]
+        pixels[shift:, shift:] = smooth_pixels(pixels[shift:, shift:], flatten_pixels)
+
+    Image.fromarray(pixels, 'RGB').save(filename, 'BMP')
+
+
+def smooth_pixels(pixels, flatten_pixels, step=8):
+    """Blend pixels with real values of squares shifted by half of the step.
+       The closer to the center of shifted square, the more weight it gets.
+    """
+    height, width = flatten_pixels.shape[:2]
+    distance = numpy.abs(numpy.arange(step) - (step / 2 - 1))
+    weight1 = numpy.tile(numpy.add.outer(distance, distance) / float(step), (height / step + 1, width / step + 1))
+    weight1 = weight1[:height, :width, numpy.newaxis]
+    weight2 = 1 - weight1
+    blended = flatten_pixels * 255 * weight2 + pixels[:height, :width] * weight1
+    return numpy.minimum(blended, 255).astype(numpy.uint8)
+
+
+def deblock_pixels(pixels, width, height, bits, step=8):
+    """Filter edges of step x step squares inside width x height area of (height, width, RGB colour) array of bytes.
+       Step across each edge is spread over pixels on its both sides, first along columns, then along rows.
+       Pixels are changed at most half of the square far from the edge.
+       Only edges, which look like blocking of codes quantified to bits, are filtered, see DEBLOCKING_ALPHA.
+    """
+    quantization_step = 256.0 / pow(2, bits)
+    alpha, beta = DEBLOCKING_ALPHA * quantization_step, DEBLOCKING_BETA * quantization_step
+    filtered = pixels.astype(numpy.float32)
+    for area, limit in ((filtered.swapaxes(0, 1), width), (filtered, height)):
+        number = (limit + step - 1) / step
+        blocks = area[:number * step].reshape((number, step) + area.shape[1:])
+        # pixels before and after edges between consecutive blocks
+        before, after = blocks[:-1], blocks[1:]
+        difference = after[:, 0] - before[:, step - 1]
+        blocking = ((numpy.abs(difference) < alpha) & (numpy.abs(before[:, step - 1] - before[:, step - 2]) < beta) &
+                    (numpy.abs(after[:, 1] - after[:, 0]) < beta))
+        difference *= blocking
+        for distance, weight in enumerate(DEBLOCKING_WEIGHTS[:step / 2]):
+            before[:, step - 1 - distance] += difference * weight
+            after[:, distance] -= difference * weight
+    return numpy.clip(numpy.rint(filtered), 0, 255).astype(numpy.uint8)
+
+
+def rows_to_raster(squares, rows, columns, step):
+    """Place squares ordered row by row into (height, width, RGB colour) array of real values"""
+    blocks = numpy.asarray(squares).reshape(rows, columns, 3, step, step)
+    return blocks.transpose(0, 3, 1, 4, 2).reshape(rows * step, columns * step, 3)
+
+
+def squares_to_raster(squares, columns, rows, step):
+    """Place squares ordered column by column into (height, width, RGB colour) array of real values"""
+    blocks = numpy.asarray(squares).reshape(columns, rows, 3, step, step)
+    return blocks.transpose(1, 3, 0, 4, 2).reshape(rows * step, columns * step, 3)
@@ -0,0 +1,165 @@
+"""In this module you can find lossless entropy coding of quantified hidden values.
+   Values are coded by interleaved rANS with an adaptive frequency model for every hidden neuron (context).
+   Many coder states (lanes) work in lockstep, each lane always codes values of the same neuron,
+   so a single coding step is a vector operation over all lanes. Larger matrices are coded in more lanes,
+   so that the number of steps, each of which costs a few numpy calls, stays low.
+"""
+import numpy
+
+
+SCALE_BITS = 12
+SCALE = 1 << SCALE_BITS
+STATE_LOWER_BOUND = 1 << 16
+WORD_BITS = 16
+# every lane ends with 4 bytes of state, so each lane codes at least this number of bits of raw values
+# and states take at most 1/16 of raw size, larger matrices use more lanes and fewer coding steps
+LANE_BITS = 512
+# compressed images of version 6 and older use at most 8 lanes per context of 512 rows each
+LEGACY_MAX_LANES_PER_CONTEXT = 8
+LEGACY_ROWS_PER_LANE = 512
+# frequency models are updated after this number of steps, and after steps 1, 2, 4 and so on before,
+# so that models adapt early even when a step codes many rows; legacy lanes are updated at a fixed rate
+ADAPTATION_STEPS = 8
+
+
+class EntropyCodingException(Exception):
+    pass
+
+
+def encode(symbols, bits, legacy=False):
+    """Encode (rows, contexts) matrix of integers from <0;2^bits - 1>, every column uses its own model.
+       Returns string of final lane states followed by 16 bit words in the order decoder reads them.
+       Legacy lanes are those of compressed images of version 6 and older.
+    """
+    symbols = numpy.asarray(symbols, dtype=numpy.int64)
+    rows, contexts = symbols.shape
+    lanes, steps = _geometry(rows, contexts, bits, legacy)
+    lane_symbols = _to_lanes(symbols, lanes, steps)
+    frequencies = numpy.empty((steps, lanes), dtype=numpy.int64)
+    starts = numpy.empty((steps, lanes), dtype=numpy.int64)
+
+    # model must evolve in the decoding order, but rANS encodes backwards, so it is counted in advance
+    model = _Model(contexts, pow(2, bits), lanes)
+    first = 0
+    for last in _get_adaptations(steps, legacy) + [steps]:
+        block = lane_symbols[first:last]
+        frequencies[first:last], starts[first:last] = model.lookup(block)
+        model.update(block)
+        first = last
+    # padding is coded with the whole range, which leaves states unchanged and emits nothing
+    padding = lane_symbols < 0
+    frequencies[padding], starts[padding] = SCALE, 0
+    limits = frequencies << 2 * WORD_BITS - SCALE_BITS
+
+    states = numpy.full(lanes, STATE_LOWER_BOUND, dtype=numpy.int64)
+    words = numpy.empty((steps, lanes), dtype=numpy.int64)
+    emitted = numpy.empty((steps, lanes), dtype=bool)
+    for step in xrange(steps - 1, -1, -1):
+        emit = numpy.greater_equal(states, limits[step], out=emitted[step])
+        numpy.bitwise_and(states, (1 << WORD_BITS) - 1, out=words[step])
+        states = numpy.where(emit, states >> WORD_BITS, states)
+        quotients, remainders = numpy.divmod(states, frequencies[step])
+        states = (quotients << SCALE_BITS) + remainders + starts[step]
+
+    return states.astype('<u4').tostring() + words[emitted].astype('<u2').tostring()
+
+
+def decode(data, bits, rows, contexts, legacy=False):
+    """Decode (rows, contexts) matrix of integers encoded by encode"""
+    lanes, steps = _geometry(rows, contexts, bits, legacy)
+    if len(data) < 4 * lanes or (len(data) - 4 * lanes) % 2 != 0:
+        raise EntropyCodingException('Entropy coded data is damaged')
+    states = numpy.frombuffer(data, dtype='<u4', count=lanes).astype(numpy.int64)
+    words = numpy.frombuffer(data, dtype='<u2', offset=4 * lanes).astype(numpy.int64)
+
+    # lanes code rows in order, so only the first lanes of the last step may have a row to decode
+    last_lanes = (rows - (steps - 1) * (lanes / contexts)) * contexts
+    lane_symbols = numpy.full((steps, lanes), -1, dtype=numpy.int64)
+    model = _Model(contexts, pow(2, bits), lanes)
+    adaptations = set(_get_adaptations(steps, legacy))
+    position = 0
+    first = 0
+    for step in xrange(steps):
+        active = lanes if step < steps - 1 else last_lanes
+        lane_states = states[:active]
+        slots = lane_states & SCALE - 1
+        indices = model.find(slots)
+        lane_states = model.frequencies.take(indices) * (lane_states >> SCALE_BITS) + slots - model.starts.take(indices)
+        refill = lane_states < STATE_LOWER_BOUND
+        number = numpy.count_nonzero(refill)
+        if position + number > len(words):
+            raise EntropyCodingException('Entropy coded data is damaged')
+        lane_states[refill] = lane_states[refill] << WORD_BITS | words[position:position + number]
+        position += number
+        states[:active] = lane_states
+        lane_symbols[step, :active] = indices - model.lane_indices[:active]
+        if step + 1 in adaptations:
+            model.update(lane_symbols[first:step + 1])
+            first = step + 1
+
+    if position != len(words) or (states != STATE_LOWER_BOUND).any():
+        raise EntropyCodingException('Entropy coded data is damaged')
+    return lane_symbols.reshape(-1, contexts)[:rows]
+
+
+def _geometry(rows, contexts, bits, legacy=False):
+    """Count lanes and coding steps for (rows, contexts) matrix"""
+    if legacy:
+        rows_per_step = max(min(LEGACY_MAX_LANES_PER_CONTEXT, rows / LEGACY_ROWS_PER_LANE), 1)
+    else:
+        rows_per_step = max(rows * bits / LANE_BITS, 1)
+    return rows_per_step * contexts, (rows + rows_per_step - 1) / rows_per_step
+
+
+def _get_adaptations(steps, legacy=False):
+    """Numbers of steps after which models are updated"""
+    early = [] if legacy else [pow(2, power) for power in xrange(ADAPTATION_STEPS.bit_length() - 1)]
+    return [step for step in early + range(ADAPTATION_STEPS, steps, ADAPTATION_STEPS) if step < steps]
+
+
+def _to_lanes(symbols, lanes, steps):
+    """Arrange rows of symbols into (steps, lanes) matrix, padded with -1"""
+    rows, contexts = symbols.shape
+    padded = numpy.full((steps * lanes / contexts, contexts), -1, dtype=numpy.int64)
+    padded[:rows] = symbols
+    return padded.reshape(steps, lanes)
+
+
+class _Model(object):
+    """Adaptive frequency models of all contexts, frequencies of each context sum up to SCALE.
+       Tables are flat, symbol of context is at index context * variants + symbol.
+    """
+
+    def __init__(self, contexts, variants, lanes):
+        self.counts = numpy.ones((contexts, variants), dtype=numpy.int64)
+        self.lane_indices = numpy.arange(lanes) % contexts * variants
+        # slots of every context are shifted by SCALE, so that starts of all contexts make one increasing sequence
+        self.lane_slots = numpy.arange(lanes) % contexts * SCALE
+        self.index_slots = numpy.arange(contexts * variants) / variants * SCALE
+        self._update_tables()
+
+    def lookup(self, symbols):
+        """Get frequencies and cumulative frequencies of symbols coded by lanes, -1 stands for no symbol"""
+        indices = self.lane_indices + numpy.maximum(symbols, 0)
+        return self.frequencies.take(indices), self.starts.take(indices)
+
+    def find(self, slots):
+        """Get table indices of symbols whose frequency range contains slots of the first lanes"""
+        return numpy.searchsorted(self.bounds, slots + self.lane_slots[:len(slots)], side='right') - 1
+
+    def update(self, block):
+        """Count symbols of (steps, lanes) block and update frequencies"""
+        valid = block >= 0
+        indices = (self.lane_indices + block)[valid]
+        self.counts += numpy.bincount(indices, minlength=self.counts.size).reshape(self.counts.shape)
+        self._update_tables()
+
+    def _update_tables(self):
+        contexts, variants = self.counts.shape
+        # every symbol keeps frequency at least 1, the rest is split proportionally to counts
+        totals = self.counts.sum(axis=1)[:, numpy.newaxis]
+        frequencies = 1 + self.counts * (SCALE - variants) / totals
+        frequencies[numpy.arange(contexts), self.counts.argmax(axis=1)] += SCALE - frequencies.sum(axis=1)
+        self.frequencies = frequencies.ravel()
+        self.starts = (numpy.cumsum(frequencies, axis=1) - frequencies).ravel()
+        self.bounds = self.starts + self.index_slots
@@ -1,10 +1,17 @@
+import os
 from Tkinter import *
 import tkMessageBox
 import tkFileDialog
 import ttk
 
 import compression
+import jobs
 import neural_network
+import progress
+
+
+# milliseconds between checks of job events
+POLL_INTERVAL = 100
 
 
 class Application(Tk):
@@ -29,14 +36,19 @@ class Application(Tk):
         self._init_teach_page()
         self._init_compress_page()
         self._init_decompress_page()
+        self._init_jobs_panel()
+
+        self.controller = jobs.JobController()
+        self.protocol('WM_DELETE_WINDOW', self.close)
+        self.after(POLL_INTERVAL, self.poll_events)
 
     def _init_teach_page(self):
         """Initialize entries and buttons in 'Teach' tab.
            Assign actions to buttons and set default values.
         """
         teach_button = Button(self.teach_page, text='Run',
-                              command=lambda: Application.run_button_clicked('.mkm', [('Neural network', '.mkm')], self.teach_page, self.do_teach))
-        teach_button.grid(column=2, row=9)
+                              command=lambda: self.run_button_clicked('.mkm', [('Neural network', '.mkm')], self.do_teach))
+        teach_button.grid(column=2, row=17)
 
         label = Label(self.teach_page, text='Training image', anchor='w')
         label.grid(column=0, row=0, columnspan=2, sticky='ew')
@@ -65,14 +77,36 @@ class Application(Tk):
         self.layer_size_entry.insert(0, '32')
         self.layer_size_entry.grid(column=0, row=8, sticky='ew')
 
+        label = Label(self.teach_page, text='Batch size', anchor='w')
+        label.grid(column=0, row=9, columnspan=2, sticky='ew')
+        self.batch_size_entry = Entry(self.teach_page)
+        self.batch_size_entry.insert(0, '1')
+        self.batch_size_entry.grid(column=0, row=10, sticky='ew')
+
+        label = Label(self.teach_page, text='Epochs', anchor='w')
+        label.grid(column=0, row=11, columnspan=2, sticky='ew')
+        self.epochs_entry = Entry(self.teach_page)
+        self.epochs_entry.insert(0, '1')
+        self.epochs_entry.grid(column=0, row=12, sticky='ew')
+
+        label = Label(self.teach_page, text='Block size', anchor='w')
+        label.grid(column=0, row=13, columnspan=2, sticky='ew')
+        self.block_size = IntVar(value=8)
+        self.block_size_entry = OptionMenu(self.teach_page, self.block_size, *compression.BLOCK_SIZES)
+        self.block_size_entry.grid(column=0, row=14, sticky='W')
+
+        label = Label(self.teach_page, text='Encoder layers sizes', anchor='w')
+        label.grid(column=0, row=15, columnspan=2, sticky='ew')
+        self.encoder_entry = Entry(self.teach_page)
+        self.encoder_entry.grid(column=0, row=16, sticky='ew')
+
     def _init_compress_page(self):
         """Initialize entries and buttons in 'Compress' tab.
            Assign actions to buttons and set default values.
         """
         compress_button = Button(self.compress_page, text='Run',
-                                 command=lambda: Application.run_button_clicked('.zdp', [('Compressed image', '.zdp')], self.compress_page,
-                                                                                self.do_compress))
-        compress_button.grid(column=2, row=9, sticky='sw')
+                                 command=lambda: self.run_button_clicked('.zdp', [('Compressed image', '.zdp')], self.do_compress))
+        compress_button.grid(column=2, row=11, sticky='sw')
 
         label = Label(self.compress_page, text='Image', anchor='w')
         label.grid(column=0, row=0, columnspan=2, sticky='ew')
@@ -97,17 +131,28 @@ class Application(Tk):
         self.bits_entry.insert(0, '4')
         self.bits_entry.grid(column=0, row=5, sticky='EW')
 
-        self.smoothing = BooleanVar()
-        self.smoothing_entry = Checkbutton(self.compress_page, text='Smoothing', variable=self.smoothing, onvalue=True, offvalue=False)
+        label = Label(self.compress_page, text='Smoothing', anchor='w')
+        label.grid(column=0, row=6, columnspan=2, sticky='ew')
+        self.smoothing = StringVar(value='none')
+        self.smoothing_entry = OptionMenu(self.compress_page, self.smoothing, 'none', *sorted(compression.SMOOTHING_MODES))
         self.smoothing_entry.grid(column=0, row=7, sticky='W')
 
+        self.entropy_coding = BooleanVar()
+        self.entropy_coding_entry = Checkbutton(self.compress_page, text='Entropy coding', variable=self.entropy_coding, onvalue=True,
+                                                offvalue=False)
+        self.entropy_coding_entry.grid(column=0, row=8, sticky='W')
+
+        label = Label(self.compress_page, text='Chroma bits, empty to code RGB', anchor='w')
+        label.grid(column=0, row=9, columnspan=2, sticky='ew')
+        self.chroma_bits_entry = Entry(self.compress_page)
+        self.chroma_bits_entry.grid(column=0, row=10, sticky='EW')
+
     def _init_decompress_page(self):
         """Initialize entries and buttons in 'Decompress' tab.
            Assign actions to buttons and set default values.
         """
         compress_button = Button(self.decompress_page, text='Run',
-                                 command=lambda: Application.run_button_clicked('.bmp', [('Bitmap', '.bmp')], self.decompress_page,
-                                                                                self.do_decompress))
+                                 command=lambda: self.run_button_clicked('.bmp', [('Bitmap', '.bmp')], self.do_decompress))
         compress_button.grid(column=2, row=9)
 
         label = Label(self.decompress_page, text='Compressed image', anchor='w')
@@ -127,28 +172,74 @@ class Application(Tk):
                                  command=lambda: Application.open_button_clicked(self.network_entry2, [('Neural network', '.mkm')]))
         network_button2.grid(column=1, row=3)
 
-    @staticmethod
-    def run_button_clicked(defaultextension, filetypes, parent, action):
+    def _init_jobs_panel(self):
+        """Initialize progress bar, job queue and 'Cancel' button below tabs"""
+        panel = ttk.Frame(self)
+        panel.pack(expand=1, fill='both')
+        panel.columnconfigure(0, weight=1)
+
+        self.status_label = Label(panel, text='Ready', anchor='w')
+        self.status_label.grid(column=0, row=0, columnspan=2, sticky='ew')
+        self.progress_bar = ttk.Progressbar(panel, maximum=1.0)
+        self.progress_bar.grid(column=0, row=1, sticky='ew')
+        cancel_button = Button(panel, text='Cancel', command=self.cancel_button_clicked)
+        cancel_button.grid(column=1, row=1)
+        self.times_label = Label(panel, text='', anchor='w')
+        self.times_label.grid(column=0, row=2, columnspan=2, sticky='ew')
+
+        label = Label(panel, text='Queued jobs', anchor='w')
+        label.grid(column=0, row=3, columnspan=2, sticky='ew')
+        self.jobs_list = Listbox(panel, height=4)
+        self.jobs_list.grid(column=0, row=4, columnspan=2, sticky='ew')
+
+    def run_button_clicked(self, defaultextension, filetypes, action):
         """Open dialog window so that user can choose output file.
-           Call action and show error message if any was occurred.
+           Queue job made by action or show error message if input values are wrong.
         """
         output = tkFileDialog.asksaveasfilename(defaultextension=defaultextension, filetypes=filetypes)
         if output != '':
-            label = Label(parent, text='In progress...', anchor='w')
-            label.grid(column=0, row=9, columnspan=2, sticky='ew')
-            label.update()
             try:
-                action(output)
+                self.controller.submit(action(output))
             except ValueError:
                 tkMessageBox.showerror(message='Improper input values')
-            except neural_network.NeuralNetworkException as exc:
-                tkMessageBox.showerror(message='Cannot load neural network: ' + exc.message)
             except compression.ZdpException as exc:
                 tkMessageBox.showerror(message=exc.message)
-            except IOError as exc:
-                tkMessageBox.showerror(message='Cannot load neural network: ' + exc.strerror)
-            finally:
-                label.destroy()
+
+    def cancel_button_clicked(self):
+        """Cancel job selected in queue, the running one if none is selected"""
+        selection = self.jobs_list.curselection()
+        pending = self.controller.pending()
+        if selection and int(selection[0]) < len(pending):
+            self.controller.cancel(pending[int(selection[0])])
+        else:
+            self.controller.cancel()
+
+    def poll_events(self):
+        """Show progress and results of jobs, it is called periodically by Tk main loop"""
+        events = self.controller.get_events()
+        for kind, job in events:
+            if kind == jobs.RUNNING:
+                self.status_label.config(text='%s... %d%%' % (job.name, 100 * job.fraction()))
+                self.progress_bar['value'] = job.fraction()
+                self.times_label.config(text=progress.format_times(job.times, 4))
+            elif kind == jobs.DONE:
+                self.status_label.config(text='%s completed' % job.name)
+                self.progress_bar['value'] = 1.0
+                self.times_label.config(text=progress.format_times(job.times, 4))
+            elif kind == jobs.CANCELLED:
+                self.status_label.config(text='%s cancelled' % job.name)
+            elif kind == jobs.FAILED:
+                self.status_label.config(text='%s failed' % job.name)
+                tkMessageBox.showerror(message=get_error_message(job.error))
+        if events:
+            self.jobs_list.delete(0, END)
+            for job in self.controller.pending():
+                self.jobs_list.insert(END, job.name)
+        self.after(POLL_INTERVAL, self.poll_events)
+
+    def close(self):
+        self.controller.close()
+        self.destroy()
 
     @staticmethod
     def open_button_clicked(entry, filetypes=[]):
@@ -158,11 +249,32 @@ class Application(Tk):
         entry.insert(0, filename)
 
     def do_teach(self, output):
-        compression.teach(output, self.training_image_entry.get(), int(self.repetitions_entry.get()), float(self.rate_entry.get()),
-                          int(self.layer_size_entry.get()))
+        return jobs.Job('Teaching ' + os.path.basename(output), output, compression.teach, output, self.training_image_entry.get(),
+                        int(self.repetitions_entry.get()), float(self.rate_entry.get()), int(self.layer_size_entry.get()),
+                        int(self.batch_size_entry.get()), int(self.epochs_entry.get()), self.block_size.get(),
+                        [int(size) for size in self.encoder_entry.get().replace(',', ' ').split()])
 
     def do_compress(self, output):
-        compression.compress(self.image_entry.get(), self.network_entry.get(), output, int(self.bits_entry.get()), self.smoothing.get())
+        bits = int(self.bits_entry.get())
+        smoothing = compression.SMOOTHING_MODES.get(self.smoothing.get(), compression.SMOOTHING_NONE)
+        chroma_bits = int(self.chroma_bits_entry.get()) if self.chroma_bits_entry.get().strip() else None
+        compression.check_compress_arguments(bits, smoothing=smoothing, chroma_bits=chroma_bits)
+        return jobs.Job('Compressing ' + os.path.basename(self.image_entry.get()), output, compression.compress, self.image_entry.get(),
+                        self.network_entry.get(), output, bits, smoothing, entropy_coding=self.entropy_coding.get(), chroma_bits=chroma_bits)
 
     def do_decompress(self, output):
-        compression.decompress(self.compressed_image_entry.get(), self.network_entry2.get(), output)
\ No newline at end of file
+        return jobs.Job('Decompressing ' + os.path.basename(self.compressed_image_entry.get()), output, compression.decompress,
+                        self.compressed_image_entry.get(), self.network_entry2.get(), output)
+
+
+def get_error_message(exc):
+    """Message shown to user when job failed with exc"""
+    if isinstance(exc, ValueError):
+        return 'Improper input values'
+    if isinstance(exc, neural_network.NeuralNetworkException):
+        return 'Cannot load neural network: ' + exc.message
+    if isinstance(exc, compression.ZdpException):
+        return exc.message
+    if isinstance(exc, IOError):
+        return 'Cannot load neural network: ' + exc.strerror
+    return str(exc)
\ No newline at end of file
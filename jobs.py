@@ -0,0 +1,183 @@
+"""In this module you can find running of teaching, compression and decompression jobs in a background thread.
+   Jobs are queued and run one by one, so that the caller, for example the GUI, is never blocked.
+   Controller puts events about jobs to a queue, which the caller polls, and job fields hold the latest progress.
+   Running job is cancelled through a progress hook, which stops the work loop at its next step, see progress module.
+   Nothing here depends on Tkinter, so jobs can be driven without a window.
+"""
+import os
+import Queue
+import threading
+
+import progress
+
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+
+class Job(object):
+    """Call of function(*args, **kwargs) which writes output file.
+       Progress fields (done, total, times) are updated while the job runs, report is set when it is done.
+    """
+
+    def __init__(self, name, output, function, *args, **kwargs):
+        self.name = name
+        self.output = output
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.state = QUEUED
+        self.done = 0
+        self.total = 0
+        self.times = {}
+        self.report = None
+        self.error = None
+        self.cancel_requested = False
+
+    def fraction(self):
+        """Done part of the job from 0 to 1"""
+        return float(self.done) / self.total if self.total else 0.0
+
+
+class JobController(object):
+    """Runs submitted jobs in order in a single worker thread.
+       Events are (kind, job) pairs, where kind is one of job states.
+       Progress events have kind RUNNING and come at most once per hook interval.
+    """
+
+    def __init__(self, interval=0.1):
+        self.events = Queue.Queue()
+        self.jobs = []
+        self.current = None
+        self.lock = threading.Condition()
+        self.closed = False
+        self.hook = _JobHook(self, interval)
+        progress.add_hook(self.hook)
+        self.thread = threading.Thread(target=self._work)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, job):
+        with self.lock:
+            if self.closed:
+                raise RuntimeError('Job controller is closed')
+            self.jobs.append(job)
+            self.lock.notify()
+        self.events.put((QUEUED, job))
+        return job
+
+    def cancel(self, job=None):
+        """Cancel given job or the running one. Queued job is just removed from queue."""
+        with self.lock:
+            job = job or self.current
+            if job is None or job.state not in (QUEUED, RUNNING):
+                return
+            job.cancel_requested = True
+            if job in self.jobs:
+                self.jobs.remove(job)
+                job.state = CANCELLED
+                self.events.put((CANCELLED, job))
+
+    def cancel_all(self):
+        with self.lock:
+            for job in list(self.jobs) + [self.current]:
+                if job is not None:
+                    self.cancel(job)
+
+    def pending(self):
+        """Queued jobs in order of running"""
+        with self.lock:
+            return list(self.jobs)
+
+    def get_events(self):
+        """All events which came since the last call, it does not block"""
+        events = []
+        while True:
+            try:
+                events.append(self.events.get_nowait())
+            except Queue.Empty:
+                return events
+
+    def wait(self):
+        """Block until all submitted jobs are over"""
+        with self.lock:
+            while self.jobs or self.current is not None:
+                self.lock.wait(0.1)
+
+    def close(self, cancel=True):
+        """Stop worker thread when the running job is over, remaining queued jobs are cancelled if cancel is set"""
+        if cancel:
+            self.cancel_all()
+        with self.lock:
+            self.closed = True
+            self.lock.notify()
+        self.thread.join()
+        progress.remove_hook(self.hook)
+
+    def _work(self):
+        while True:
+            with self.lock:
+                while not self.jobs and not self.closed:
+                    self.lock.wait()
+                if not self.jobs:
+                    return
+                job = self.current = self.jobs.pop(0)
+                job.state = RUNNING
+            self.events.put((RUNNING, job))
+            self._run(job)
+            with self.lock:
+                self.current = None
+                self.lock.notify_all()
+            self.events.put((job.state, job))
+
+    def _run(self, job):
+        try:
+            job.function(*job.args, **job.kwargs)
+            job.state = DONE
+        except progress.Cancelled:
+            job.state = CANCELLED
+        except Exception as exc:
+            job.error = exc
+            job.state = FAILED
+        if job.state == CANCELLED and job.output and os.path.isfile(job.output):
+            # partly written output is of no use
+            os.remove(job.output)
+
+
+class _JobHook(progress.Hook):
+    """Passes progress of operations run by the controller thread to the running job and stops cancelled job"""
+
+    def __init__(self, controller, interval):
+        self.controller = controller
+        self.interval = interval
+
+    def started(self, operation, total):
+        job = self._get_job()
+        if job is not None:
+            job.done, job.total = 0, total
+            self._update(job)
+
+    def progress(self, operation, done, total, times):
+        job = self._get_job()
+        if job is not None:
+            job.done, job.total, job.times = done, total, dict(times)
+            self._update(job)
+
+    def finished(self, operation, report):
+        job = self._get_job()
+        if job is not None:
+            job.times = dict(report['stages'])
+            job.report = report
+
+    def _get_job(self):
+        if threading.current_thread() is self.controller.thread:
+            return self.controller.current
+        return None
+
+    def _update(self, job):
+        if job.cancel_requested:
+            raise progress.Cancelled()
+        self.controller.events.put((RUNNING, job))
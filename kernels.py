@@ -0,0 +1,48 @@
+"""In this module you can find array kernels used by compression to quantify network values
+   and pack them into bytes. Every function works on whole matrices, one row per square colour.
+   Values are packed starting from the least significant bit of the first byte,
+   a value may continue in the next byte.
+"""
+import numpy
+
+
+def quantify(values, bits):
+    """Quantify matrix of real numbers from <0;1> to integers from <0;2^bits - 1>"""
+    variants = pow(2, bits)
+    return numpy.clip(numpy.floor(numpy.asarray(values) * variants), 0, variants - 1).astype(numpy.uint8)
+
+
+def dequantify(values, bits):
+    """Dequantify matrix of integers from <0;2^bits - 1> to real numbers from <0;1>"""
+    return numpy.asarray(values) / float(pow(2, bits) - 1)
+
+
+def pack(values, bits):
+    """Pack each row of integers of bits width into bytes.
+       Rows are padded with zero bits to whole bytes.
+    """
+    values = numpy.asarray(values, dtype=numpy.uint64)
+    rows, length = values.shape
+    # 8 values of bits width fill exactly bits bytes of a 64 bit word
+    groups = (length + 7) / 8
+    padded = numpy.zeros((rows, groups * 8), dtype=numpy.uint64)
+    padded[:, :length] = values
+    shifts = numpy.arange(0, 8 * bits, bits, dtype=numpy.uint64)
+    words = numpy.bitwise_or.reduce(padded.reshape(rows, groups, 8) << shifts, axis=2)
+    data = words.astype('<u8').view(numpy.uint8).reshape(rows, groups, 8)[:, :, :bits]
+    return numpy.ascontiguousarray(data.reshape(rows, groups * bits)[:, :(length * bits + 7) / 8])
+
+
+def unpack(data, bits, length):
+    """Unpack length integers of bits width from each row of bytes made by pack"""
+    data = numpy.asarray(data, dtype=numpy.uint8)
+    rows = len(data)
+    groups = (length + 7) / 8
+    padded_data = numpy.zeros((rows, groups * bits), dtype=numpy.uint8)
+    padded_data[:, :data.shape[1]] = data
+    padded = numpy.zeros((rows, groups, 8), dtype=numpy.uint8)
+    padded[:, :, :bits] = padded_data.reshape(rows, groups, bits)
+    words = padded.view('<u8').reshape(rows, groups, 1)
+    shifts = numpy.arange(0, 8 * bits, bits, dtype=numpy.uint64)
+    values = (words >> shifts) & numpy.uint64(pow(2, bits) - 1)
+    return values.reshape(rows, groups * 8)[:, :length].astype(numpy.uint8)
@@ -1,47 +1,293 @@
 """In this module you can find implementation of neural network.
    NeuralNetwork allows to create network with input and output layer and 0 or more hidden layers.
    All layer must contain at least single neuron.
+   One of hidden layers is the bottleneck, whose values are the code of compressed input,
+   layers up to it form the encoder and the following ones the decoder.
+   Encoder and Decoder halves can be saved and loaded alone, so that decompression reads only decoder weights.
+   Weights between consecutive layers are kept in dense numpy matrices,
+   so a forward or backward pass is a matrix-vector product per layer.
+   Network is taught in float64, but encoding and decoding can run in float32 with float32 or int8 weights,
+   the chosen weights type is saved in the network file, see convert_precision.
 """
-import math
-import random
 import pickle
-import sys
+import random
+import struct
+
+import numpy
 
 
 def sigmoid_function(x):
-    return 1 / (1 + math.exp(-x))
+    # exp overflows to infinity for large negative x, mostly in float32, which still gives the right value 0
+    with numpy.errstate(over='ignore'):
+        return 1 / (1 + numpy.exp(-x))
+
+
+# network file starts with a header: magic, format version, activation function, weights type,
+# number of layers and learning rate, followed by layer sizes, since version 2 by index of bottleneck layer
+# and since version 3 by stored part of the network; halves keep sizes of all layers, but weights of their layers only;
+# int8 weights are followed by scale of every stored matrix;
+# weight matrices are stored row by row after the header, aligned to 16 bytes
+MAGIC = 'MKM\x00'
+VERSION = 3
+HEADER_FORMAT = '<4sHBBHd'
+BOTTLENECK_FORMAT = '<H'
+PART_FORMAT = '<B'
+SCALE_FORMAT = '<f'
+WHOLE = 0
+ENCODER = 1
+DECODER = 2
+PART_NAMES = {WHOLE: 'whole network', ENCODER: 'encoder', DECODER: 'decoder'}
+SIGMOID = 0
+# weights type sets also the precision of inference: float32 weights of networks saved by older versions
+# are multiplied in float64, the other types in float32; int8 weights are real weights divided by scale of their matrix
+FLOAT32 = 0
+FLOAT32_SINGLE = 1
+INT8_SINGLE = 2
+WEIGHTS_TYPES = {FLOAT32: numpy.dtype('<f4'), FLOAT32_SINGLE: numpy.dtype('<f4'), INT8_SINGLE: numpy.dtype('i1')}
+PRODUCT_TYPES = {FLOAT32: numpy.float64, FLOAT32_SINGLE: numpy.float32, INT8_SINGLE: numpy.float32}
+PRECISIONS = {'float64': FLOAT32, 'float32': FLOAT32_SINGLE, 'int8': INT8_SINGLE}
+INT8_MAX = 127
+# fractions of the largest weight tried as clipping range of int8 matrix by calibrate_scales
+INT8_CLIPPING = (1.0, 0.95, 0.9, 0.85, 0.8, 0.75, 0.7, 0.6, 0.5)
+MAX_LAYER_SIZE = 1 << 16
 
 
 def save(neural_network, filename):
-    if type(neural_network) is NeuralNetwork:
-        try:
-            pickle.dump(neural_network, open(filename, 'wb'), pickle.HIGHEST_PROTOCOL)
-        except RuntimeError:
-            # recursion limit exceeded, try with bigger one
-            sys.setrecursionlimit(sys.getrecursionlimit() * 10)
-            pickle.dump(neural_network, open(filename, 'wb'), pickle.HIGHEST_PROTOCOL)
-    else:
+    """Save network or its Encoder or Decoder half with its weights type"""
+    parts = {NeuralNetwork: WHOLE, Encoder: ENCODER, Decoder: DECODER}
+    if type(neural_network) not in parts:
         raise NeuralNetworkException('Given neural network is not a type of ' + NeuralNetwork.__name__)
 
+    sizes = neural_network.sizes
+    learning_rate = getattr(neural_network, 'learning_rate', 0.0)
+    weights_type = neural_network.weights_type
+    header = struct.pack(HEADER_FORMAT, MAGIC, VERSION, SIGMOID, weights_type, len(sizes), learning_rate)
+    header += struct.pack('<%dI' % len(sizes), *sizes)
+    header += struct.pack(BOTTLENECK_FORMAT, neural_network.bottleneck + 1)
+    header += struct.pack(PART_FORMAT, parts[type(neural_network)])
+    scales = neural_network.scales if weights_type == INT8_SINGLE else []
+    for scale in scales:
+        header += struct.pack(SCALE_FORMAT, scale)
+    with open(filename, 'wb') as file:
+        file.write(header)
+        file.write('\x00' * (_weights_offset(len(sizes), VERSION, len(scales)) - len(header)))
+        for i, weights in enumerate(neural_network.weights):
+            if weights_type == INT8_SINGLE:
+                weights = quantize_weights(weights, scales[i])
+            file.write(numpy.asarray(weights, dtype=WEIGHTS_TYPES[weights_type]).tostring())
+
 
 def load(filename):
-    neural_network = pickle.load(open(filename, 'rb'))
+    """Load network saved by save. Float32 weight matrices are memory-mapped copy-on-write,
+       so changing them does not affect the file, int8 weights are multiplied by their scales into float32 matrices.
+    """
+    header = _read_header(filename)
+    if header['part'] != WHOLE:
+        raise NeuralNetworkException('File contains only ' + PART_NAMES[header['part']])
+    sizes = header['sizes']
+    neural_network = NeuralNetwork(sizes[0], sizes[1:-1], sizes[-1], header['learning_rate'], header['bottleneck'] - 1)
+    neural_network.weights_type = header['weights_type']
+    neural_network.scales = header['scales']
+    for layer, weights in zip(neural_network.layers[1:], _map_weights(filename, header, 0, len(sizes) - 1)):
+        layer.weights = weights
+    return neural_network
+
+
+def load_encoder(filename):
+    """Load encoder saved by save or encoder half of saved network, weights of decoder are not read"""
+    header = _read_header(filename)
+    if header['part'] == DECODER or len(header['sizes']) <= 2:
+        raise NeuralNetworkException('File does not contain encoder')
+    last = header['bottleneck']
+    return Encoder(header['sizes'], header['bottleneck'] - 1, _map_weights(filename, header, 0, last), header['weights_type'],
+                   _get_scales(header, 0, last))
+
+
+def load_decoder(filename):
+    """Load decoder saved by save or decoder half of saved network, weights of encoder are not read"""
+    header = _read_header(filename)
+    if header['part'] == ENCODER or len(header['sizes']) <= 2:
+        raise NeuralNetworkException('File does not contain decoder')
+    first, last = header['bottleneck'], len(header['sizes']) - 1
+    return Decoder(header['sizes'], header['bottleneck'] - 1, _map_weights(filename, header, first, last), header['weights_type'],
+                   _get_scales(header, first, last))
+
+
+def _read_header(filename):
+    """Read and check header of network file, returns dictionary of its fields"""
+    with open(filename, 'rb') as file:
+        header = file.read(struct.calcsize(HEADER_FORMAT))
+        if len(header) != struct.calcsize(HEADER_FORMAT) or not header.startswith(MAGIC):
+            raise NeuralNetworkException('Unknown file format, networks saved by older versions have to be converted first')
+        magic, version, activation, weights_type, number_of_layers, learning_rate = struct.unpack(HEADER_FORMAT, header)
+        if not 1 <= version <= VERSION:
+            raise NeuralNetworkException('Unsupported file version %d' % version)
+        if activation != SIGMOID or weights_type not in WEIGHTS_TYPES:
+            raise NeuralNetworkException('Unsupported activation function or weights type')
+        if number_of_layers < 2:
+            raise NeuralNetworkException('Network must contain at least input and output layer')
+        data = file.read(4 * number_of_layers)
+        if len(data) != 4 * number_of_layers:
+            raise NeuralNetworkException('Network file is damaged')
+        sizes = struct.unpack('<%dI' % number_of_layers, data)
+        if not all(0 < size <= MAX_LAYER_SIZE for size in sizes):
+            raise NeuralNetworkException('Improper layer size')
+        # networks of version 1 use the first hidden layer as bottleneck, files of versions 1 and 2 contain whole networks
+        bottleneck, part = 1, WHOLE
+        if version >= 2:
+            bottleneck = _read_field(file, BOTTLENECK_FORMAT)
+        if version >= 3:
+            part = _read_field(file, PART_FORMAT)
+        if number_of_layers > 2 and not 0 < bottleneck < number_of_layers - 1 or part not in PART_NAMES:
+            raise NeuralNetworkException('Improper bottleneck layer or part of network')
+        stored_first, stored_last = _get_stored_layers(sizes, bottleneck, part)
+        scales = None
+        if weights_type == INT8_SINGLE:
+            scales = [_read_field(file, SCALE_FORMAT) for i in xrange(stored_last - stored_first)]
+            if not all(scale > 0 for scale in scales):
+                raise NeuralNetworkException('Network file is damaged')
+        file.seek(0, 2)
+        file_size = file.tell()
+    return {'version': version, 'weights_type': weights_type, 'learning_rate': learning_rate, 'sizes': sizes, 'bottleneck': bottleneck,
+            'part': part, 'scales': scales, 'file_size': file_size}
+
+
+def _read_field(file, field_format):
+    data = file.read(struct.calcsize(field_format))
+    if len(data) != struct.calcsize(field_format):
+        raise NeuralNetworkException('Network file is damaged')
+    return struct.unpack(field_format, data)[0]
+
+
+def _map_weights(filename, header, first, last):
+    """Memory-map weight matrices from first to last - 1 of network of given header, they must be stored in file"""
+    sizes = header['sizes']
+    stored_first, stored_last = _get_stored_layers(sizes, header['bottleneck'], header['part'])
+    counts = [rows * columns for rows, columns in zip(sizes[:-1], sizes[1:])]
+    dtype = WEIGHTS_TYPES[header['weights_type']]
+    offset = _weights_offset(len(sizes), header['version'], len(header['scales'] or []))
+    if header['file_size'] != offset + sum(counts[stored_first:stored_last]) * dtype.itemsize:
+        raise NeuralNetworkException('Network file is damaged')
+
+    offset += sum(counts[stored_first:first]) * dtype.itemsize
+    data = numpy.memmap(filename, dtype=dtype, mode='c', offset=offset, shape=(sum(counts[first:last]),))
+    weights = []
+    start = 0
+    for rows, columns in zip(sizes[first:last], sizes[first + 1:last + 1]):
+        weights.append(data[start:start + rows * columns].reshape(rows, columns))
+        start += rows * columns
+    if header['weights_type'] == INT8_SINGLE:
+        weights = [dequantize_weights(matrix, scale) for matrix, scale in zip(weights, _get_scales(header, first, last))]
+    return weights
+
+
+def _get_stored_layers(sizes, bottleneck, part):
+    """First and last + 1 weight matrix stored in file of given part of network, bottleneck is index of its layer"""
+    return {WHOLE: (0, len(sizes) - 1), ENCODER: (0, bottleneck), DECODER: (bottleneck, len(sizes) - 1)}[part]
+
+
+def _get_scales(header, first, last):
+    """Scales of int8 weight matrices from first to last - 1, None for other weights types"""
+    if header['scales'] is None:
+        return None
+    stored_first = _get_stored_layers(header['sizes'], header['bottleneck'], header['part'])[0]
+    return header['scales'][first - stored_first:last - stored_first]
+
+
+def load_pickle(filename):
+    """Load network pickled by older versions. Pickle can execute any code, so load only trusted files."""
+    neural_network = _LegacyUnpickler(open(filename, 'rb')).load()
     if type(neural_network) is not NeuralNetwork:
         raise NeuralNetworkException('Loaded neural network is not a type of ' + NeuralNetwork.__name__)
     return neural_network
 
 
+def convert(pickle_filename, filename):
+    """Convert network pickled by older versions to the current file format"""
+    save(load_pickle(pickle_filename), filename)
+
+
+def _weights_offset(number_of_layers, version, number_of_scales=0):
+    header_size = struct.calcsize(HEADER_FORMAT) + 4 * number_of_layers + struct.calcsize(SCALE_FORMAT) * number_of_scales
+    if version >= 2:
+        header_size += struct.calcsize(BOTTLENECK_FORMAT)
+    if version >= 3:
+        header_size += struct.calcsize(PART_FORMAT)
+    return (header_size + 15) / 16 * 16
+
+
+def quantize_weights(weights, scale):
+    """Round weights divided by scale to int8 values from <-127;127>"""
+    return numpy.clip(numpy.round(numpy.asarray(weights) / scale), -INT8_MAX, INT8_MAX).astype(numpy.int8)
+
+
+def dequantize_weights(weights, scale):
+    """Float32 matrix of int8 weights multiplied by scale"""
+    return numpy.asarray(weights, dtype=numpy.float32) * numpy.float32(scale)
+
+
+def calibrate_scales(weights, inputs):
+    """Choose scale of int8 values of each weight matrix of consecutive layers for given rows of first layer values,
+       for example squares of the training picture. Largest weights may be clipped, when rounding of the other ones
+       causes greater squared error of the products. Values are passed on through already quantized layers,
+       so that each scale makes up for the errors of the previous ones.
+    """
+    values = numpy.asarray(inputs, dtype=numpy.float32)
+    scales = []
+    for matrix in weights:
+        matrix = numpy.asarray(matrix, dtype=numpy.float32)
+        reference = numpy.dot(values, matrix)
+        largest = max(float(numpy.abs(matrix).max()), 1e-30)
+        best_error, best_scale = None, None
+        for clipping in INT8_CLIPPING:
+            scale = largest * clipping / INT8_MAX
+            error = numpy.mean((numpy.dot(values, dequantize_weights(quantize_weights(matrix, scale), scale)) - reference) ** 2)
+            if best_error is None or error < best_error:
+                best_error, best_scale = error, scale
+        scales.append(best_scale)
+        values = sigmoid_function(numpy.dot(values, dequantize_weights(quantize_weights(matrix, best_scale), best_scale)))
+    return scales
+
+
+def convert_precision(neural_network, weights_type, inputs=None):
+    """Copy of network with given weights type. Inputs are rows of input layer values calibrating scales of int8 weights,
+       without them weights are not clipped. Weights of the copy are what the network file will keep, see save.
+    """
+    if weights_type not in WEIGHTS_TYPES:
+        raise NeuralNetworkException('Unsupported weights type')
+    sizes = neural_network.sizes
+    copy = NeuralNetwork(sizes[0], sizes[1:-1], sizes[-1], neural_network.learning_rate, neural_network.bottleneck)
+    copy.weights_type = weights_type
+    weights = [numpy.array(matrix, dtype=numpy.float32) for matrix in neural_network.weights]
+    if weights_type == INT8_SINGLE:
+        if inputs is None:
+            copy.scales = [max(float(numpy.abs(matrix).max()), 1e-30) / INT8_MAX for matrix in weights]
+        else:
+            copy.scales = calibrate_scales(weights, inputs)
+        weights = [dequantize_weights(quantize_weights(matrix, scale), scale) for matrix, scale in zip(weights, copy.scales)]
+    for layer, matrix in zip(copy.layers[1:], weights):
+        layer.weights = matrix
+    return copy
+
+
 class NeuralNetworkException(Exception):
     pass
 
 
 class NeuralNetwork(object):
-    """Neural network containing single hidden layer.
+    """Neural network containing input, output and 0 or more hidden layers.
+       Bottleneck is index of the hidden layer used as code by encode and decode.
+       Weights type sets precision of encode and decode, int8 weights keep scale of each matrix in scales.
        Teaching algorithm uses error backpropagation.
     """
 
-    def __init__(self, input_layer_size, hidden_layers_sizes, output_layer_size, learning_rate=0.5):
+    def __init__(self, input_layer_size, hidden_layers_sizes, output_layer_size, learning_rate=0.5, bottleneck=0):
+        if hidden_layers_sizes and not 0 <= bottleneck < len(hidden_layers_sizes):
+            raise NeuralNetworkException('Improper bottleneck layer')
         self.learning_rate = learning_rate
+        self.bottleneck = bottleneck
+        self.weights_type = FLOAT32
+        self.scales = None
         self.input_layer = Layer(input_layer_size)
         self.hidden_layers = [Layer(hidden_layers_sizes[i]) for i in xrange(len(hidden_layers_sizes))]
         self.output_layer = Layer(output_layer_size)
@@ -49,30 +295,73 @@ class NeuralNetwork(object):
         for hidden_layer in self.hidden_layers:
             self._init_edges(hidden_layer)
 
+    def __setstate__(self, state):
+        if hasattr(state['input_layer'], 'neurons'):
+            state = self._convert_legacy_state(state)
+        state.setdefault('bottleneck', 0)
+        state.setdefault('weights_type', FLOAT32)
+        state.setdefault('scales', None)
+        self.__dict__.update(state)
+
+    @property
+    def layers(self):
+        return [self.input_layer] + self.hidden_layers + [self.output_layer]
+
+    @property
+    def code_layer(self):
+        return self.hidden_layers[self.bottleneck]
+
+    @property
+    def sizes(self):
+        return [len(layer) for layer in self.layers]
+
+    @property
+    def code_size(self):
+        return len(self.code_layer)
+
+    @property
+    def weights(self):
+        """Weight matrices of consecutive layers, weights[k][i, j] connects
+           neuron i of layer k with neuron j of layer k + 1
+        """
+        return [layer.weights for layer in self.layers[1:]]
+
     def init_weights(self):
         """Initialize all network edges with random values from <-1; 1>"""
-        for neuron in self.input_layer:
-            for edge in neuron.outgoing_edges:
-                edge.weight = random.uniform(-1, 1)
-
-        for hidden_layer in self.hidden_layers:
-            for neuron in hidden_layer:
-                for edge in neuron.outgoing_edges:
-                    edge.weight = random.uniform(-1, 1)
+        for layer in self.layers[1:]:
+            rows, columns = layer.weights.shape
+            layer.weights = numpy.array([[random.uniform(-1, 1) for j in xrange(columns)] for i in xrange(rows)])
 
     def run(self, input):
         """Counts and returns network output for given input"""
         if len(input) != len(self.input_layer):
             raise NeuralNetworkException('Improper input size')
 
-        for i, neuron in enumerate(self.input_layer, start=0):
-            neuron.value = input[i]
+        self.input_layer.values = numpy.array(input, dtype=numpy.float64)
 
         for hidden_layer in self.hidden_layers:
             hidden_layer.update_values()
         self.output_layer.update_values()
 
-        return [neuron.value for neuron in self.output_layer]
+        return self.output_layer.values.tolist()
+
+    def encoder(self):
+        """Encoder half of the network, it shares weights with the network"""
+        scales = self.scales and self.scales[:self.bottleneck + 1]
+        return Encoder(self.sizes, self.bottleneck, self.weights[:self.bottleneck + 1], self.weights_type, scales)
+
+    def decoder(self):
+        """Decoder half of the network, it shares weights with the network"""
+        scales = self.scales and self.scales[self.bottleneck + 1:]
+        return Decoder(self.sizes, self.bottleneck, self.weights[self.bottleneck + 1:], self.weights_type, scales)
+
+    def encode(self, inputs):
+        """Counts bottleneck layer values for each row of inputs matrix"""
+        return self.encoder().encode(inputs)
+
+    def decode(self, hidden_values):
+        """Counts network output for each row of bottleneck layer values matrix"""
+        return self.decoder().decode(hidden_values)
 
     def teach_step(self, input, target):
         """Calculate network output. Compare it with target and calculate errors.
@@ -84,30 +373,63 @@ class NeuralNetwork(object):
             raise NeuralNetworkException('Improper target size')
 
         self.run(input)
-        self._propagate_error(target)
+        self._propagate_error(numpy.asarray(target, dtype=numpy.float64))
+
+    def teach_batch(self, inputs, targets):
+        """Teach network with a mini-batch of samples given as rows of inputs and targets matrices.
+           Weights are adjusted once by the average of samples' corrections.
+           Returns mean squared error of network output counted before the adjustment.
+        """
+        inputs = numpy.asarray(inputs, dtype=numpy.float64)
+        targets = numpy.asarray(targets, dtype=numpy.float64)
+        if inputs.ndim != 2 or inputs.shape[1] != len(self.input_layer):
+            raise NeuralNetworkException('Improper input size')
+        if targets.shape != (len(inputs), len(self.output_layer)):
+            raise NeuralNetworkException('Improper target size')
+
+        layers = self.layers
+        values = [inputs]
+        for layer in layers[1:]:
+            values.append(sigmoid_function(numpy.dot(values[-1], layer.weights)))
+
+        output = values[-1]
+        errors = output * (1 - output) * (targets - output)
+        for k in xrange(len(layers) - 1, 0, -1):
+            previous_errors = numpy.dot(errors, layers[k].weights.T) * values[k - 1] * (1 - values[k - 1])
+            layers[k].weights += self.learning_rate * numpy.dot(values[k - 1].T, errors) / len(inputs)
+            errors = previous_errors
+
+        return numpy.mean((targets - output) ** 2)
 
     def _init_edges(self, layer):
-        """Creates all possible connection between neurons in network"""
-        for neuron_begin in layer:
-            for neuron_end in self._get_layer_successor(layer):
-                edge = Edge(neuron_begin, neuron_end)
-                neuron_begin.outgoing_edges.append(edge)
-                neuron_end.ingoing_edges.append(edge)
+        """Creates all possible connection between neurons of layer and its successor"""
+        successor = self._get_layer_successor(layer)
+        successor.predecessor = layer
+        successor.weights = numpy.zeros((len(layer), len(successor)))
 
     def _propagate_error(self, target):
         """Implementation of error backpropagation algorithm step.
-           Counts error for each neuron and updates all weights
+           Counts error for each layer and updates all weights
         """
-        for i, neuron in enumerate(self.output_layer, start=0):
-            neuron.update_error(target[i])
-            for edge in neuron.ingoing_edges:
-                edge.update_weight(self.learning_rate)
-
-        for hidden_layer in self.hidden_layers:
-            for neuron in hidden_layer:
-                neuron.update_error()
-                for edge in neuron.ingoing_edges:
-                    edge.update_weight(self.learning_rate)
+        output = self.output_layer
+        output.errors = output.values * (1 - output.values) * (target - output.values)
+        successor = output
+        for hidden_layer in reversed(self.hidden_layers):
+            hidden_layer.errors = numpy.dot(successor.weights, successor.errors) * hidden_layer.values * (1 - hidden_layer.values)
+            successor = hidden_layer
+
+        for layer in self.layers[1:]:
+            layer.weights += self.learning_rate * numpy.outer(layer.predecessor.values, layer.errors)
+
+    @staticmethod
+    def _convert_legacy_state(state):
+        """Rebuild weight matrices from the Neuron/Edge object graph of older versions"""
+        old_layers = [state['input_layer']] + state['hidden_layers'] + [state['output_layer']]
+        network = NeuralNetwork(len(old_layers[0].neurons), [len(layer.neurons) for layer in old_layers[1:-1]],
+                                len(old_layers[-1].neurons), state['learning_rate'])
+        for old_layer, layer in zip(old_layers, network.layers[1:]):
+            layer.weights = numpy.array([[edge.weight for edge in neuron.outgoing_edges] for neuron in old_layer.neurons])
+        return network.__dict__
 
     def _get_layer_successor(self, layer):
         if layer is self.input_layer:
@@ -126,59 +448,109 @@ class NeuralNetwork(object):
             raise NeuralNetworkException('Given layer unknown')
 
 
+class _Half(object):
+    """Consecutive layers of network, sizes and bottleneck describe the whole network.
+       Half keeps no values of neurons, so it can be shared by threads.
+    """
+
+    def __init__(self, sizes, bottleneck, weights, weights_type=FLOAT32, scales=None):
+        self.sizes = list(sizes)
+        self.bottleneck = bottleneck
+        self.weights_type = weights_type
+        self.scales = scales
+        self.dtype = PRODUCT_TYPES[weights_type]
+        if self.dtype == numpy.float32:
+            weights = [numpy.asarray(matrix, dtype=numpy.float32) for matrix in weights]
+        self.weights = list(weights)
+
+    @property
+    def code_size(self):
+        return self.sizes[self.bottleneck + 1]
+
+
+class Encoder(_Half):
+    """Layers of network from input to bottleneck"""
+
+    def encode(self, inputs):
+        """Counts bottleneck layer values for each row of inputs matrix"""
+        values = numpy.asarray(inputs, dtype=self.dtype)
+        if values.shape[-1] != self.sizes[0]:
+            raise NeuralNetworkException('Improper input size')
+
+        for weights in self.weights:
+            values = sigmoid_function(numpy.dot(values, weights))
+        return values
+
+
+class Decoder(_Half):
+    """Layers of network from bottleneck to output"""
+
+    def decode(self, hidden_values):
+        """Counts network output for each row of bottleneck layer values matrix"""
+        values = numpy.asarray(hidden_values, dtype=self.dtype)
+        if values.shape[-1] != self.code_size:
+            raise NeuralNetworkException('Improper hidden layer values size')
+
+        for weights in self.weights:
+            values = sigmoid_function(numpy.dot(values, weights))
+        return values
+
+
 class Layer(object):
-    """Class represents neural network layer"""
+    """Class represents neural network layer.
+       Neuron values and errors are kept in vectors, ingoing edges in a matrix
+       of shape (predecessor size, layer size).
+    """
 
     def __init__(self, size):
-        self.neurons = [Neuron() for i in xrange(size)]
+        self.values = numpy.zeros(size)
+        self.errors = numpy.zeros(size)
+        self.predecessor = None
+        self.weights = None
 
     def __getitem__(self, index):
-        return self.neurons[index]
+        if not -len(self) <= index < len(self):
+            raise IndexError('Layer index out of range')
+        return Neuron(self, index)
 
     def __len__(self):
-        return len(self.neurons)
+        return len(self.values)
+
+    def __iter__(self):
+        return (Neuron(self, i) for i in xrange(len(self)))
 
     def update_values(self):
-        for neuron in self.neurons:
-            neuron.update_value()
+        self.values = sigmoid_function(numpy.dot(self.predecessor.values, self.weights))
 
 
-class Edge(object):
-    """Class represents neural network edge connecting two neurons"""
+class Neuron(object):
+    """Class represents neural network node, a view of a single layer entry"""
 
-    def __init__(self, begin=None, end=None, weight=0.0):
-        self.begin = begin
-        self.end = end
-        self.weight = weight
+    def __init__(self, layer, index):
+        self.layer = layer
+        self.index = index
 
-    def update_weight(self, learning_rate):
-        self.weight += learning_rate * self.begin.value * self.end.error
+    @property
+    def value(self):
+        return self.layer.values[self.index]
 
+    @value.setter
+    def value(self, value):
+        self.layer.values[self.index] = value
 
-class Neuron(object):
-    """Class represents neural network node"""
+    @property
+    def error(self):
+        return self.layer.errors[self.index]
 
-    def __init__(self, value=0.0, error=0.0):
-        self.value = value
-        self.error = error
-        self.ingoing_edges = []
-        self.outgoing_edges = []
 
-    def update_value(self):
-        """Update neuron output/value - perform weighted sum of ingoing edges values
-           and applies sigmoid function
-        """
-        weighted_value_sum = 0.0
-        for edge in self.ingoing_edges:
-            weighted_value_sum += edge.weight * edge.begin.value
-        self.value = sigmoid_function(weighted_value_sum)
-
-    def update_error(self, target=None):
-        """Update neuron's error - used by error backpropagation algorithm"""
-        if target is not None:
-            self.error = self.value * (1 - self.value) * (target - self.value)
-        else:
-            weighted_error_sum = 0.0
-            for edge in self.outgoing_edges:
-                weighted_error_sum += edge.weight * edge.end.error
-            self.error = weighted_error_sum * self.value * (1 - self.value)
\ No newline at end of file
+class _LegacyUnpickler(pickle.Unpickler):
+    """Unpickler able to read networks saved as Neuron/Edge object graphs by older versions"""
+
+    def find_class(self, module, name):
+        if module == __name__ and name in ('Neuron', 'Edge'):
+            return _LegacyObject
+        return pickle.Unpickler.find_class(self, module, name)
+
+
+class _LegacyObject(object):
+    pass
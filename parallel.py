@@ -0,0 +1,182 @@
+"""In this module you can find helpers running work in a pool of processes or prefetching it in a background thread.
+   Arrays are handed to worker processes through shared memory, so they are neither pickled nor copied.
+   Arrays shared for the whole life of the pool are given when it is created, arrays of streamed items and their results
+   pass through slots of shared memory, which are reused as items go by, see Slots.
+"""
+import collections
+import ctypes
+import multiprocessing
+import Queue
+import threading
+
+import numpy
+
+
+_shared = {}
+# items a worker can take ahead of the result being waited for
+DEPTH = 4
+SLOTS = 'slots'
+
+
+class SharedArray(object):
+    """Numpy array placed in shared memory.
+       It can be passed to worker processes when the pool is created.
+    """
+
+    def __init__(self, shape, dtype):
+        self.shape = tuple(shape)
+        self.dtype = numpy.dtype(dtype)
+        self.buffer = multiprocessing.RawArray(ctypes.c_char, max(int(numpy.prod(self.shape)) * self.dtype.itemsize, 1))
+
+    def array(self):
+        return numpy.frombuffer(self.buffer, dtype=self.dtype, count=int(numpy.prod(self.shape))).reshape(self.shape)
+
+
+class Slots(object):
+    """Ring of arrays in shared memory handing items of imap_bounded to workers and their results back.
+       Every slot has an array of each name of arrays dictionary, which maps names to (shape, type).
+       With item_array, items are arrays copied into the slot array of that name instead of being pickled.
+    """
+
+    def __init__(self, number, arrays, item_array=None):
+        self.number = number
+        self.arrays = dict((name, SharedArray((number,) + tuple(shape), dtype)) for name, (shape, dtype) in arrays.iteritems())
+        self.item_array = item_array
+
+    def get(self, name, slot):
+        return self.arrays[name].array()[slot]
+
+
+def split_range(number, parts):
+    """Split range(number) into at most parts contiguous, non empty (first, last) ranges"""
+    bounds = [number * k / parts for k in xrange(parts + 1)]
+    return [(first, last) for first, last in zip(bounds[:-1], bounds[1:]) if first < last]
+
+
+def create_pool(workers, shared):
+    """Pool of workers processes, values of shared dictionary are available in workers through get_shared.
+       Caller closes and joins the pool.
+    """
+    return multiprocessing.Pool(workers, _init_worker, (shared,))
+
+
+def map_ranges(function, number, workers, shared):
+    """Call function((first, last)) for contiguous parts of range(number) in a pool of workers processes.
+       Values of shared dictionary are available in workers through get_shared.
+       Returns list of results ordered as the ranges.
+    """
+    pool = create_pool(workers, shared)
+    try:
+        return pool.map(function, split_range(number, workers))
+    finally:
+        pool.close()
+        pool.join()
+
+
+def imap_tasks(function, tasks, workers, shared):
+    """Call function(task) for each task in a pool of workers processes.
+       Values of shared dictionary are available in workers through get_shared.
+       Yields results in the tasks order as soon as they are ready.
+    """
+    pool = create_pool(workers, shared)
+    try:
+        for result in pool.imap(function, tasks):
+            yield result
+    finally:
+        pool.close()
+        pool.join()
+
+
+def imap_bounded(function, items, workers, shared, depth=DEPTH, slots=None):
+    """Call function(item) for each item in a pool of workers processes, yields results in the items order.
+       Items are taken lazily, at most workers * depth at once, so that memory stays bounded,
+       and the next item is sent as soon as a result is taken, so that workers do not wait for each other.
+       With slots made for workers * depth items, function((slot, item)) is called with the slot reserved for the item,
+       whose arrays workers get by get_slot, and (slot, result) pairs are yielded.
+       The slot is reused for another item once the next result is taken.
+    """
+    window = workers * depth
+    if slots is not None:
+        if slots.number != window:
+            raise ValueError('Slots are made for %d items, not for %d' % (slots.number, window))
+        shared = dict(shared, **{SLOTS: slots})
+    pool = create_pool(workers, shared)
+    try:
+        pending = collections.deque()
+        for index, item in enumerate(items):
+            if len(pending) == window:
+                yield _get_result(pending.popleft(), slots)
+            if slots is not None:
+                slot = index % window
+                if slots.item_array is not None:
+                    slots.get(slots.item_array, slot)[...] = item
+                    item = None
+                item = slot, item
+            pending.append((item, pool.apply_async(function, (item,))))
+        while pending:
+            yield _get_result(pending.popleft(), slots)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _get_result(task, slots):
+    item, result = task
+    if slots is None:
+        return result.get()
+    return item[0], result.get()
+
+
+def prefetch(function, items, depth=1):
+    """Yield (item, value, error) for each item, where value is function(item) or error is raised exception.
+       Values for up to depth following items are counted in advance by a background thread,
+       which stops when the generator is closed, after the value being counted.
+    """
+    queue = Queue.Queue(depth)
+    stopped = threading.Event()
+
+    def put(fetched):
+        while not stopped.is_set():
+            try:
+                queue.put(fetched, timeout=0.1)
+                return
+            except Queue.Full:
+                pass
+
+    def fetch():
+        for item in items:
+            if stopped.is_set():
+                return
+            try:
+                put((item, function(item), None))
+            except Exception as exc:
+                put((item, None, exc))
+        put(None)
+
+    thread = threading.Thread(target=fetch)
+    thread.daemon = True
+    thread.start()
+    try:
+        for fetched in iter(queue.get, None):
+            yield fetched
+    finally:
+        stopped.set()
+        thread.join()
+
+
+def get_shared(name):
+    """Get value shared with the worker process, SharedArray is returned as numpy array"""
+    value = _shared[name]
+    if isinstance(value, SharedArray):
+        return value.array()
+    return value
+
+
+def get_slot(name, slot):
+    """Get array of given name of the slot in worker process, see imap_bounded"""
+    return _shared[SLOTS].get(name, slot)
+
+
+def _init_worker(shared):
+    _shared.clear()
+    _shared.update(shared)
@@ -0,0 +1,230 @@
+"""In this module you can find progress reporting and timing of long operations (teaching, compression, decompression).
+   Operation gets a tracker from track, begins it when number of steps is known and advances it as steps are done.
+   Tracker also measures time of operation stages and counts processed items.
+   Tracker passes progress to registered hooks at most once per hook interval and the final report when finished.
+   When no hook is registered, track returns NULL_TRACKER, whose methods do nothing.
+   Hook may stop the operation by raising Cancelled from any of its methods.
+"""
+import threading
+import time
+
+
+_hooks = []
+
+
+class Cancelled(Exception):
+    """Raised by hook to stop the tracked operation"""
+    pass
+
+
+class Hook(object):
+    """Base of progress hooks, subclasses override methods they need"""
+    # minimal number of seconds between progress calls
+    interval = 0.1
+
+    def started(self, operation, total):
+        pass
+
+    def progress(self, operation, done, total, times):
+        """Times are seconds of stages measured so far, the dictionary must not be changed"""
+        pass
+
+    def finished(self, operation, report):
+        """Report is dictionary of total seconds, seconds of stages and counters"""
+        pass
+
+
+class StageTimer(object):
+    """Sums time spent in stages, it can be sent between processes"""
+
+    def __init__(self):
+        self.times = {}
+
+    def stage(self, name):
+        return _Stage(self.times, name)
+
+    def timed(self, name, iterable):
+        """Yield items of iterable, time spent getting them is added to stage"""
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def add_times(self, times):
+        for name, seconds in times.iteritems():
+            self.times[name] = self.times.get(name, 0.0) + seconds
+
+
+class Tracker(StageTimer):
+
+    def __init__(self, operation, hooks):
+        StageTimer.__init__(self)
+        self.operation = operation
+        self.total = 0
+        self.done = 0
+        self.counters = {}
+        self.hooks = hooks
+        self.start = time.time()
+        self.last_progress = [self.start] * len(hooks)
+
+    def begin(self, total):
+        """Start reporting progress of operation consisting of total steps"""
+        self.total = total
+        for hook in self.hooks:
+            hook.started(self.operation, total)
+
+    def advance(self, number=1):
+        self.done += number
+        now = time.time()
+        for i, hook in enumerate(self.hooks):
+            if now - self.last_progress[i] >= hook.interval or self.done >= self.total:
+                self.last_progress[i] = now
+                hook.progress(self.operation, self.done, self.total, self.times)
+
+    def count(self, name, number=1):
+        self.counters[name] = self.counters.get(name, 0) + number
+
+    def finish(self):
+        report = {'seconds': time.time() - self.start, 'stages': dict(self.times), 'counters': dict(self.counters)}
+        for hook in self.hooks:
+            hook.finished(self.operation, report)
+
+
+class _NullTracker(object):
+
+    times = {}
+
+    def stage(self, name):
+        return _NULL_STAGE
+
+    def timed(self, name, iterable):
+        return iterable
+
+    def add_times(self, times):
+        pass
+
+    def begin(self, total):
+        pass
+
+    def advance(self, number=1):
+        pass
+
+    def count(self, name, number=1):
+        pass
+
+    def finish(self):
+        pass
+
+
+class _Stage(object):
+
+    def __init__(self, times, name):
+        self.times = times
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.time()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.times[self.name] = self.times.get(self.name, 0.0) + time.time() - self.start
+
+
+class _NullStage(object):
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+NULL_TRACKER = _NullTracker()
+_NULL_STAGE = _NullStage()
+
+
+def add_hook(hook):
+    _hooks.append(hook)
+
+
+def remove_hook(hook):
+    _hooks.remove(hook)
+
+
+def track(operation):
+    """Get tracker of operation, its stages may be timed before it begins"""
+    if not _hooks:
+        return NULL_TRACKER
+    return Tracker(operation, list(_hooks))
+
+
+def format_times(times, limit=None):
+    """Describe seconds of stages, the longest limit stages only if limit is given"""
+    names = sorted(times)
+    if limit is not None:
+        names = sorted(sorted(times, key=times.get, reverse=True)[:limit])
+    return ', '.join('%s %.3fs' % (name, times[name]) for name in names)
+
+
+class LoggingHook(Hook):
+    """Logs progress in percents, overwriting the previous line of terminal, and stage times of finished operation"""
+
+    NAMES = {'teach': 'Teaching', 'compress': 'Compressing', 'decompress': 'Decompressing'}
+
+    def __init__(self, logger, interval=0.5):
+        self.logger = logger
+        self.interval = interval
+
+    def progress(self, operation, done, total, times):
+        self.logger.info('%s in progress... %d%%\033[F' % (self.NAMES.get(operation, operation), 100 * done / max(total, 1)))
+
+    def finished(self, operation, report):
+        self.logger.debug('%s took %.3fs (%s)' % (self.NAMES.get(operation, operation), report['seconds'], format_times(report['stages'])))
+
+
+class MetricsHook(Hook):
+    """Sums reports of finished operations, so that they can be exported as metrics.
+       It can be shared by threads.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.operations = {}
+        self.seconds = {}
+        self.stages = {}
+        self.counters = {}
+
+    def finished(self, operation, report):
+        with self.lock:
+            self.operations[operation] = self.operations.get(operation, 0) + 1
+            self.seconds[operation] = self.seconds.get(operation, 0.0) + report['seconds']
+            for name, seconds in report['stages'].iteritems():
+                self.stages[operation, name] = self.stages.get((operation, name), 0.0) + seconds
+            for name, number in report['counters'].iteritems():
+                self.counters[operation, name] = self.counters.get((operation, name), 0) + number
+
+    def snapshot(self):
+        """Returns copy of sums as dictionary"""
+        with self.lock:
+            return {'operations': dict(self.operations), 'seconds': dict(self.seconds), 'stages': dict(self.stages),
+                    'counters': dict(self.counters)}
+
+    def exposition(self, prefix='zdp'):
+        """Returns sums in Prometheus text format"""
+        snapshot = self.snapshot()
+        lines = ['# TYPE %s_operations_total counter' % prefix]
+        lines += ['%s_operations_total{operation="%s"} %d' % (prefix, operation, number)
+                  for operation, number in sorted(snapshot['operations'].items())]
+        lines.append('# TYPE %s_operation_seconds_total counter' % prefix)
+        lines += ['%s_operation_seconds_total{operation="%s"} %.6f' % (prefix, operation, seconds)
+                  for operation, seconds in sorted(snapshot['seconds'].items())]
+        lines.append('# TYPE %s_stage_seconds_total counter' % prefix)
+        lines += ['%s_stage_seconds_total{operation="%s",stage="%s"} %.6f' % (prefix, operation, stage, seconds)
+                  for (operation, stage), seconds in sorted(snapshot['stages'].items())]
+        lines.append('# TYPE %s_items_total counter' % prefix)
+        lines += ['%s_items_total{operation="%s",item="%s"} %d' % (prefix, operation, name, number)
+                  for (operation, name), number in sorted(snapshot['counters'].items())]
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,476 @@
+"""In this module you can find HTTP service compressing and decompressing images with preloaded networks,
+   so that clients do not pay for process start and network loading on every request.
+   POST /compress takes a picture and returns compressed image, POST /decompress takes compressed image and returns BMP picture,
+   options are given in query, see Service.parse_options. GET /metrics returns metrics in Prometheus text format.
+   Connections are served by threads, which put requests to a queue of bounded length, further requests are rejected
+   with status 503 until the queue has room again. Dispatcher thread takes queued requests in batches and runs them
+   in a pool of worker processes, which got the networks when they were started.
+   Watchdog thread fails batches, which raised in the pool or were not done in time, for example because their
+   worker was killed, and frees their place, since the pool of Python 2 never reports lost tasks.
+   Python 2 has no asyncio, so waiting for clients is left to threads of the standard library.
+"""
+import BaseHTTPServer
+import logging
+import os
+import Queue
+import SocketServer
+import StringIO
+import struct
+import tempfile
+import threading
+import time
+import urlparse
+
+from PIL import Image
+
+import compression
+import neural_network
+import parallel
+import progress
+
+
+logger = logging.getLogger('logger')
+
+COMPRESS = 'compress'
+DECOMPRESS = 'decompress'
+OPERATIONS = (COMPRESS, DECOMPRESS)
+# upper bounds of latency histogram buckets in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+CONTENT_TYPES = {COMPRESS: 'application/octet-stream', DECOMPRESS: 'image/bmp'}
+# seconds between checks of running batches
+WATCH_INTERVAL = 0.5
+
+
+class RequestError(Exception):
+    """Request which cannot be served, status is the HTTP status sent to client"""
+
+    def __init__(self, status, message):
+        Exception.__init__(self, message)
+        self.status = status
+
+
+class Histogram(object):
+    """Counts of observed values up to each bucket bound, their sum and number. It can be shared by threads."""
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.lock = threading.Lock()
+        self.bounds = bounds
+        self.counts = [0] * len(bounds)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        with self.lock:
+            for i, bound in enumerate(self.bounds):
+                if value <= bound:
+                    self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+    def exposition(self, name, labels):
+        """Lines of histogram in Prometheus text format, labels is text of labels without braces"""
+        with self.lock:
+            lines = ['%s_bucket{%s,le="%g"} %d' % (name, labels, bound, count) for bound, count in zip(self.bounds, self.counts)]
+            lines.append('%s_bucket{%s,le="+Inf"} %d' % (name, labels, self.count))
+            lines.append('%s_sum{%s} %.6f' % (name, labels, self.sum))
+            lines.append('%s_count{%s} %d' % (name, labels, self.count))
+        return lines
+
+
+class Service(object):
+    """Runs compression and decompression requests with preloaded networks in a pool of workers processes.
+       Networks maps names to paths of networks or their halves, a half serves only its operation.
+       At most workers batches of at most batch_size requests run at once and at most queue_size requests wait,
+       request is answered with status 504 when it is not done in timeout seconds and it is not run, if it was still queued,
+       batch not done in timeout seconds after it was started is failed, so that it does not hold a worker forever.
+    """
+
+    def __init__(self, networks, workers=1, queue_size=64, batch_size=8, max_size=32 << 20, timeout=60.0):
+        if workers <= 0 or queue_size <= 0 or batch_size <= 0 or max_size <= 0 or timeout <= 0:
+            raise compression.ZdpException('Number of workers, queue and batch size, size limit and timeout must be grater than 0')
+        self.networks = dict((name, load_network(path)) for name, path in networks.iteritems())
+        if not self.networks:
+            raise compression.ZdpException('Service needs at least one neural network')
+        self.default_network = sorted(self.networks)[0] if len(self.networks) == 1 else None
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.queue = Queue.Queue(queue_size)
+        self.slots = threading.Semaphore(workers)
+        self.metrics = progress.MetricsHook()
+        self.latency = dict((operation, Histogram()) for operation in OPERATIONS)
+        self.waiting = dict((operation, Histogram()) for operation in OPERATIONS)
+        self.lock = threading.Lock()
+        self.responses = {}
+        self.batches = 0
+        self.batched_requests = 0
+        self.failed_batches = 0
+        self.abandoned_requests = 0
+        self.running = set()
+        self.stopping = threading.Event()
+        self.pool = parallel.create_pool(workers, {'networks': self.networks})
+        self.dispatcher = threading.Thread(target=self._dispatch)
+        self.dispatcher.daemon = True
+        self.dispatcher.start()
+        self.watchdog = threading.Thread(target=self._watch)
+        self.watchdog.daemon = True
+        self.watchdog.start()
+        self.httpd = None
+
+    def start(self, host='127.0.0.1', port=8080):
+        """Listen on given address in a background thread, port 0 picks a free one. Returns (host, port) listened on."""
+        self.httpd = _HTTPServer((host, port), _Handler)
+        self.httpd.service = self
+        thread = threading.Thread(target=self.httpd.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self.httpd.server_address
+
+    def stop(self):
+        """Stop listening, answer queued requests with status 503, finish running batches and stop worker processes"""
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+        # waiting for room in full queue could block the stop, handlers still reading their requests can fill it again
+        while True:
+            try:
+                request = self.queue.get_nowait()
+            except Queue.Empty:
+                try:
+                    self.queue.put_nowait(None)
+                    break
+                except Queue.Full:
+                    continue
+            if request is not None:
+                request.status, request.body = 503, 'Service is stopping'
+                request.done.set()
+        self.dispatcher.join()
+        self.stopping.set()
+        self.watchdog.join()
+        self.pool.close()
+        self.pool.join()
+
+    def handle(self, operation, query, data):
+        """Serve request of operation with query dictionary of options and data of picture or compressed image.
+           Returns (status, body, content type).
+        """
+        start = time.time()
+        try:
+            if operation not in OPERATIONS:
+                raise RequestError(404, 'Unknown operation ' + operation)
+            request = _Request(operation, self.parse_options(operation, query), data)
+            try:
+                self.queue.put_nowait(request)
+            except Queue.Full:
+                raise RequestError(503, 'Too many requests are waiting')
+            if not request.done.wait(self.timeout):
+                request.abandoned = True
+                raise RequestError(504, 'Request was not done in %g seconds' % self.timeout)
+            status, body = request.status, request.body
+        except RequestError as exc:
+            status, body = exc.status, str(exc)
+        # rejected requests are only counted
+        if operation in OPERATIONS and status != 503:
+            self.latency[operation].observe(time.time() - start)
+        self._count_response(operation if operation in OPERATIONS else 'unknown', status)
+        return status, body, CONTENT_TYPES[operation] if status == 200 else 'text/plain'
+
+    def parse_options(self, operation, query):
+        """Check options of request given as query dictionary.
+           Network selects one of service networks, it can be left out when there is just one.
+           Compression options are bits, smooth (grid or deblock), entropy (0 or 1), chroma (bits), progressive
+           (comma separated preview scales) and tile, decompression option is layer of progressive image.
+        """
+        name = query.get('network', self.default_network)
+        if name is None:
+            raise RequestError(400, 'Neural network must be chosen, service has ' + ', '.join(sorted(self.networks)))
+        if name not in self.networks:
+            raise RequestError(404, 'Unknown neural network %s' % name)
+        encoder, decoder = self.networks[name]
+        if (encoder if operation == COMPRESS else decoder) is None:
+            raise RequestError(404, 'Neural network %s cannot be used to %s' % (name, operation))
+        try:
+            if operation == DECOMPRESS:
+                layer = query.get('layer')
+                return {'network': name, 'layer': int(layer) if layer is not None else None}
+            options = {'network': name, 'bits': int(query.get('bits', 4)), 'entropy_coding': query.get('entropy', '0') == '1',
+                       'chroma_bits': int(query['chroma']) if 'chroma' in query else None,
+                       'progressive': [int(scale) for scale in query.get('progressive', '').split(',') if scale],
+                       'tile_size': int(query.get('tile', 256))}
+        except ValueError:
+            raise RequestError(400, 'Options must be integers')
+        smooth = query.get('smooth')
+        if smooth is not None and smooth not in compression.SMOOTHING_MODES:
+            raise RequestError(400, 'Unknown smoothing mode')
+        options['smoothing'] = compression.SMOOTHING_MODES.get(smooth, compression.SMOOTHING_NONE)
+        try:
+            compression.check_compress_arguments(options['bits'], 1, options['smoothing'], options['chroma_bits'], options['progressive'])
+        except compression.ZdpException as exc:
+            raise RequestError(400, exc.message)
+        return options
+
+    def exposition(self, prefix='zdp'):
+        """Metrics of codec stages, request latency and queue in Prometheus text format"""
+        lines = ['# TYPE %s_request_seconds histogram' % prefix]
+        for operation in OPERATIONS:
+            lines += self.latency[operation].exposition('%s_request_seconds' % prefix, 'operation="%s"' % operation)
+        lines.append('# TYPE %s_queue_seconds histogram' % prefix)
+        for operation in OPERATIONS:
+            lines += self.waiting[operation].exposition('%s_queue_seconds' % prefix, 'operation="%s"' % operation)
+        with self.lock:
+            lines.append('# TYPE %s_responses_total counter' % prefix)
+            lines += ['%s_responses_total{operation="%s",status="%d"} %d' % (prefix, operation, status, number)
+                      for (operation, status), number in sorted(self.responses.items())]
+            lines.append('# TYPE %s_batches_total counter' % prefix)
+            lines.append('%s_batches_total %d' % (prefix, self.batches))
+            lines.append('# TYPE %s_batched_requests_total counter' % prefix)
+            lines.append('%s_batched_requests_total %d' % (prefix, self.batched_requests))
+            lines.append('# TYPE %s_failed_batches_total counter' % prefix)
+            lines.append('%s_failed_batches_total %d' % (prefix, self.failed_batches))
+            lines.append('# TYPE %s_abandoned_requests_total counter' % prefix)
+            lines.append('%s_abandoned_requests_total %d' % (prefix, self.abandoned_requests))
+        lines.append('# TYPE %s_queued_requests gauge' % prefix)
+        lines.append('%s_queued_requests %d' % (prefix, self.queue.qsize()))
+        return self.metrics.exposition(prefix) + '\n'.join(lines) + '\n'
+
+    def _count_response(self, operation, status):
+        with self.lock:
+            self.responses[operation, status] = self.responses.get((operation, status), 0) + 1
+
+    def _dispatch(self):
+        """Take requests queued while all workers were busy in batches, so that each batch is a single task of the pool.
+           Requests, whose clients were already answered with status 504, are left out.
+        """
+        stopped = False
+        while not stopped:
+            self.slots.acquire()
+            batch = []
+            request = self.queue.get()
+            while request is not None:
+                if request.abandoned:
+                    with self.lock:
+                        self.abandoned_requests += 1
+                else:
+                    batch.append(request)
+                if len(batch) == self.batch_size:
+                    break
+                try:
+                    request = self.queue.get_nowait()
+                except Queue.Empty:
+                    break
+            stopped = request is None
+            if not batch:
+                self.slots.release()
+                continue
+            now = time.time()
+            for request in batch:
+                self.waiting[request.operation].observe(now - request.queued)
+            with self.lock:
+                self.batches += 1
+                self.batched_requests += len(batch)
+            tasks = [(request.operation, request.options, request.data) for request in batch]
+            batch = _Batch(batch)
+            batch.result = self.pool.apply_async(_run_batch, (tasks,), callback=lambda results, batch=batch: self._finish(batch, results))
+            with self.lock:
+                if not batch.finished:
+                    self.running.add(batch)
+
+    def _finish(self, batch, results):
+        """Called by the pool when batch is done, passes results to waiting requests"""
+        if not self._complete(batch):
+            return
+        for request, (status, body, reports) in zip(batch.requests, results):
+            for operation, report in reports:
+                self.metrics.finished(operation, report)
+            request.status, request.body = status, body
+            request.done.set()
+        self.slots.release()
+
+    def _fail(self, batch, status, message):
+        """Answer requests of batch, which will never be finished by the pool, with given status"""
+        if not self._complete(batch):
+            return
+        logger.warning('Batch of %d requests failed: %s' % (len(batch.requests), message))
+        with self.lock:
+            self.failed_batches += 1
+        for request in batch.requests:
+            request.status, request.body = status, message
+            request.done.set()
+        self.slots.release()
+
+    def _complete(self, batch):
+        """Mark batch as complete, returns False when it was already completed by the pool or the watchdog"""
+        with self.lock:
+            if batch.finished:
+                return False
+            batch.finished = True
+            self.running.discard(batch)
+            return True
+
+    def _watch(self):
+        """Fail running batches, which raised in the pool or were not done in timeout seconds after they were started"""
+        while not self.stopping.wait(WATCH_INTERVAL):
+            with self.lock:
+                running = list(self.running)
+            for batch in running:
+                if batch.result.ready():
+                    if not batch.result.successful():
+                        try:
+                            batch.result.get()
+                        except Exception as exc:
+                            self._fail(batch, 500, 'Worker failed: %s: %s' % (type(exc).__name__, exc))
+                elif time.time() - batch.started > self.timeout:
+                    self._fail(batch, 504, 'Worker did not finish the batch in %g seconds' % self.timeout)
+
+
+def load_network(path):
+    """Load (encoder, decoder) halves of network, file of a half gives None for the other one"""
+    halves = []
+    for load in (neural_network.load_encoder, neural_network.load_decoder):
+        try:
+            halves.append(load(path))
+        except neural_network.NeuralNetworkException:
+            halves.append(None)
+    if halves == [None, None]:
+        # load again to report why
+        neural_network.load_encoder(path)
+    return tuple(halves)
+
+
+def serve(networks, host='127.0.0.1', port=8080, workers=1, queue_size=64, batch_size=8, max_size=32 << 20, timeout=60.0):
+    """Run service until interrupted by keyboard"""
+    service = Service(networks, workers, queue_size, batch_size, max_size, timeout)
+    host, port = service.start(host, port)
+    logger.info('Serving %s on http://%s:%d/' % (', '.join(sorted(service.networks)), host, port))
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        logger.info('Stopping service')
+    finally:
+        service.stop()
+
+
+class _Request(object):
+
+    def __init__(self, operation, options, data):
+        self.operation = operation
+        self.options = options
+        self.data = data
+        self.queued = time.time()
+        self.done = threading.Event()
+        self.status = None
+        self.body = None
+        self.abandoned = False
+
+
+class _Batch(object):
+    """Requests run in the pool as a single task, result is the AsyncResult of the task"""
+
+    def __init__(self, requests):
+        self.requests = requests
+        self.started = time.time()
+        self.result = None
+        self.finished = False
+
+
+class _HTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 64
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    server_version = 'zdp'
+    protocol_version = 'HTTP/1.1'
+    # idle kept-alive connections are closed after this many seconds
+    timeout = 30
+
+    def do_GET(self):
+        path = urlparse.urlparse(self.path).path
+        if path == '/metrics':
+            self._respond(200, self.server.service.exposition(), 'text/plain; version=0.0.4')
+        elif path == '/health':
+            self._respond(200, 'ok\n', 'text/plain')
+        else:
+            self._respond(404, 'Unknown path ' + path, 'text/plain')
+
+    def do_POST(self):
+        service = self.server.service
+        url = urlparse.urlparse(self.path)
+        length = self.headers.getheader('Content-Length')
+        if length is None or not length.isdigit():
+            self.close_connection = True
+            self._respond(411, 'Content-Length is required', 'text/plain')
+            return
+        if int(length) > service.max_size:
+            # body is not read, so the connection cannot be used again
+            self.close_connection = True
+            self._respond(413, 'Request body is greater than %d bytes' % service.max_size, 'text/plain')
+            return
+        data = self.rfile.read(int(length))
+        query = dict(urlparse.parse_qsl(url.query))
+        status, body, content_type = service.handle(url.path.strip('/'), query, data)
+        self._respond(status, body, content_type)
+
+    def log_message(self, format, *args):
+        logger.debug('%s - %s' % (self.client_address[0], format % args))
+
+    def _respond(self, status, body, content_type):
+        if status != 200 and not body.endswith('\n'):
+            body += '\n'
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        if status == 503:
+            self.send_header('Retry-After', '1')
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class _ReportHook(progress.Hook):
+    """Keeps reports of operations finished in worker process, so that they can be summed by the service"""
+
+    def __init__(self):
+        self.reports = []
+
+    def finished(self, operation, report):
+        self.reports.append((operation, report))
+
+
+def _run_batch(tasks):
+    """Run (operation, options, data) tasks in worker process, returns (status, body, reports) for each of them"""
+    # progress of single requests is of no interest
+    logging.getLogger('logger').setLevel(logging.WARNING)
+    hook = _ReportHook()
+    progress.add_hook(hook)
+    try:
+        return [_run_task(task, hook) for task in tasks]
+    finally:
+        progress.remove_hook(hook)
+
+
+def _run_task(task, hook):
+    operation, options, data = task
+    del hook.reports[:]
+    handle, path = tempfile.mkstemp(suffix='.zdp' if operation == COMPRESS else '.bmp')
+    os.close(handle)
+    try:
+        encoder, decoder = parallel.get_shared('networks')[options['network']]
+        if operation == COMPRESS:
+            pixels = compression.get_pixels(Image.open(StringIO.StringIO(data)))
+            compression.compress_pixels(pixels, encoder, path, options['bits'], options['smoothing'], tile_size=options['tile_size'],
+                                        entropy_coding=options['entropy_coding'], chroma_bits=options['chroma_bits'],
+                                        progressive=options['progressive'])
+        else:
+            compression.decompress_file(StringIO.StringIO(data), decoder, path, layer=options['layer'])
+        with open(path, 'rb') as file:
+            return 200, file.read(), list(hook.reports)
+    except (compression.ZdpException, neural_network.NeuralNetworkException, IOError, ValueError, struct.error) as exc:
+        return 400, str(exc), list(hook.reports)
+    except Exception as exc:
+        # damaged data may fail anywhere, single request must not stop the worker
+        return 500, '%s: %s' % (type(exc).__name__, exc), list(hook.reports)
+    finally:
+        os.remove(path)
@@ -0,0 +1,79 @@
+"""In this module you can find tests of reading damaged compressed images"""
+import logging
+import os
+import shutil
+import StringIO
+import struct
+import tempfile
+import unittest
+
+import numpy
+from PIL import Image
+
+import compression
+import neural_network
+
+
+class DamagedImageTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        logging.getLogger('logger').addHandler(logging.NullHandler())
+        cls.directory = tempfile.mkdtemp()
+        cls.network_path = os.path.join(cls.directory, 'network.mkm')
+        network = neural_network.NeuralNetwork(64, [32], 64, bottleneck=0)
+        network.init_weights()
+        neural_network.save(network, cls.network_path)
+        cls.network = neural_network.load_decoder(cls.network_path)
+        pixels = numpy.random.RandomState(10).randint(0, 256, (45, 61, 3)).astype(numpy.uint8)
+        cls.images = {}
+        for name, options in (('plain', {}), ('chroma', {'chroma_bits': 2, 'entropy_coding': True}),
+                              ('progressive', {'smoothing': compression.SMOOTHING_GRID, 'progressive': (2,), 'tile_size': 32})):
+            path = os.path.join(cls.directory, name + '.zdp')
+            compression.compress_pixels(pixels, neural_network.load_encoder(cls.network_path), path, 4, **options)
+            with open(path, 'rb') as file:
+                cls.images[name] = file.read()
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory)
+
+    def decompress(self, data):
+        compression.decompress_file(StringIO.StringIO(data), self.network, os.path.join(self.directory, 'output.bmp'))
+
+    def assertDamaged(self, data):
+        with self.assertRaises(compression.ZdpException) as context:
+            self.decompress(data)
+        self.assertEqual(context.exception.message, 'Compressed image is damaged')
+
+    def test_intact_images(self):
+        for data in self.images.itervalues():
+            self.decompress(data)
+
+    def test_truncated_header(self):
+        for name, data in self.images.iteritems():
+            tiles = compression.read_header(StringIO.StringIO(data))['offsets'][0]
+            for length in xrange(tiles):
+                self.assertDamaged(data[:length])
+
+    def test_damaged_fields(self):
+        # sides at 4, bits at 16, tile size at 22 and block size at 27
+        fields = [(4, '>i', 0), (4, '>i', -8), (8, '>i', 70000), (16, '>b', 0), (16, '>b', 9),
+                  (22, '>i', 1 << 24), (22, '>i', -1), (22, '>i', 12), (27, '>B', 5)]
+        for name, data in self.images.iteritems():
+            for position, format, value in fields:
+                value = struct.pack(format, value)
+                self.assertDamaged(data[:position] + value + data[position + len(value):])
+
+    def test_damaged_tile_size_bytes(self):
+        data = self.images['plain']
+        for first in xrange(256):
+            for second in (0, 1, 0x7f, 0xff):
+                try:
+                    self.decompress(data[:22] + chr(first) + chr(second) + data[24:])
+                except compression.ZdpException:
+                    pass
+
+
+if __name__ == '__main__':
+    unittest.main()
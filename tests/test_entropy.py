@@ -0,0 +1,46 @@
+"""In this module you can find tests of entropy coding of quantified values"""
+import unittest
+
+import numpy
+
+import entropy
+
+
+class EntropyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.random_state = numpy.random.RandomState(12)
+        # single rows, partly filled last steps and matrices of many lanes per context
+        self.shapes = [(1, 1), (1, 16), (7, 3), (513, 8), (3072, 16), (5000, 32)]
+
+    def random_symbols(self, bits, shape):
+        # skewed values like hidden values of a network, with the whole range present
+        return numpy.minimum(self.random_state.geometric(0.3, shape) - 1, pow(2, bits) - 1)
+
+    def test_round_trip(self):
+        for legacy in (False, True):
+            for bits in xrange(1, 9):
+                for rows, contexts in self.shapes:
+                    symbols = self.random_symbols(bits, (rows, contexts))
+                    data = entropy.encode(symbols, bits, legacy)
+                    numpy.testing.assert_array_equal(entropy.decode(data, bits, rows, contexts, legacy), symbols)
+
+    def test_lanes_grow_with_rows(self):
+        self.assertEqual(entropy._geometry(3072, 16, 4), (16 * 24, 128))
+        self.assertEqual(entropy._geometry(3072, 16, 4, legacy=True), (16 * 6, 512))
+        self.assertEqual(entropy._geometry(10, 16, 1), (16, 10))
+
+    def test_compression(self):
+        symbols = self.random_symbols(8, (3072, 16))
+        # values take about 3 of 8 bits, states of lanes take at most 1/16 of raw size
+        self.assertTrue(len(entropy.encode(symbols, 8)) < 0.6 * symbols.size)
+
+    def test_damaged_data(self):
+        symbols = self.random_symbols(4, (600, 16))
+        data = entropy.encode(symbols, 4)
+        for damaged in (data[:-2], data + '\x00\x00', data[:-1], ''):
+            self.assertRaises(entropy.EntropyCodingException, entropy.decode, damaged, 4, 600, 16)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+"""In this module you can find tests of running jobs by JobController without a window"""
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import numpy
+from PIL import Image
+
+import compression
+import jobs
+import neural_network
+import progress
+
+
+class _CancelOnProgress(progress.Hook):
+    """Cancels the running job of controller when it reports progress for the first time"""
+
+    interval = 0
+
+    def __init__(self, controller):
+        self.controller = controller
+        self.cancelled = None
+
+    def progress(self, operation, done, total, times):
+        if threading.current_thread() is self.controller.thread and self.cancelled is None:
+            self.cancelled = self.controller.current
+            self.controller.cancel()
+
+
+class JobControllerTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        logging.getLogger('logger').addHandler(logging.NullHandler())
+        cls.directory = tempfile.mkdtemp()
+        cls.network_path = os.path.join(cls.directory, 'network.mkm')
+        network = neural_network.NeuralNetwork(64, [32], 64, bottleneck=0)
+        network.init_weights()
+        neural_network.save(network, cls.network_path)
+        cls.picture_path = os.path.join(cls.directory, 'picture.bmp')
+        pixels = numpy.random.RandomState(17).randint(0, 256, (256, 64, 3)).astype(numpy.uint8)
+        Image.fromarray(pixels, 'RGB').save(cls.picture_path)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory)
+
+    def setUp(self):
+        self.controller = jobs.JobController(interval=0)
+
+    def tearDown(self):
+        self.controller.close()
+
+    def compress_job(self, name):
+        output = os.path.join(self.directory, name + '.zdp')
+        return jobs.Job(name, output, compression.compress, self.picture_path, self.network_path, output, 4)
+
+    def test_job_is_done(self):
+        job = self.controller.submit(self.compress_job('done'))
+        self.controller.wait()
+        self.assertEqual(job.state, jobs.DONE)
+        self.assertTrue(os.path.isfile(job.output))
+        self.assertEqual(job.done, job.total)
+        self.assertIn('stages', job.report)
+        kinds = [kind for kind, event_job in self.controller.get_events() if event_job is job]
+        self.assertEqual((kinds[0], kinds[1], kinds[-1]), (jobs.QUEUED, jobs.RUNNING, jobs.DONE))
+
+    def test_cancel_running_compress_removes_output(self):
+        hook = _CancelOnProgress(self.controller)
+        progress.add_hook(hook)
+        try:
+            job = self.controller.submit(self.compress_job('cancelled'))
+            self.controller.wait()
+        finally:
+            progress.remove_hook(hook)
+        self.assertIs(hook.cancelled, job)
+        self.assertEqual(job.state, jobs.CANCELLED)
+        self.assertTrue(job.done < job.total)
+        self.assertFalse(os.path.exists(job.output))
+        self.assertIn((jobs.CANCELLED, job), self.controller.get_events())
+
+    def test_cancel_queued_job(self):
+        started, release = threading.Event(), threading.Event()
+
+        def block():
+            started.set()
+            release.wait()
+
+        blocking = self.controller.submit(jobs.Job('blocking', None, block))
+        started.wait()
+        queued = self.controller.submit(self.compress_job('queued'))
+        self.assertEqual(self.controller.pending(), [queued])
+        self.controller.cancel(queued)
+        self.assertEqual(queued.state, jobs.CANCELLED)
+        self.assertEqual(self.controller.pending(), [])
+        release.set()
+        self.controller.wait()
+        self.assertEqual(blocking.state, jobs.DONE)
+        self.assertEqual(queued.state, jobs.CANCELLED)
+        self.assertFalse(os.path.exists(queued.output))
+        kinds = [kind for kind, event_job in self.controller.get_events() if event_job is queued]
+        self.assertEqual(kinds, [jobs.QUEUED, jobs.CANCELLED])
+
+    def test_failure_reaches_events(self):
+        output = os.path.join(self.directory, 'failed.bmp')
+        job = self.controller.submit(jobs.Job('failed', output, compression.decompress, os.path.join(self.directory, 'missing.zdp'),
+                                              self.network_path, output))
+        following = self.controller.submit(self.compress_job('following'))
+        self.controller.wait()
+        self.assertEqual(job.state, jobs.FAILED)
+        self.assertIsInstance(job.error, IOError)
+        self.assertIn((jobs.FAILED, job), self.controller.get_events())
+        # failed job does not stop the queue
+        self.assertEqual(following.state, jobs.DONE)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+"""In this module you can find tests of quantifying and bit packing kernels"""
+import unittest
+
+import numpy
+
+import kernels
+
+
+def legacy_pack(values, bits):
+    """Packer used before kernels module, bit by bit from the least significant bit of every byte.
+       Rows are padded with zero bits to whole bytes, the original required whole bytes.
+    """
+    bit_matrix = (values[..., numpy.newaxis] >> numpy.arange(bits, dtype=numpy.uint8)) & 1
+    bit_matrix = bit_matrix.reshape(values.shape[0], -1)
+    padded = numpy.zeros((values.shape[0], (bit_matrix.shape[1] + 7) / 8 * 8), dtype=bit_matrix.dtype)
+    padded[:, :bit_matrix.shape[1]] = bit_matrix
+    return numpy.dot(padded.reshape(values.shape[0], -1, 8), 1 << numpy.arange(8)).astype(numpy.uint8)
+
+
+class KernelsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.random_state = numpy.random.RandomState(11)
+        # lengths of whole 64 bit words as well as lengths of partial words and bytes
+        self.lengths = [1, 7, 8, 9, 16, 32, 63, 64, 65] + list(self.random_state.randint(1, 300, 20))
+
+    def random_values(self, bits, length, rows=5):
+        return self.random_state.randint(0, pow(2, bits), (rows, length)).astype(numpy.uint8)
+
+    def test_round_trip(self):
+        for bits in xrange(1, 9):
+            for length in self.lengths:
+                values = self.random_values(bits, length)
+                data = kernels.pack(values, bits)
+                self.assertEqual(data.shape, (len(values), (length * bits + 7) / 8))
+                numpy.testing.assert_array_equal(kernels.unpack(data, bits, length), values)
+
+    def test_legacy_layout(self):
+        for bits in xrange(1, 9):
+            for length in self.lengths:
+                values = self.random_values(bits, length)
+                numpy.testing.assert_array_equal(kernels.pack(values, bits), legacy_pack(values, bits))
+
+    def test_padding_bits_are_zero(self):
+        for bits in xrange(1, 9):
+            values = numpy.full((1, 3), pow(2, bits) - 1, dtype=numpy.uint8)
+            data = kernels.pack(values, bits)
+            self.assertEqual(int(data[0, -1]) >> (3 * bits - 8 * (data.shape[1] - 1)), 0)
+
+    def test_quantify_range(self):
+        for bits in xrange(1, 9):
+            top = pow(2, bits) - 1
+            self.assertEqual(kernels.quantify(1.0, bits), top)
+            self.assertEqual(kernels.quantify(0.0, bits), 0)
+            numpy.testing.assert_array_equal(kernels.quantify([-0.5, 1.5], bits), [0, top])
+            values = self.random_state.rand(4, 64)
+            self.assertTrue(kernels.quantify(values, bits).max() <= top)
+
+    def test_dequantify(self):
+        for bits in xrange(1, 9):
+            top = pow(2, bits) - 1
+            numpy.testing.assert_array_equal(kernels.dequantify([0, top], bits), [0.0, 1.0])
+
+
+if __name__ == '__main__':
+    unittest.main()
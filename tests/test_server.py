@@ -0,0 +1,171 @@
+"""In this module you can find tests of HTTP service run on a free local port"""
+import httplib
+import logging
+import os
+import shutil
+import StringIO
+import tempfile
+import threading
+import time
+import unittest
+
+import numpy
+from PIL import Image
+
+import compression
+import neural_network
+import server
+
+
+class _LostResult(object):
+    """Result of a pool task, whose worker died, it is never ready"""
+
+    def ready(self):
+        return False
+
+
+class ServiceTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        logging.getLogger('logger').addHandler(logging.NullHandler())
+        cls.directory = tempfile.mkdtemp()
+        cls.network_path = os.path.join(cls.directory, 'network.mkm')
+        network = neural_network.NeuralNetwork(64, [32], 64, bottleneck=0)
+        network.init_weights()
+        neural_network.save(network, cls.network_path)
+        pixels = numpy.random.RandomState(24).randint(0, 256, (30, 40, 3)).astype(numpy.uint8)
+        picture = StringIO.StringIO()
+        Image.fromarray(pixels, 'RGB').save(picture, 'BMP')
+        cls.pixels, cls.picture = pixels, picture.getvalue()
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory)
+
+    def setUp(self):
+        self.service = server.Service({'net': self.network_path}, workers=1, timeout=2.0)
+        self.host, self.port = self.service.start('127.0.0.1', 0)
+
+    def tearDown(self):
+        self.service.stop()
+
+    def request(self, method, path, body=None):
+        connection = httplib.HTTPConnection(self.host, self.port, timeout=30)
+        try:
+            connection.request(method, path, body)
+            response = connection.getresponse()
+            return response.status, response.read()
+        finally:
+            connection.close()
+
+    def compress(self, bits):
+        path = os.path.join(self.directory, 'expected.zdp')
+        compression.compress_pixels(self.pixels, neural_network.load_encoder(self.network_path), path, bits)
+        with open(path, 'rb') as file:
+            return file.read()
+
+    def test_round_trip_matches_library(self):
+        status, compressed = self.request('POST', '/compress?bits=4', self.picture)
+        self.assertEqual(status, 200)
+        self.assertEqual(compressed, self.compress(4))
+        status, bitmap = self.request('POST', '/decompress', compressed)
+        self.assertEqual(status, 200)
+        self.assertEqual(Image.open(StringIO.StringIO(bitmap)).size, (40, 30))
+
+    def test_bad_requests(self):
+        self.assertEqual(self.request('POST', '/compress?bits=9', self.picture)[0], 400)
+        self.assertEqual(self.request('POST', '/compress?bits=x', self.picture)[0], 400)
+        self.assertEqual(self.request('POST', '/compress?network=other', self.picture)[0], 404)
+        self.assertEqual(self.request('POST', '/decompress', 'ZDP\x06damaged')[0], 400)
+        status, metrics = self.request('GET', '/metrics')
+        self.assertEqual(status, 200)
+        # requests rejected by options and by the worker are measured alike
+        self.assertIn('zdp_request_seconds_count{operation="compress"} 3', metrics)
+        self.assertIn('zdp_request_seconds_count{operation="decompress"} 1', metrics)
+        self.assertIn('zdp_responses_total{operation="compress",status="400"} 2', metrics)
+
+    def test_lost_batch_frees_worker(self):
+        pool = self.service.pool
+        apply_async = pool.apply_async
+
+        def lose(function, args, callback):
+            pool.apply_async = apply_async
+            return _LostResult()
+
+        pool.apply_async = lose
+        self.assertEqual(self.request('POST', '/compress?bits=4', self.picture)[0], 504)
+        deadline = time.time() + 10
+        while self.service.failed_batches == 0 and time.time() < deadline:
+            time.sleep(0.1)
+        self.assertEqual(self.service.failed_batches, 1)
+        status, compressed = self.request('POST', '/compress?bits=4', self.picture)
+        self.assertEqual(status, 200)
+        self.assertEqual(compressed, self.compress(4))
+        self.assertIn('zdp_failed_batches_total 1', self.request('GET', '/metrics')[1])
+
+    def block_dispatcher(self, service):
+        """Dispatcher of service stops in its next batch until returned release event is set, entered event is set then"""
+        pool = service.pool
+        apply_async = pool.apply_async
+        entered, release = threading.Event(), threading.Event()
+
+        def block(function, args, callback):
+            pool.apply_async = apply_async
+            entered.set()
+            release.wait()
+            return apply_async(function, args, callback=callback)
+
+        pool.apply_async = block
+        return entered, release
+
+    def handle_in_thread(self, service, responses):
+        thread = threading.Thread(target=lambda: responses.append(service.handle('compress', {'bits': '4'}, self.picture)[0]))
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def test_abandoned_request_is_not_run(self):
+        entered, release = self.block_dispatcher(self.service)
+        responses = []
+        thread = self.handle_in_thread(self.service, responses)
+        entered.wait()
+        # request queued behind the blocked batch times out and is left out when the worker is free
+        self.assertEqual(self.request('POST', '/compress?bits=4', self.picture)[0], 504)
+        release.set()
+        thread.join()
+        self.assertEqual(responses, [504])
+        deadline = time.time() + 10
+        while self.service.abandoned_requests == 0 and time.time() < deadline:
+            time.sleep(0.1)
+        self.assertEqual(self.service.abandoned_requests, 1)
+        self.assertEqual(self.request('POST', '/compress?bits=4', self.picture)[0], 200)
+        metrics = self.request('GET', '/metrics')[1]
+        self.assertIn('zdp_batched_requests_total 2', metrics)
+        self.assertIn('zdp_abandoned_requests_total 1', metrics)
+
+    def test_stop_with_full_queue(self):
+        service = server.Service({'net': self.network_path}, workers=1, queue_size=1, timeout=10.0)
+        entered, release = self.block_dispatcher(service)
+        running, queued = [], []
+        self.handle_in_thread(service, running)
+        entered.wait()
+        thread = self.handle_in_thread(service, queued)
+        deadline = time.time() + 10
+        while not service.queue.full() and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertTrue(service.queue.full())
+        stopping = threading.Thread(target=service.stop)
+        stopping.daemon = True
+        stopping.start()
+        # queued request is answered at once, running batch is finished before workers are stopped
+        thread.join(5)
+        self.assertEqual(queued, [503])
+        release.set()
+        stopping.join(10)
+        self.assertFalse(stopping.is_alive())
+        self.assertEqual(running, [200])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,179 @@
+"""In this module you can find streaming of training squares from many pictures, so that networks can be taught
+   on more pictures than fit in memory.
+   Training set is a picture, a directory of pictures or a glob pattern. Pictures are read and cut into random squares
+   in a background thread, see parallel.prefetch, and the squares pass through a shuffling reservoir of bounded size,
+   so that consecutive samples come from many pictures. A few whole pictures are held out and squares cut from them
+   measure the taught network. The same seed always gives the same squares.
+"""
+import errno
+import glob
+import logging
+import os
+
+import numpy
+from PIL import Image
+
+import colour
+import parallel
+
+
+logger = logging.getLogger('logger')
+
+IMAGE_EXTENSIONS = ('.bmp', '.png', '.jpg', '.jpeg', '.tif', '.tiff', '.gif')
+RESERVOIR_SIZE = 1 << 16
+SQUARES_PER_IMAGE = 256
+VALIDATION_SAMPLES = 4096
+# one of this many pictures is held out for validation, but never more than VALIDATION_IMAGES
+VALIDATION_SHARE = 20
+VALIDATION_IMAGES = 32
+PREFETCH_DEPTH = 4
+# colour spaces of training squares, networks coding YCbCr 4:2:0 images should be taught on luma and chroma planes
+COLOUR_RGB = 'rgb'
+COLOUR_YCBCR = 'ycbcr'
+COLOURS = (COLOUR_RGB, COLOUR_YCBCR)
+
+
+def get_image_paths(source):
+    """List pictures of training set given as picture path, directory or glob pattern"""
+    if os.path.isfile(source):
+        return [source]
+    if os.path.isdir(source):
+        names = sorted(name for name in os.listdir(source) if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS)
+        return [os.path.join(source, name) for name in names]
+    return sorted(path for path in glob.glob(source) if os.path.isfile(path) and os.path.splitext(path)[1].lower() in IMAGE_EXTENSIONS)
+
+
+def get_all_squares(pixels, size):
+    """Get strided view of every size x size square of the picture pixels,
+       indexed by top left corner row and column, RGB colour, row and column of the square
+    """
+    y, x, colours = pixels.shape
+    row_stride, column_stride, colour_stride = pixels.strides
+    return numpy.lib.stride_tricks.as_strided(pixels, (y - size + 1, x - size + 1, colours, size, size),
+                                              (row_stride, column_stride, colour_stride, row_stride, column_stride))
+
+
+def cut_squares(pixels, size, number, random_state):
+    """Cut number of random single colour size x size squares from (height, width, RGB colour) array of bytes,
+       returns them as rows of bytes
+    """
+    squares = get_all_squares(pixels, size)
+    ys = random_state.randint(0, squares.shape[0], number)
+    xs = random_state.randint(0, squares.shape[1], number)
+    return squares[ys, xs, random_state.randint(0, squares.shape[2], number)].reshape(number, size * size)
+
+
+def cut_ycbcr_squares(pixels, size, number, random_state):
+    """Cut number of random size x size squares of luma and subsampled chroma planes, see colour module,
+       from (height, width, RGB colour) array of bytes. Luma and chroma squares are cut in proportion 2:1,
+       as macroblocks code them, and returned as rows of bytes.
+    """
+    height, width = pixels.shape[0] / 2 * 2, pixels.shape[1] / 2 * 2
+    luma, chroma = colour.rgb_to_ycbcr(pixels[:height, :width] / 255.0)
+    luma_planes = numpy.clip(numpy.rint(luma * 255), 0, 255).astype(numpy.uint8)[:, :, numpy.newaxis]
+    chroma_planes = numpy.clip(numpy.rint(chroma * 255), 0, 255).astype(numpy.uint8).transpose(1, 2, 0)
+    luma_number = number - number / 3
+    return numpy.concatenate((cut_squares(luma_planes, size, luma_number, random_state),
+                              cut_squares(chroma_planes, size, number - luma_number, random_state)))
+
+
+class SquareStream(object):
+    """Endless stream of random squares of training pictures, which are read again and again in random order.
+       Squares of every read picture replace random squares of the reservoir, replaced squares are the samples.
+       Memory is bounded by the reservoir and squares of prefetched pictures.
+       Validation holds squares of held-out pictures or, when there is a single picture, of the training one.
+       Squares are single colours of RGB pictures or planes of YCbCr 4:2:0 pictures, see COLOURS.
+    """
+
+    def __init__(self, paths, block_size, seed=None, reservoir_size=RESERVOIR_SIZE, validation_samples=VALIDATION_SAMPLES,
+                 squares_per_image=SQUARES_PER_IMAGE, depth=PREFETCH_DEPTH, colour_space=COLOUR_RGB):
+        self.block_size = block_size
+        self.colour_space = colour_space
+        self.random_state = numpy.random.RandomState(seed)
+        paths = list(paths)
+        self.random_state.shuffle(paths)
+        held_out = min(max(len(paths) / VALIDATION_SHARE, 1), VALIDATION_IMAGES) if len(paths) > 1 else 0
+        self.validation_paths, self.paths = paths[:held_out], paths[held_out:]
+        # few pictures are read less often in more squares, so the reservoir is not filled by the same picture many times
+        self.squares_per_image = max(squares_per_image, reservoir_size / max(len(self.paths), 1))
+        self.reservoir = numpy.empty((reservoir_size, block_size * block_size), dtype=numpy.uint8)
+        self.filled = 0
+        self.pending = self.reservoir[:0]
+        self.validation = self._cut_validation(validation_samples)
+        self.fetched = self._fetch(depth)
+
+    def next_batch(self, number):
+        """Next number of samples as rows of <0;1> values"""
+        samples = numpy.empty((number, self.reservoir.shape[1]), dtype=numpy.uint8)
+        done = 0
+        while done < number:
+            if not len(self.pending):
+                self.pending = next(self.fetched)
+            if self.filled < len(self.reservoir):
+                incoming, self.pending = self.pending[:len(self.reservoir) - self.filled], self.pending[len(self.reservoir) - self.filled:]
+                self.reservoir[self.filled:self.filled + len(incoming)] = incoming
+                self.filled += len(incoming)
+                continue
+            incoming, self.pending = self.pending[:number - done], self.pending[number - done:]
+            slots = self.random_state.randint(0, len(self.reservoir), len(incoming))
+            samples[done:done + len(incoming)] = self.reservoir[slots]
+            self.reservoir[slots] = incoming
+            done += len(incoming)
+        return samples / 255.0
+
+    def close(self):
+        """Stop the background thread reading pictures"""
+        self.fetched.close()
+
+    def _fetch(self, depth):
+        """Yield squares of pictures in a new random order on every pass,
+           pictures which cannot be read are skipped and left out of the following passes
+        """
+        while True:
+            order = self.random_state.permutation(len(self.paths))
+            seeds = self.random_state.randint(0, 1 << 31, len(order))
+            skipped = set()
+            fetched = parallel.prefetch(self._read_squares, [(self.paths[i], seed) for i, seed in zip(order, seeds)], depth)
+            try:
+                for (path, seed), squares, error in fetched:
+                    if error is not None:
+                        logger.warning('Training image %s skipped: %s' % (path, error))
+                        skipped.add(path)
+                        continue
+                    yield squares
+            finally:
+                fetched.close()
+            self.paths = [path for path in self.paths if path not in skipped]
+            if not self.paths:
+                raise IOError(errno.ENOENT, 'None of training images can be read')
+
+    def _read_squares(self, task):
+        path, seed = task
+        return self._cut(path, self.squares_per_image, numpy.random.RandomState(seed))
+
+    def _cut(self, path, number, random_state):
+        pixels = numpy.array(Image.open(path).convert('RGB'), dtype=numpy.uint8)
+        # chroma planes are half of the picture
+        side = self.block_size * (2 if self.colour_space == COLOUR_YCBCR else 1)
+        if pixels.shape[0] < side or pixels.shape[1] < side:
+            raise ValueError('picture is smaller than %d x %d pixels' % (side, side))
+        if self.colour_space == COLOUR_YCBCR:
+            return cut_ycbcr_squares(pixels, self.block_size, number, random_state)
+        return cut_squares(pixels, self.block_size, number, random_state)
+
+    def _cut_validation(self, number):
+        """Cut validation squares evenly from held-out pictures, or from the training picture, as rows of <0;1> values"""
+        paths = self.validation_paths or self.paths
+        if not number or not paths:
+            return numpy.empty((0, self.reservoir.shape[1]))
+        if not self.validation_paths:
+            logger.info('Single training image, validation squares are cut from it')
+        squares = []
+        for i, path in enumerate(paths):
+            try:
+                squares.append(self._cut(path, number / len(paths) + (i < number % len(paths)), self.random_state))
+            except (IOError, ValueError) as exc:
+                logger.warning('Validation image %s skipped: %s' % (path, exc))
+        if not squares:
+            return numpy.empty((0, self.reservoir.shape[1]))
+        return numpy.concatenate(squares) / 255.0